@@ -46,14 +46,23 @@ from traitlets.config import Application
 
 from .base import VersionHandler
 from .build import BuildExecutor, KubernetesBuildExecutor, KubernetesCleaner
+from .build_logs import BuildLogStore
+from .build_queue import BuildQueue
+from .build_registry import BuildRegistry
+from .build_sessions import BuildSessionRegistry
 from .builder import BuildHandler
 from .events import EventLog
+from .handlers.build_logs import BuildLogsHandler
 from .handlers.repoproviders import RepoProvidersHandlers
+from .handlers.webhooks import GitHubWebhookHandler, GitLabWebhookHandler
 from .health import HealthHandler, KubernetesHealthHandler
+from .informer import PodCache
 from .launcher import Launcher
 from .log import log_request
 from .main import LegacyRedirectHandler, RepoLaunchUIHandler, UIHandler, UserRedirectHandler
 from .metrics import MetricsHandler
+from .node_images import NodeImageIndex
+from .prepull import ImagePrePuller
 from .quota import KubernetesLaunchQuota, LaunchQuota
 from .ratelimit import RateLimiter
 from .registry import DockerRegistry
@@ -70,6 +79,8 @@ from .repoproviders import (
     ZenodoProvider,
 )
 from .utils import ByteSpecification, url_path_join
+from .warm_pool import WarmPool
+from .warmer import ImageWarmer
 
 HERE = os.path.dirname(os.path.abspath(__file__))
 
@@ -654,7 +665,12 @@ class BinderHub(Application):
         return proposal.value
 
     concurrent_build_limit = Integer(
-        32, config=True, help="""The number of concurrent builds to allow."""
+        32,
+        config=True,
+        help="""The number of concurrent builds to allow.
+
+        Further builds wait in a queue, see BuildQueue.per_repo_limit.
+        """,
     )
     executor_threads = Integer(
         5,
@@ -666,6 +682,22 @@ class BinderHub(Application):
         This executor is not used for long-running tasks (e.g. builds).
         """,
     )
+    use_pod_informers = Bool(
+        True,
+        config=True,
+        help="""Keep track of build and user pods with shared watches.
+
+        When enabled, build pods are followed with a single watch on all build pods
+        (with the KubernetesBuildExecutor),
+        launch quotas are checked against a watched index of user pods
+        (with the KubernetesLaunchQuota),
+        and the health check, build scheduling and build cleanup read pods
+        from the same watches.
+
+        When disabled, every build watches its own pod in a thread of the build pool,
+        and every consumer lists pods when it needs them.
+        """,
+    )
     build_cleanup_interval = Integer(
         60,
         config=True,
@@ -709,6 +741,31 @@ class BinderHub(Application):
         """,
     )
 
+    github_webhook_secret = Unicode(
+        "",
+        config=True,
+        help="""
+        Secret of the GitHub push webhook at /webhooks/github.
+
+        Pushes to GitHub repos with the webhook start building
+        the image of the pushed commit, so it is ready before anyone launches it.
+        Only repos matching GitHubRepoProvider.prebuild_specs are built.
+        The webhook is disabled if empty.
+        """,
+    )
+
+    gitlab_webhook_secret = Unicode(
+        "",
+        config=True,
+        help="""
+        Secret token of the GitLab push webhook at /webhooks/gitlab.
+
+        Like github_webhook_secret, for GitLab repos.
+        Only repos matching GitLabRepoProvider.prebuild_specs are built.
+        The webhook is disabled if empty.
+        """,
+    )
+
     build_token_expires_seconds = Integer(
         300,
         config=True,
@@ -903,8 +960,28 @@ class BinderHub(Application):
                 kubernetes.client.CoreV1Api()
             )
 
-        # times 2 for log + build threads
-        self.build_pool = ThreadPoolExecutor(self.concurrent_build_limit * 2)
+        # shared watches on pods, queried by label
+        self.pod_cache = None
+        self.build_pod_informer = None
+        if self.builder_required and self.use_pod_informers:
+            self.pod_cache = PodCache(parent=self, api=self.kube_client)
+            if issubclass(self.build_class, KubernetesBuildExecutor):
+                build_namespace = self.build_class(parent=self).namespace
+                # one thread watching all build pods
+                self.build_pod_informer = self.pod_cache.get_informer(
+                    build_namespace, "component=binderhub-build"
+                )
+                # user pods in the build namespace, for the health check
+                self.pod_cache.get_informer(
+                    build_namespace, "app=jupyterhub,component=singleuser-server"
+                )
+
+        if self.build_pod_informer is not None:
+            # one log thread per build
+            self.build_pool = ThreadPoolExecutor(self.concurrent_build_limit)
+        else:
+            # times 2 for log + build threads
+            self.build_pool = ThreadPoolExecutor(self.concurrent_build_limit * 2)
         # default executor for asyncifying blocking calls (e.g. to kubernetes, docker).
         # this should not be used for long-running requests
         self.executor = ThreadPoolExecutor(self.executor_threads)
@@ -941,6 +1018,12 @@ class BinderHub(Application):
             create_user=not self.auth_enabled,
         )
 
+        # images present on each node, to launch on nodes which have the image
+        self.node_image_index = None
+        if self.builder_required and self.launcher.prefer_nodes_with_image:
+            self.node_image_index = NodeImageIndex(parent=self, kube=self.kube_client)
+            self.launcher.node_image_index = self.node_image_index
+
         self.event_log = EventLog(parent=self)
 
         for schema_file in glob(os.path.join(HERE, "event-schemas", "*.json")):
@@ -949,9 +1032,50 @@ class BinderHub(Application):
 
         launch_quota = self.launch_quota_class(parent=self, executor=self.executor)
 
+        if self.pod_cache is not None and isinstance(
+            launch_quota, KubernetesLaunchQuota
+        ):
+            # count user pods with a watch instead of listing them on every launch
+            launch_quota.pod_informer = self.pod_cache.get_informer(
+                launch_quota.namespace, "app=jupyterhub,component=singleuser-server"
+            )
+
+        # forgets expired limits in the background, see start()
+        self.rate_limiter = RateLimiter(parent=self)
+
+        # idle servers for launches to claim, held by temporary users
+        self.warm_pool = WarmPool(
+            parent=self, launcher=self.launcher, launch_quota=launch_quota
+        )
+        if self.warm_pool.enabled and self.auth_enabled:
+            self.log.warning("WarmPool is only used without authentication")
+
+        self.image_prepuller = ImagePrePuller(parent=self)
+        if self.builder_required:
+            self.image_prepuller.kube = self.kube_client
+
+        # builds in progress, shared by all requests for the same image
+        self.build_log_store = BuildLogStore(parent=self)
+        self.build_registry = BuildRegistry(
+            parent=self,
+            build_queue=BuildQueue(
+                parent=self, concurrent_build_limit=self.concurrent_build_limit
+            ),
+            log_store=self.build_log_store,
+        )
+
         # Construct a Builder so that we can extract parameters such as the
         # configuration or the version string to pass to /version and /health handlers
         example_builder = self.build_class(parent=self)
+        if (
+            self.pod_cache is not None
+            and isinstance(example_builder, KubernetesBuildExecutor)
+            and example_builder.sticky_builds
+        ):
+            # image builder pods, for scheduling sticky builds
+            self.pod_cache.get_informer(
+                example_builder.namespace, "component=image-builder,app=binder"
+            )
         self.tornado_settings.update(
             {
                 "log_function": log_request,
@@ -962,16 +1086,27 @@ class BinderHub(Application):
                 "launcher": self.launcher,
                 "ban_networks": self.ban_networks,
                 "build_pool": self.build_pool,
+                "build_registry": self.build_registry,
+                "build_sessions": BuildSessionRegistry(parent=self),
+                "image_prepuller": self.image_prepuller,
+                "warm_pool": (
+                    self.warm_pool
+                    if self.warm_pool.enabled and not self.auth_enabled
+                    else None
+                ),
+                "pod_cache": self.pod_cache,
                 "build_token_check_origin": self.build_token_check_origin,
                 "build_token_secret": self.build_token_secret,
                 "build_token_expires_seconds": self.build_token_expires_seconds,
+                "github_webhook_secret": self.github_webhook_secret,
+                "gitlab_webhook_secret": self.gitlab_webhook_secret,
                 "example_builder": example_builder,
                 "pod_quota": self.pod_quota,
                 "per_repo_quota": self.per_repo_quota,
                 "per_repo_quota_higher": self.per_repo_quota_higher,
                 "repo_providers": self.repo_providers,
                 "launch_quota": launch_quota,
-                "rate_limiter": RateLimiter(parent=self),
+                "rate_limiter": self.rate_limiter,
                 "use_registry": self.use_registry,
                 "build_class": self.build_class,
                 "registry": registry,
@@ -997,6 +1132,8 @@ class BinderHub(Application):
             }
         )
         self.tornado_settings["cookie_secret"] = secrets.token_bytes(32)
+        # keeps the images of popular specs built
+        self.image_warmer = ImageWarmer(parent=self, settings=self.tornado_settings)
         if self.cors_allow_origin:
             self.tornado_settings.setdefault("headers", {})[
                 "Access-Control-Allow-Origin"
@@ -1009,6 +1146,18 @@ class BinderHub(Application):
             (r"/health", self.health_handler_class, {"hub_url": self.hub_url_local}),
             (r"/api/repoproviders", RepoProvidersHandlers),
         ]
+        if self.build_log_store.path:
+            handlers.append(
+                (
+                    r"/build-logs/(.+)",
+                    BuildLogsHandler,
+                    {"path": self.build_log_store.path},
+                )
+            )
+        if self.github_webhook_secret:
+            handlers.append((r"/webhooks/github", GitHubWebhookHandler))
+        if self.gitlab_webhook_secret:
+            handlers.append((r"/webhooks/gitlab", GitLabWebhookHandler))
         if not self.enable_api_only_mode:
             # In API only mode the endpoints in the list below
             # are not registered since they are primarily about providing UI
@@ -1118,6 +1267,8 @@ class BinderHub(Application):
 
     def stop(self):
         self.http_server.stop()
+        if self.pod_cache is not None:
+            self.pod_cache.stop()
         self.build_pool.shutdown()
 
     async def watch_build_pods(self):
@@ -1129,11 +1280,22 @@ class BinderHub(Application):
     async def watch_builders(self):
         """
         Watch builders, run a cleanup function every build_cleanup_interval
+
+        Cleaners following a pod informer delete build pods as they stop instead.
         """
         while self.build_cleaner_class:
             cleaner = self.build_cleaner_class(
                 kube=self.kube_client, namespace=self.build_namespace, parent=self
             )
+            if getattr(cleaner, "pod_informer", None) is not None:
+                # clean up what stopped while we weren't running,
+                # then follow the watch
+                try:
+                    await asyncio.wrap_future(self.executor.submit(cleaner.cleanup))
+                except Exception:
+                    app_log.exception("Failed to cleanup builders")
+                cleaner.start()
+                return
             try:
                 await asyncio.wrap_future(self.executor.submit(cleaner.cleanup))
             except Exception:
@@ -1147,8 +1309,19 @@ class BinderHub(Application):
             xheaders=True,
         )
         self.http_server.listen(self.port)
+        if self.pod_cache is not None:
+            self.pod_cache.start()
         if self.builder_required:
             asyncio.ensure_future(self.watch_builders())
+            if self.image_warmer.enabled:
+                asyncio.ensure_future(self.image_warmer.run())
+            if self.image_prepuller.enabled:
+                asyncio.ensure_future(self.image_prepuller.run())
+            if self.node_image_index is not None:
+                asyncio.ensure_future(self.node_image_index.run())
+        if self.tornado_settings["warm_pool"] is not None:
+            asyncio.ensure_future(self.warm_pool.run())
+        asyncio.ensure_future(self.rate_limiter.run())
         if run_loop:
             tornado.ioloop.IOLoop.current().start()
 
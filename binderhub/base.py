@@ -103,31 +103,46 @@ class BaseHandler(HubOAuthenticated, web.RequestHandler):
             # no limit enabled
             return
 
+        # rate limit is applied per-ip, unless authenticated
+        request_ip = self.request.remote_ip
         if self.settings["auth_enabled"] and self.current_user:
-            # authenticated, no limit
-            # TODO: separate authenticated limit
-            return
-
-        if self._have_build_token:
-            # build token defined, no limit
-            # TODO: use different limit for verified builds
-            return
+            # authenticated, separate limit per user
+            if rate_limiter.authenticated_limit is None:
+                return
+            key = ("user", self.current_user["name"])
+            limit_value = rate_limiter.authenticated_limit
+        elif self._have_build_token:
+            # build token defined, separate limit for verified builds
+            if rate_limiter.build_token_limit is None:
+                return
+            key = ("build-token", request_ip)
+            limit_value = rate_limiter.build_token_limit
+        else:
+            key = request_ip
+            limit_value = rate_limiter.limit
 
-        # rate limit is applied per-ip
-        request_ip = self.request.remote_ip
         try:
-            limit = rate_limiter.increment(request_ip)
-        except RateLimitExceeded:
+            limit = rate_limiter.increment(key, limit=limit_value)
+        except RateLimitExceeded as e:
+            self._retry_after = e.retry_after
             raise web.HTTPError(
                 429,
-                f"Rate limit exceeded. Try again in {rate_limiter.period_seconds} seconds.",
+                f"Rate limit exceeded. Try again in {e.retry_after} seconds.",
             )
         else:
-            app_log.debug(f"Rate limit for {request_ip}: {limit}")
+            app_log.debug(f"Rate limit for {key}: {limit}")
 
         self.set_header("x-ratelimit-remaining", str(limit["remaining"]))
         self.set_header("x-ratelimit-reset", str(limit["reset"]))
-        self.set_header("x-ratelimit-limit", str(rate_limiter.limit))
+        self.set_header("x-ratelimit-limit", str(limit_value))
+
+    # seconds after which a rate limited request may be retried
+    _retry_after = None
+
+    def write_error(self, status_code, **kwargs):
+        if status_code == 429 and self._retry_after is not None:
+            self.set_header("Retry-After", str(self._retry_after))
+        super().write_error(status_code, **kwargs)
 
     def get_current_user(self):
         if not self.settings["auth_enabled"]:
@@ -99,6 +99,14 @@ class BinderSpawnerMixin(Configurable):
                 raise web.HTTPError(400, "image required")
         if "image" in self.user_options:
             self.image = self.user_options["image"]
+        if "node_affinity_preferred" in self.user_options and self.has_trait(
+            "node_affinity_preferred"
+        ):
+            # prefer nodes which already have the image, see Launcher.prefer_nodes_with_image
+            self.node_affinity_preferred = (
+                list(self.node_affinity_preferred)
+                + self.user_options["node_affinity_preferred"]
+            )
         return super().start()
 
     def get_env(self):
@@ -2,25 +2,38 @@
 Contains build of a docker image from a git repository.
 """
 
+import asyncio
 import datetime
 import json
 import os
 import threading
+import time
 import warnings
 from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
 from enum import Enum
-from typing import Union
+from typing import Optional, Union
 from urllib.parse import urlparse
 
 import kubernetes.config
 from kubernetes import client, watch
 from tornado.ioloop import IOLoop
 from tornado.log import app_log
-from traitlets import Any, Bool, Dict, Integer, List, Unicode, default
+from traitlets import Any, Bool, Dict, Float, Integer, List, Unicode, default
 from traitlets.config import LoggingConfigurable
 from urllib3.exceptions import ReadTimeoutError
 
-from .utils import KUBE_REQUEST_TIMEOUT, ByteSpecification, rendezvous_rank
+from .utils import KUBE_REQUEST_TIMEOUT, ByteSpecification, bounded_load_rank
+
+# waiting reasons of the builder container that won't resolve themselves
+_FATAL_WAITING_REASONS = {"InvalidImageName", "ErrImageNeverPull"}
+# waiting reasons that fail the build if they last for `stuck_pod_timeout`
+_STUCK_WAITING_REASONS = {
+    "ErrImagePull",
+    "ImagePullBackOff",
+    "CrashLoopBackOff",
+    "CreateContainerConfigError",
+}
 
 
 class ProgressEvent:
@@ -49,9 +62,55 @@ class ProgressEvent:
         FAILED = "failed"
         UNKNOWN = "unknown"
 
-    def __init__(self, kind: Kind, payload: Union[str, BuildStatus]):
+    def __init__(
+        self,
+        kind: Kind,
+        payload: Union[str, BuildStatus],
+        phase: Optional[str] = None,
+    ):
         self.kind = kind
         self.payload = payload
+        # phase of a log message, parsed from the payload when first needed
+        self._phase = phase
+
+    @property
+    def phase(self):
+        """The phase of the build this event reports, if any"""
+        if self._phase is None:
+            if self.kind == ProgressEvent.Kind.BUILD_STATUS_CHANGE:
+                self._phase = self.payload.value
+            else:
+                try:
+                    self._phase = json.loads(self.payload).get("phase", "")
+                except (ValueError, AttributeError):
+                    self._phase = ""
+        return self._phase
+
+    @classmethod
+    def from_log_line(cls, line: str):
+        """Create a LOG_MESSAGE event from a line of repo2docker's JSON log
+
+        The line is parsed only once, here,
+        to check that it is JSON and to get its phase.
+        Lines that aren't JSON become messages with phase 'unknown'.
+        """
+        try:
+            phase = json.loads(line).get("phase", "")
+        except (ValueError, AttributeError):
+            # log event wasn't JSON.
+            # use the line itself as the message with unknown phase.
+            # We don't know what the right phase is, use 'unknown'.
+            # If it was a fatal error, presumably a 'failure'
+            # message will arrive shortly.
+            app_log.error("log event not json: %r", line)
+            phase = "unknown"
+            line = json.dumps(
+                {
+                    "phase": phase,
+                    "message": line,
+                }
+            )
+        return cls(cls.Kind.LOG_MESSAGE, line, phase=phase)
 
 
 class BuildExecutor(LoggingConfigurable):
@@ -141,9 +200,31 @@ class BuildExecutor(LoggingConfigurable):
         config=True,
     )
 
+    cache_from_previous = Bool(
+        False,
+        help="""
+        Use the most recently built image of the same repo as a cache source.
+
+        Passes `--cache-from` to repo2docker,
+        so layers that didn't change since the previous ref can be reused
+        even on a builder without the previous image.
+        Requires a registry, and a builder able to use the pushed image as cache,
+        e.g. BuildKit with inline cache metadata.
+        """,
+        config=True,
+    )
+
+    cache_from = List(
+        Unicode(),
+        help="Images to use as cache sources for this build",
+    )
+
     def __init__(self, **kwargs):
         super().__init__(**kwargs)
         self.main_loop = IOLoop.current()
+        # events waiting to be put in the queue on the main thread
+        self._pending_events = []
+        self._pending_lock = threading.Lock()
 
     stop_event = Any()
 
@@ -165,6 +246,9 @@ class BuildExecutor(LoggingConfigurable):
         if self.appendix:
             r2d_options.extend(["--appendix", self.appendix])
 
+        for image in self.cache_from:
+            r2d_options.append(f"--cache-from={image}")
+
         if self.push_secret:
             r2d_options.append("--push")
 
@@ -189,7 +273,27 @@ class BuildExecutor(LoggingConfigurable):
         """
         Put current progress info into the queue on the main thread
         """
-        self.main_loop.add_callback(self.q.put, ProgressEvent(kind, payload))
+        self.put_event(ProgressEvent(kind, payload))
+
+    def put_event(self, event: ProgressEvent):
+        """
+        Put a ProgressEvent into the queue on the main thread
+
+        Events put while the main thread is busy are handed over together,
+        with a single callback.
+        """
+        with self._pending_lock:
+            self._pending_events.append(event)
+            first = len(self._pending_events) == 1
+        if first:
+            self.main_loop.add_callback(self._put_pending_events)
+
+    def _put_pending_events(self):
+        with self._pending_lock:
+            events = self._pending_events
+            self._pending_events = []
+        for event in events:
+            self.q.put_nowait(event)
 
     def submit(self):
         """
@@ -221,6 +325,15 @@ class BuildExecutor(LoggingConfigurable):
         """
         self.stop_event.set()
 
+    def on_finished(self, callback):
+        """
+        Call `callback()` on the main thread once the build has stopped running
+
+        Unlike progress events, this works after `stop()`,
+        for callers that hold resources while the build runs.
+        """
+        self.main_loop.add_callback(callback)
+
 
 class KubernetesBuildExecutor(BuildExecutor):
     """Represents a build of a git repository into a docker image.
@@ -386,8 +499,157 @@ class KubernetesBuildExecutor(BuildExecutor):
         config=True,
     )
 
+    sticky_builds_epsilon = Float(
+        0.25,
+        help=(
+            "How much more than their share of the builds nodes may run with sticky builds. "
+            "A repo's builds go to the next node in its ranking "
+            "when its preferred node runs more than (1 + epsilon) times the average number of builds. "
+            "Lower values spread builds more evenly, higher values keep more builds on their cached node."
+        ),
+        config=True,
+    )
+
+    pod_list_max_age = Integer(
+        60,
+        help=(
+            "Time (in seconds) for which to reuse a listing of image builder and build pods "
+            "for sticky builds, when they are not watched by a pod cache. "
+            "Builds placed since the listing was made are counted on the node they were sent to."
+        ),
+        config=True,
+    )
+
+    pod_informer = Any(
+        None,
+        allow_none=True,
+        help="""
+        PodInformer watching all build pods.
+
+        If set, build pods are followed through the shared informer
+        instead of a watch per build.
+        Defaults to the `build_pod_informer` of the parent BinderHub application, if any.
+        """,
+    )
+
+    @default("pod_informer")
+    def _default_pod_informer(self):
+        return getattr(self.parent, "build_pod_informer", None)
+
+    pod_cache = Any(
+        None,
+        allow_none=True,
+        help="""
+        PodCache to look up image builder pods in, instead of listing them.
+
+        Defaults to the `pod_cache` of the parent BinderHub application, if any.
+        """,
+    )
+
+    @default("pod_cache")
+    def _default_pod_cache(self):
+        return getattr(self.parent, "pod_cache", None)
+
+    stuck_pod_timeout = Integer(
+        300,
+        help=(
+            "Time (in seconds) after which a build pod that can't be scheduled, "
+            "or whose builder image can't be pulled, fails the build and is deleted. "
+            "Pods with an invalid builder image fail right away. "
+            "0 waits for stuck build pods until they are cleaned up."
+        ),
+        config=True,
+    )
+
+    finished_poll_interval = Integer(
+        10,
+        help=(
+            "Time (in seconds) between checks of whether a build pod nobody follows anymore "
+            "has stopped, when build pods are not watched by a pod informer."
+        ),
+        config=True,
+    )
+
     _component_label = Unicode("binderhub-build")
 
+    # the node chosen for a sticky build, if any
+    sticky_node = None
+
+    # time.monotonic() since which the build pod has been stuck, if it is
+    _stuck_since = None
+    _stuck_timer = None
+
+    # (namespace, label_selector) -> (time listed, pods),
+    # shared by all builds when pods are not watched
+    _pod_lists = {}
+    _pod_lists_lock = threading.Lock()
+    # (time placed, namespace, node name) of the sticky builds placed recently
+    _placements = []
+
+    def _list_pods_since(self, label_selector):
+        """List pods from the pod cache, or a recent listing
+
+        Returns the time.monotonic() of the listing and the pods.
+        """
+        if self.pod_cache is not None:
+            pods = self.pod_cache.list_pods(self.namespace, label_selector)
+            if pods is not None:
+                return time.monotonic(), pods
+        key = (self.namespace, label_selector)
+        with self._pod_lists_lock:
+            listed, pods = self._pod_lists.get(key, (0, None))
+            if pods is not None and time.monotonic() - listed < self.pod_list_max_age:
+                return listed, pods
+            listed = time.monotonic()
+            resp = self.api.list_namespaced_pod(
+                self.namespace,
+                label_selector=label_selector,
+                _request_timeout=KUBE_REQUEST_TIMEOUT,
+                _preload_content=False,
+            )
+            pods = json.loads(resp.read())["items"]
+            self._pod_lists[key] = (listed, pods)
+        return listed, pods
+
+    def _list_image_builder_pods(self):
+        """List the image builder (docker-in-docker) pods"""
+        return self._list_pods_since("component=image-builder,app=binder")[1]
+
+    def _builds_per_node(self):
+        """Count the builds in progress on (or assigned to) each node
+
+        Builds placed since the pods were listed are counted
+        on the node they were sent to.
+        """
+        builds = defaultdict(int)
+        listed, pods = self._list_pods_since(f"component={self._component_label}")
+        for pod in pods:
+            if pod.get("status", {}).get("phase") in {"Succeeded", "Failed"}:
+                continue
+            node_name = pod.get("spec", {}).get("nodeName")
+            if not node_name:
+                # not scheduled yet, count it on the node it was sent to
+                annotations = pod.get("metadata", {}).get("annotations") or {}
+                node_name = annotations.get("binder-sticky-node")
+            if node_name:
+                builds[node_name] += 1
+        with self._pod_lists_lock:
+            for placed, namespace, node_name in self._placements:
+                if placed > listed and namespace == self.namespace:
+                    builds[node_name] += 1
+        return builds
+
+    def _record_placement(self, node_name):
+        """Remember the node a build was sent to, until listings include it"""
+        now = time.monotonic()
+        with self._pod_lists_lock:
+            self._placements[:] = [
+                placement
+                for placement in self._placements
+                if now - placement[0] < self.pod_list_max_age
+            ]
+            self._placements.append((now, self.namespace, node_name))
+
     def get_affinity(self):
         """Determine the affinity term for the build pod.
 
@@ -400,21 +662,24 @@ class KubernetesBuildExecutor(BuildExecutor):
         In a setup with docker-in-docker enabled pods for a particular
         repository prefer to schedule on the same node in order to reuse the
         docker layer cache of previous builds.
+        Repositories are spread over the nodes with rendezvous hashing,
+        moving on to the next node of a repository's ranking
+        when a node runs too many builds (see `sticky_builds_epsilon`).
         """
-        resp = self.api.list_namespaced_pod(
-            self.namespace,
-            label_selector="component=image-builder,app=binder",
-            _request_timeout=KUBE_REQUEST_TIMEOUT,
-            _preload_content=False,
-        )
-        image_builder_pods = json.loads(resp.read())
+        image_builder_pods = []
+        if self.sticky_builds:
+            image_builder_pods = self._list_image_builder_pods()
 
         if self.sticky_builds and image_builder_pods:
-            node_names = [
-                pod["spec"]["nodeName"] for pod in image_builder_pods["items"]
-            ]
-            ranked_nodes = rendezvous_rank(node_names, self.repo_url)
-            best_node_name = ranked_nodes[0]
+            node_names = [pod["spec"]["nodeName"] for pod in image_builder_pods]
+            ranked_nodes = bounded_load_rank(
+                node_names,
+                self.repo_url,
+                self._builds_per_node(),
+                epsilon=self.sticky_builds_epsilon,
+            )
+            best_node_name = self.sticky_node = ranked_nodes[0]
+            self._record_placement(best_node_name)
 
             affinity = client.V1Affinity(
                 node_affinity=client.V1NodeAffinity(
@@ -506,6 +771,152 @@ class KubernetesBuildExecutor(BuildExecutor):
 
         return image_pull_secrets
 
+    def _report_phase(self, phase):
+        """Report the phase of the build pod as progress"""
+        # Account for all the phases kubernetes pods can be in
+        # Pending, Running, Succeeded, Failed, Unknown
+        # https://kubernetes.io/docs/concepts/workloads/pods/pod-lifecycle/#pod-phase
+        if phase == "Pending":
+            self.progress(
+                ProgressEvent.Kind.BUILD_STATUS_CHANGE,
+                ProgressEvent.BuildStatus.PENDING,
+            )
+        elif phase == "Running":
+            self.progress(
+                ProgressEvent.Kind.BUILD_STATUS_CHANGE,
+                ProgressEvent.BuildStatus.RUNNING,
+            )
+        elif phase == "Succeeded":
+            # Do nothing! We will clean this up, and send a 'Completed' progress event
+            # when the pod has been deleted
+            pass
+        elif phase == "Failed":
+            self.progress(
+                ProgressEvent.Kind.BUILD_STATUS_CHANGE,
+                ProgressEvent.BuildStatus.FAILED,
+            )
+        elif phase == "Unknown":
+            self.progress(
+                ProgressEvent.Kind.BUILD_STATUS_CHANGE,
+                ProgressEvent.BuildStatus.UNKNOWN,
+            )
+        else:
+            # This shouldn't happen, unless k8s introduces new Phase types
+            warnings.warn(f"Found unknown phase {phase} when building {self.name}")
+
+    def _report_deleted(self, phase):
+        """Report the outcome of the build when the build pod is deleted"""
+        app_log.debug("Pod %s was deleted with phase %s", self.name, phase)
+        if phase == "Succeeded":
+            self.progress(
+                ProgressEvent.Kind.BUILD_STATUS_CHANGE,
+                ProgressEvent.BuildStatus.BUILT,
+            )
+        else:
+            self.progress(
+                ProgressEvent.Kind.BUILD_STATUS_CHANGE,
+                ProgressEvent.BuildStatus.FAILED,
+            )
+
+    @staticmethod
+    def _stuck_state(pod):
+        """(reason, message) if the build pod is stuck before building, else None
+
+        `pod` is a pod dict, as returned by the API.
+        """
+        status = pod.get("status") or {}
+        for container_status in status.get("containerStatuses") or []:
+            waiting = (container_status.get("state") or {}).get("waiting") or {}
+            reason = waiting.get("reason")
+            if reason in _FATAL_WAITING_REASONS or reason in _STUCK_WAITING_REASONS:
+                return reason, waiting.get("message", "")
+        for condition in status.get("conditions") or []:
+            if (
+                condition.get("type") == "PodScheduled"
+                and condition.get("status") == "False"
+                and condition.get("reason") == "Unschedulable"
+            ):
+                return "Unschedulable", condition.get("message", "")
+        return None
+
+    def _check_stuck(self, pod):
+        """(reason, message) if the build pod should be given up on, else None
+
+        Keeps track of how long the pod has been stuck.
+        """
+        if not self.stuck_pod_timeout:
+            return None
+        stuck = self._stuck_state(pod)
+        if stuck is None:
+            self._stuck_since = None
+            return None
+        now = time.monotonic()
+        if self._stuck_since is None:
+            self._stuck_since = now
+        if (
+            stuck[0] in _FATAL_WAITING_REASONS
+            or now - self._stuck_since >= self.stuck_pod_timeout
+        ):
+            return stuck
+        return None
+
+    def _fail_stuck(self, reason, message):
+        """Fail the build of a stuck pod
+
+        The caller deletes the pod.
+        """
+        app_log.warning(
+            "Build pod %s is stuck in %s, giving up: %s", self.name, reason, message
+        )
+        self.stop_event.set()
+        self.progress(
+            ProgressEvent.Kind.LOG_MESSAGE,
+            json.dumps(
+                {
+                    "phase": ProgressEvent.BuildStatus.FAILED.value,
+                    "message": f"Build pod could not start ({reason}): {message}\n",
+                }
+            ),
+        )
+        self.progress(
+            ProgressEvent.Kind.BUILD_STATUS_CHANGE,
+            ProgressEvent.BuildStatus.FAILED,
+        )
+
+    def _recheck_stuck(self):
+        """Check again on a stuck pod, which may not change anymore"""
+        self._stuck_timer = None
+        pod = self.pod_informer.pods.get(self.name)
+        if pod is not None and not self.stop_event.is_set():
+            self._handle_pod_event("MODIFIED", pod)
+
+    def _handle_pod_event(self, event_type, pod):
+        """Handle a change to the build pod, reported by the pod informer
+
+        Called on the main event loop.
+        """
+        phase = pod.get("status", {}).get("phase")
+        if event_type == "DELETED":
+            self.pod_informer.remove_handler(self.name, self._handle_pod_event)
+            self._report_deleted(phase)
+            return
+        if self.stop_event.is_set():
+            return
+        stuck = self._check_stuck(pod)
+        if stuck:
+            self.pod_informer.remove_handler(self.name, self._handle_pod_event)
+            self._fail_stuck(*stuck)
+            self.main_loop.run_in_executor(None, self.cleanup)
+            return
+        if self._stuck_since is not None and self._stuck_timer is None:
+            deadline = self._stuck_since + self.stuck_pod_timeout
+            self._stuck_timer = self.main_loop.call_later(
+                deadline - time.monotonic(), self._recheck_stuck
+            )
+        self._report_phase(phase)
+        if phase in ("Succeeded", "Failed"):
+            self.main_loop.run_in_executor(None, self.cleanup)
+
     def submit(self):
         """
         Submit a build pod to create the image for the repository.
@@ -536,6 +947,12 @@ class KubernetesBuildExecutor(BuildExecutor):
             volumes.append(client.V1Volume(name='repo', host_path=client.V1HostPathVolumeSource(path=self.repo_url, type='Directory')))
             volume_mounts.append(client.V1VolumeMount(name='repo', mount_path=self.repo_url, read_only=True))
 
+        affinity = self.get_affinity()
+        annotations = {"binder-repo": self.repo_url}
+        if self.sticky_node:
+            # counts towards the node's builds until the pod is scheduled
+            annotations["binder-sticky-node"] = self.sticky_node
+
         self.pod = client.V1Pod(
             metadata=client.V1ObjectMeta(
                 name=self.name,
@@ -543,9 +960,7 @@ class KubernetesBuildExecutor(BuildExecutor):
                     "name": self.name,
                     "component": self._component_label,
                 },
-                annotations={
-                    "binder-repo": self.repo_url,
-                },
+                annotations=annotations,
             ),
             spec=client.V1PodSpec(
                 containers=[
@@ -577,7 +992,7 @@ class KubernetesBuildExecutor(BuildExecutor):
                 node_selector=self.node_selector,
                 volumes=volumes,
                 restart_policy="Never",
-                affinity=self.get_affinity(),
+                affinity=affinity,
                 image_pull_secrets=self.get_image_pull_secrets(),
             ),
         )
@@ -598,6 +1013,15 @@ class KubernetesBuildExecutor(BuildExecutor):
         else:
             app_log.info("Started build %s", self.name)
 
+        if self.pod_informer is not None:
+            # the shared informer watches the pod for us,
+            # no need to tie up this thread for the duration of the build
+            if not self.stop_event.is_set():
+                self.main_loop.add_callback(
+                    self.pod_informer.add_handler, self.name, self._handle_pod_event
+                )
+            return
+
         app_log.info("Watching build pod %s", self.name)
         while not self.stop_event.is_set():
             w = watch.Watch()
@@ -610,58 +1034,20 @@ class KubernetesBuildExecutor(BuildExecutor):
                     _request_timeout=KUBE_REQUEST_TIMEOUT,
                 ):
                     if f["type"] == "DELETED":
-                        phase = f["object"].status.phase
-                        app_log.debug(
-                            "Pod %s was deleted with phase %s",
-                            f["object"].metadata.name,
-                            phase,
-                        )
-                        if phase == "Succeeded":
-                            self.progress(
-                                ProgressEvent.Kind.BUILD_STATUS_CHANGE,
-                                ProgressEvent.BuildStatus.BUILT,
-                            )
-                        else:
-                            self.progress(
-                                ProgressEvent.Kind.BUILD_STATUS_CHANGE,
-                                ProgressEvent.BuildStatus.FAILED,
-                            )
+                        self._report_deleted(f["object"].status.phase)
                         return
                     self.pod = f["object"]
                     if not self.stop_event.is_set():
-                        # Account for all the phases kubernetes pods can be in
-                        # Pending, Running, Succeeded, Failed, Unknown
-                        # https://kubernetes.io/docs/concepts/workloads/pods/pod-lifecycle/#pod-phase
-                        phase = self.pod.status.phase
-                        if phase == "Pending":
-                            self.progress(
-                                ProgressEvent.Kind.BUILD_STATUS_CHANGE,
-                                ProgressEvent.BuildStatus.PENDING,
-                            )
-                        elif phase == "Running":
-                            self.progress(
-                                ProgressEvent.Kind.BUILD_STATUS_CHANGE,
-                                ProgressEvent.BuildStatus.RUNNING,
-                            )
-                        elif phase == "Succeeded":
-                            # Do nothing! We will clean this up, and send a 'Completed' progress event
-                            # when the pod has been deleted
-                            pass
-                        elif phase == "Failed":
-                            self.progress(
-                                ProgressEvent.Kind.BUILD_STATUS_CHANGE,
-                                ProgressEvent.BuildStatus.FAILED,
-                            )
-                        elif phase == "Unknown":
-                            self.progress(
-                                ProgressEvent.Kind.BUILD_STATUS_CHANGE,
-                                ProgressEvent.BuildStatus.UNKNOWN,
-                            )
-                        else:
-                            # This shouldn't happen, unless k8s introduces new Phase types
-                            warnings.warn(
-                                f"Found unknown phase {phase} when building {self.name}"
-                            )
+                        # the watch restarts at least every 30s,
+                        # replaying the pod even if it doesn't change
+                        stuck = self._check_stuck(
+                            self.api.api_client.sanitize_for_serialization(self.pod)
+                        )
+                        if stuck:
+                            self._fail_stuck(*stuck)
+                            self.cleanup()
+                            return
+                        self._report_phase(self.pod.status.phase)
 
                     if self.pod.status.phase == "Succeeded":
                         self.cleanup()
@@ -696,25 +1082,7 @@ class KubernetesBuildExecutor(BuildExecutor):
             if self.stop_event.is_set():
                 app_log.info("Stopping logs of %s", self.name)
                 return
-            # verify that the line is JSON
-            line = line.decode("utf-8")
-            try:
-                json.loads(line)
-            except ValueError:
-                # log event wasn't JSON.
-                # use the line itself as the message with unknown phase.
-                # We don't know what the right phase is, use 'unknown'.
-                # If it was a fatal error, presumably a 'failure'
-                # message will arrive shortly.
-                app_log.error("log event not json: %r", line)
-                line = json.dumps(
-                    {
-                        "phase": "unknown",
-                        "message": line,
-                    }
-                )
-
-            self.progress(ProgressEvent.Kind.LOG_MESSAGE, line)
+            self.put_event(ProgressEvent.from_log_line(line.decode("utf-8")))
         else:
             app_log.info("Finished streaming logs of %s", self.name)
 
@@ -736,11 +1104,66 @@ class KubernetesBuildExecutor(BuildExecutor):
             else:
                 raise
 
+    def stop(self):
+        super().stop()
+        if self.pod_informer is not None:
+            self.main_loop.add_callback(
+                self.pod_informer.remove_handler, self.name, self._handle_pod_event
+            )
+
+    def on_finished(self, callback):
+        """
+        Call `callback()` on the main thread once the build pod has stopped or is gone
+        """
+        if self.pod_informer is not None:
+            self.main_loop.add_callback(self._watch_finished, callback)
+        else:
+            self.main_loop.add_callback(self._poll_finished, callback)
+
+    def _watch_finished(self, callback):
+        if self.name not in self.pod_informer.pods:
+            callback()
+            return
+
+        def handle_pod_event(event_type, pod):
+            phase = pod.get("status", {}).get("phase")
+            if event_type == "DELETED" or phase in ("Succeeded", "Failed"):
+                self.pod_informer.remove_handler(self.name, handle_pod_event)
+                callback()
+
+        self.pod_informer.add_handler(self.name, handle_pod_event)
+
+    async def _poll_finished(self, callback):
+        while True:
+            try:
+                pod = await self.main_loop.run_in_executor(
+                    None,
+                    lambda: self.api.read_namespaced_pod(
+                        self.name,
+                        self.namespace,
+                        _request_timeout=KUBE_REQUEST_TIMEOUT,
+                    ),
+                )
+            except client.rest.ApiException as e:
+                if e.status == 404:
+                    break
+                app_log.warning("Failed to check build pod %s: %s", self.name, e)
+            except Exception:
+                app_log.exception("Failed to check build pod %s", self.name)
+            else:
+                if pod.status.phase in ("Succeeded", "Failed"):
+                    break
+            await asyncio.sleep(self.finished_poll_interval)
+        callback()
+
 
 class KubernetesCleaner(LoggingConfigurable):
     """Regular cleanup utility for kubernetes builds
 
     Instantiate this class, and call cleanup() periodically.
+
+    With a pod informer, call start() once instead:
+    build pods are deleted as soon as they stop or exceed `max_age`.
     """
 
     kube = Any(help="kubernetes API client")
@@ -765,65 +1188,217 @@ class KubernetesCleaner(LoggingConfigurable):
         config=True,
     )
 
+    pod_cache = Any(
+        None,
+        allow_none=True,
+        help="""
+        PodCache to look up build pods in, instead of listing them.
+
+        Defaults to the `pod_cache` of the parent BinderHub application, if any.
+        """,
+    )
+
+    @default("pod_cache")
+    def _default_pod_cache(self):
+        return getattr(self.parent, "pod_cache", None)
+
+    pod_informer = Any(
+        None,
+        allow_none=True,
+        help="""
+        PodInformer watching all build pods, to delete them as soon as they stop.
+
+        Defaults to the `build_pod_informer` of the parent BinderHub application, if any.
+        """,
+    )
+
+    @default("pod_informer")
+    def _default_pod_informer(self):
+        return getattr(self.parent, "build_pod_informer", None)
+
+    list_page_size = Integer(
+        500,
+        help="Number of build pods to request per page when listing them",
+        config=True,
+    )
+
+    delete_concurrency = Integer(
+        10,
+        help="Maximum number of build pods to delete at the same time",
+        config=True,
+    )
+
+    retry_delay = Integer(
+        60,
+        help="Time (in seconds) to wait before trying again to delete a build pod",
+        config=True,
+    )
+
+    _label_selector = "component=binderhub-build"
+
+    def __init__(self, **kwargs):
+        super().__init__(**kwargs)
+        # pod name -> (handle, delay) of the scheduled deletion
+        self._deletions = {}
+        self._delete_semaphore = None
+
+    def _list_builds(self):
+        """List build pods
+
+        Returns (name, phase, annotations, start_time) tuples
+        """
+        if self.pod_cache is not None:
+            pods = self.pod_cache.list_pods(self.namespace, self._label_selector)
+            if pods is not None:
+                return [self._pod_info(pod) for pod in pods]
+
+        builds = []
+        _continue = None
+        while True:
+            # list in pages, to keep each request small on busy clusters
+            pod_list = self.kube.list_namespaced_pod(
+                namespace=self.namespace,
+                label_selector=self._label_selector,
+                limit=self.list_page_size,
+                _continue=_continue,
+                _request_timeout=KUBE_REQUEST_TIMEOUT,
+            )
+            builds.extend(
+                (
+                    build.metadata.name,
+                    build.status.phase,
+                    build.metadata.annotations or {},
+                    build.status.start_time,
+                )
+                for build in pod_list.items
+            )
+            _continue = pod_list.metadata._continue
+            if not _continue:
+                return builds
+
+    @staticmethod
+    def _pod_info(pod):
+        """(name, phase, annotations, start_time) of a pod dict"""
+        start_time = pod.get("status", {}).get("startTime")
+        if start_time:
+            start_time = datetime.datetime.fromisoformat(
+                start_time.replace("Z", "+00:00")
+            )
+        return (
+            pod["metadata"]["name"],
+            pod.get("status", {}).get("phase"),
+            pod["metadata"].get("annotations") or {},
+            start_time,
+        )
+
+    def _delete_pod(self, name):
+        try:
+            self.kube.delete_namespaced_pod(
+                name=name,
+                namespace=self.namespace,
+                body=client.V1DeleteOptions(grace_period_seconds=0),
+                _request_timeout=KUBE_REQUEST_TIMEOUT,
+            )
+        except client.rest.ApiException as e:
+            if e.status == 404:
+                # Is ok, someone else has already deleted it
+                pass
+            else:
+                raise
+
+    def _delete_reason(self, phase, started, now):
+        """Why a build pod should be deleted now, or None"""
+        if phase in {"Failed", "Succeeded", "Evicted"}:
+            return phase
+        max_age = datetime.timedelta(seconds=self.max_age)
+        if self.max_age and started and started < now - max_age:
+            return "long-running"
+        return None
+
     def cleanup(self):
         """Delete stopped build pods and build pods that have aged out"""
-        builds = self.kube.list_namespaced_pod(
-            namespace=self.namespace,
-            label_selector="component=binderhub-build",
-        ).items
+        builds = self._list_builds()
         phases = defaultdict(int)
         app_log.debug("%i build pods", len(builds))
         now = datetime.datetime.now(tz=datetime.timezone.utc)
-        start_cutoff = now - datetime.timedelta(seconds=self.max_age)
-        deleted = 0
-        for build in builds:
-            phase = build.status.phase
+        to_delete = []
+        for name, phase, annotations, started in builds:
             phases[phase] += 1
-            annotations = build.metadata.annotations or {}
             repo = annotations.get("binder-repo", "unknown")
-            delete = False
-            if build.status.phase in {"Failed", "Succeeded", "Evicted"}:
+            reason = self._delete_reason(phase, started, now)
+            if reason:
                 # log Deleting Failed build build-image-...
-                # print(build.metadata)
-                app_log.info(
-                    "Deleting %s build %s (repo=%s)",
-                    build.status.phase,
-                    build.metadata.name,
-                    repo,
-                )
-                delete = True
-            else:
-                # check age
-                started = build.status.start_time
-                if self.max_age and started and started < start_cutoff:
-                    app_log.info(
-                        "Deleting long-running build %s (repo=%s)",
-                        build.metadata.name,
-                        repo,
-                    )
-                    delete = True
-
-            if delete:
-                deleted += 1
-                try:
-                    self.kube.delete_namespaced_pod(
-                        name=build.metadata.name,
-                        namespace=self.namespace,
-                        body=client.V1DeleteOptions(grace_period_seconds=0),
-                    )
-                except client.rest.ApiException as e:
-                    if e.status == 404:
-                        # Is ok, someone else has already deleted it
-                        pass
-                    else:
-                        raise
-
-        if deleted:
-            app_log.info("Deleted %i/%i build pods", deleted, len(builds))
+                app_log.info("Deleting %s build %s (repo=%s)", reason, name, repo)
+                to_delete.append(name)
+
+        if to_delete:
+            with ThreadPoolExecutor(self.delete_concurrency) as pool:
+                # consume the results, to raise errors
+                list(pool.map(self._delete_pod, to_delete))
+            app_log.info("Deleted %i/%i build pods", len(to_delete), len(builds))
         app_log.debug(
             "Build phase summary: %s", json.dumps(phases, sort_keys=True, indent=1)
         )
 
+    def start(self):
+        """Delete build pods as they stop or age out, following `pod_informer`
+
+        Must be called on the main event loop.
+        """
+        self._delete_semaphore = asyncio.Semaphore(self.delete_concurrency)
+        self.pod_informer.add_handler(None, self._handle_pod_event)
+
+    def _handle_pod_event(self, event_type, pod):
+        name = pod["metadata"]["name"]
+        if event_type == "DELETED" or pod["metadata"].get("deletionTimestamp"):
+            self._cancel_deletion(name)
+            return
+
+        _, phase, annotations, started = self._pod_info(pod)
+        now = datetime.datetime.now(tz=datetime.timezone.utc)
+        reason = self._delete_reason(phase, started, now)
+        scheduled = self._deletions.get(name)
+        if reason:
+            if scheduled is not None and scheduled[1] == 0:
+                # already being deleted
+                return
+            # stopped, possibly before its max age
+            self._cancel_deletion(name)
+            delay = 0
+        elif scheduled is None and self.max_age and started:
+            reason = "long-running"
+            max_age = datetime.timedelta(seconds=self.max_age)
+            delay = (started + max_age - now).total_seconds()
+        else:
+            return
+        repo = annotations.get("binder-repo", "unknown")
+        self._schedule_deletion(name, delay, reason, repo)
+
+    def _schedule_deletion(self, name, delay, reason, repo):
+        handle = IOLoop.current().call_later(
+            delay,
+            lambda: asyncio.ensure_future(self._delete_later(name, reason, repo)),
+        )
+        self._deletions[name] = (handle, delay)
+
+    def _cancel_deletion(self, name):
+        scheduled = self._deletions.pop(name, None)
+        if scheduled is not None:
+            IOLoop.current().remove_timeout(scheduled[0])
+
+    async def _delete_later(self, name, reason, repo):
+        async with self._delete_semaphore:
+            if name not in self._deletions:
+                # deleted in the meantime
+                return
+            app_log.info("Deleting %s build %s (repo=%s)", reason, name, repo)
+            try:
+                await IOLoop.current().run_in_executor(None, self._delete_pod, name)
+            except Exception:
+                app_log.exception("Failed to delete build %s", name)
+                # try again later, stopped pods may not change anymore
+                self._schedule_deletion(name, self.retry_delay, reason, repo)
+
 
 class FakeBuild(BuildExecutor):
     """
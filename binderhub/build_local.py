@@ -2,7 +2,6 @@
 Contains build of a docker image from a git repository.
 """
 
-import json
 import os
 
 # These methods are synchronous so don't use tornado.queue
@@ -162,19 +161,4 @@ class LocalRepo2dockerBuild(BuildExecutor):
             raise
 
     def _handle_log(self, line):
-        try:
-            json.loads(line)
-        except ValueError:
-            # log event wasn't JSON.
-            # use the line itself as the message with unknown phase.
-            # We don't know what the right phase is, use 'unknown'.
-            # If it was a fatal error, presumably a 'failure'
-            # message will arrive shortly.
-            app_log.error("log event not json: %r", line)
-            line = json.dumps(
-                {
-                    "phase": "unknown",
-                    "message": line,
-                }
-            )
-        self.progress(ProgressEvent.Kind.LOG_MESSAGE, line)
+        self.put_event(ProgressEvent.from_log_line(line))
@@ -0,0 +1,189 @@
+"""
+Storage of build logs on local disk.
+
+The JSON log messages of each build are written to a gzip-compressed file per image,
+so they can be replayed to clients joining a long build
+and downloaded after the build pod is gone.
+"""
+
+import gzip
+import os
+import string
+import zlib
+
+import escapism
+from tornado.ioloop import IOLoop
+from tornado.log import app_log
+from traitlets import Integer, Unicode
+from traitlets.config import LoggingConfigurable
+
+_safe_chars = set(string.ascii_letters + string.digits + "-.")
+
+
+def log_filename(image_name):
+    """Name of the log file for an image"""
+    return escapism.escape(image_name, safe=_safe_chars, escape_char="_") + ".jsonl.gz"
+
+
+class BuildLogWriter:
+    """Append the log messages of one build to a compressed file
+
+    Messages are written to a partial file,
+    which replaces the log of the previous build of the same image when closed.
+    """
+
+    def __init__(self, store, path, max_size):
+        self.store = store
+        self.path = path
+        self.partial_path = path + ".partial"
+        self.max_size = max_size
+        self.truncated = False
+        self.closed = False
+        self.lines = 0
+        self._file = open(self.partial_path, "wb")
+        self._gzip = gzip.GzipFile(fileobj=self._file, mode="wb")
+
+    def write(self, line):
+        """Write one JSON log message"""
+        if self.closed or self.truncated:
+            return
+        if self.max_size and self._file.tell() > self.max_size:
+            self.truncated = True
+            line = '{"message": "Build log truncated\\n"}'
+        try:
+            self._gzip.write(line.rstrip("\n").encode("utf8") + b"\n")
+        except OSError:
+            app_log.exception("Failed to write build log %s", self.partial_path)
+            # don't try again for every message
+            self.truncated = True
+            return
+        self.lines += 1
+
+    def read_lines(self):
+        """Read the messages written so far"""
+        return self.line_reader()()
+
+    def line_reader(self):
+        """Return a function reading the messages written so far
+
+        Only the cheap part happens here, on the thread writing the log.
+        The returned function does the reading and decompressing,
+        and may be called from another thread, e.g. in an executor,
+        while messages are still being written.
+        """
+        if self.closed:
+            f = open(self.path, "rb")
+            size = -1
+        else:
+            # make everything written so far decompressible
+            self._gzip.flush(zlib.Z_SYNC_FLUSH)
+            size = self._file.tell()
+            # opened here, so that the file can still be read
+            # if the writer is closed and it is renamed in the meantime
+            f = open(self.partial_path, "rb")
+
+        def read_lines():
+            with f:
+                data = zlib.decompressobj(16 + zlib.MAX_WBITS).decompress(f.read(size))
+            return data.decode("utf8").splitlines()
+
+        return read_lines
+
+    def close(self):
+        """Finish the log file and make it available for download"""
+        if self.closed:
+            return
+        self.closed = True
+        try:
+            self._gzip.close()
+            self._file.close()
+            os.replace(self.partial_path, self.path)
+        except OSError:
+            app_log.exception("Failed to save build log %s", self.path)
+            return
+        self.store.prune()
+
+
+class BuildLogStore(LoggingConfigurable):
+    """Directory of compressed build logs, one per image"""
+
+    path = Unicode(
+        "",
+        config=True,
+        help="""
+        Directory in which to store build logs, e.g. /srv/binderhub/build-logs.
+
+        Build logs are not stored by default.
+        When set, the log of any image is served at /build-logs/<image name>
+        to every user of this BinderHub: any logged-in user with authentication,
+        anyone without.
+        Logs include the output of the repositories' build scripts,
+        so only set this if that is acceptable for all repositories built here.
+        Stored logs are also replayed to clients joining a long build,
+        beyond the messages kept in memory.
+        """,
+    )
+
+    max_log_size = Integer(
+        10 * 1024 * 1024,
+        config=True,
+        help="""
+        Maximum compressed size (in bytes) of the log of a single build.
+
+        Further messages are dropped. 0 means no limit.
+        """,
+    )
+
+    max_total_size = Integer(
+        1024 * 1024 * 1024,
+        config=True,
+        help="""
+        Maximum total size (in bytes) of stored build logs.
+
+        The oldest logs are deleted when a new log brings the total above this.
+        0 means no limit.
+        """,
+    )
+
+    def log_path(self, image_name):
+        return os.path.join(self.path, log_filename(image_name))
+
+    def open(self, image_name):
+        """Start the log of a new build of `image_name`
+
+        Returns a BuildLogWriter,
+        or None if logs are not stored or the log can't be written.
+        """
+        if not self.path:
+            return None
+        try:
+            os.makedirs(self.path, exist_ok=True)
+            return BuildLogWriter(
+                self, self.log_path(image_name), max_size=self.max_log_size
+            )
+        except OSError:
+            self.log.exception("Failed to open build log for %s", image_name)
+            return None
+
+    def prune(self):
+        """Delete the oldest logs in the background, to stay below max_total_size"""
+        if self.max_total_size:
+            IOLoop.current().run_in_executor(None, self._prune)
+
+    def _prune(self):
+        try:
+            logs = []
+            with os.scandir(self.path) as entries:
+                for entry in entries:
+                    if entry.name.endswith(".jsonl.gz"):
+                        stat = entry.stat()
+                        logs.append((stat.st_mtime, stat.st_size, entry.path))
+            total_size = sum(size for _, size, _ in logs)
+            for _, size, path in sorted(logs):
+                if total_size <= self.max_total_size:
+                    break
+                self.log.info("Deleting old build log %s", path)
+                os.remove(path)
+                total_size -= size
+        except OSError:
+            self.log.exception("Failed to clean up build logs in %s", self.path)
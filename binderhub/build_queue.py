@@ -0,0 +1,152 @@
+"""
+Admission control for builds.
+
+Builds wait in the BuildQueue until there is room for them,
+instead of all being submitted to the build pool at once.
+Repos take turns, so a burst of builds from one repo doesn't starve the others,
+and builds of repos with a higher quota go first.
+"""
+
+import asyncio
+from collections import Counter, OrderedDict, deque
+
+from prometheus_client import Gauge
+from traitlets import Integer
+from traitlets.config import LoggingConfigurable
+
+BUILDS_QUEUED = Gauge("binderhub_queued_builds", "Builds waiting to start")
+
+
+class _Waiter:
+    def __init__(self, repo, on_position):
+        self.repo = repo
+        self.on_position = on_position
+        self.position = None
+        self.future = asyncio.get_running_loop().create_future()
+
+
+class BuildQueue(LoggingConfigurable):
+    """Queue of builds waiting to start
+
+    Call `await acquire(repo)` before starting a build,
+    and `release(repo)` once it is done.
+    """
+
+    concurrent_build_limit = Integer(
+        32,
+        help="""
+        The number of builds to run at the same time.
+
+        Set from BinderHub.concurrent_build_limit.
+        """,
+    )
+
+    per_repo_limit = Integer(
+        0,
+        config=True,
+        help="""
+        The number of builds of the same repo to run at the same time.
+
+        0 (default) means no limit beyond concurrent_build_limit.
+        """,
+    )
+
+    def __init__(self, **kwargs):
+        super().__init__(**kwargs)
+        # repo -> number of running builds
+        self.running = Counter()
+        # whether the repo has a higher quota -> (repo -> deque of waiters),
+        # in the order in which repos take turns
+        self._queues = {True: OrderedDict(), False: OrderedDict()}
+
+    @property
+    def total_running(self):
+        return sum(self.running.values())
+
+    def __len__(self):
+        return sum(len(q) for queues in self._queues.values() for q in queues.values())
+
+    async def acquire(self, repo, high_priority=False, on_position=None):
+        """Wait until a build of `repo` may start
+
+        `on_position(n)` is called whenever the position of the build
+        in the queue changes, starting from 1.
+        It is not called if the build can start right away.
+        """
+        waiter = _Waiter(repo, on_position)
+        self._queues[high_priority].setdefault(repo, deque()).append(waiter)
+        self._schedule()
+        if waiter.future.done():
+            return
+        BUILDS_QUEUED.inc()
+        try:
+            await waiter.future
+        except asyncio.CancelledError:
+            if waiter.future.done() and not waiter.future.cancelled():
+                # started just as we were cancelled
+                self.release(repo)
+            else:
+                self._remove(waiter, high_priority)
+            raise
+        finally:
+            BUILDS_QUEUED.dec()
+
+    def release(self, repo):
+        """Record that a build of `repo` is done, starting the next one"""
+        self.running[repo] -= 1
+        if self.running[repo] <= 0:
+            del self.running[repo]
+        self._schedule()
+
+    def _remove(self, waiter, high_priority):
+        queues = self._queues[high_priority]
+        q = queues.get(waiter.repo)
+        if q is not None and waiter in q:
+            q.remove(waiter)
+            if not q:
+                del queues[waiter.repo]
+        self._update_positions()
+
+    def _next_waiter(self):
+        """Take the next waiter that may start, if any"""
+        for queues in (self._queues[True], self._queues[False]):
+            for repo, q in queues.items():
+                if self.per_repo_limit and self.running[repo] >= self.per_repo_limit:
+                    continue
+                waiter = q.popleft()
+                if q:
+                    # the repo's next build waits for the other repos' turn
+                    queues.move_to_end(repo)
+                else:
+                    del queues[repo]
+                return waiter
+        return None
+
+    def _schedule(self):
+        while self.total_running < self.concurrent_build_limit:
+            waiter = self._next_waiter()
+            if waiter is None:
+                break
+            self.running[waiter.repo] += 1
+            waiter.future.set_result(None)
+        self._update_positions()
+
+    def _update_positions(self):
+        """Tell waiters their position, if it changed
+
+        Positions follow the order in which waiters would be started
+        if no per-repo limit applied.
+        """
+        position = 0
+        for queues in (self._queues[True], self._queues[False]):
+            repo_queues = list(queues.values())
+            for i in range(max(map(len, repo_queues), default=0)):
+                for q in repo_queues:
+                    if i >= len(q):
+                        continue
+                    waiter = q[i]
+                    position += 1
+                    if waiter.position != position:
+                        waiter.position = position
+                        if waiter.on_position is not None:
+                            waiter.on_position(position)
@@ -0,0 +1,462 @@
+"""
+Coalescing of concurrent builds of the same image.
+
+Every request for an image that is not yet in the registry used to start its
+own build executor, each with its own pod watch and log stream.
+The BuildRegistry keeps one SharedBuild per image name.
+The first request starts the build, later requests subscribe to the same
+sequence of ProgressEvents, starting with a replay of what has already been emitted.
+"""
+
+import asyncio
+import json
+import time
+from collections import deque
+
+from prometheus_client import Counter, Gauge, Histogram
+from tornado.ioloop import IOLoop
+from tornado.log import app_log
+from tornado.queues import Queue
+from traitlets import Bool, Instance, Integer
+from traitlets.config import LoggingConfigurable
+
+from .build import ProgressEvent
+from .build_logs import BuildLogStore
+from .build_queue import BuildQueue
+
+# Separate buckets for builds and launches.
+# Builds and launches have very different characteristic times,
+# and there is a cost to having too many buckets in prometheus.
+BUILD_BUCKETS = [60, 120, 300, 600, 1800, 3600, 7200, float("inf")]
+BUILD_TIME = Histogram(
+    "binderhub_build_time_seconds",
+    "Histogram of build times",
+    ["status"],
+    buckets=BUILD_BUCKETS,
+)
+BUILD_COUNT = Counter(
+    "binderhub_build_count",
+    "Counter of builds by repo",
+    ["status", "provider", "repo"],
+)
+BUILDS_INPROGRESS = Gauge("binderhub_inprogress_builds", "Builds currently in progress")
+BUILD_SUBSCRIBERS = Counter(
+    "binderhub_build_subscribers",
+    "Counter of requests attached to a build, by whether they started it or joined it",
+    ["kind"],
+)
+BUILDS_REAPED = Counter(
+    "binderhub_reaped_builds",
+    "Counter of builds deleted because every request following them disconnected",
+)
+BUILD_SECONDS_SAVED = Counter(
+    "binderhub_reaped_build_saved_seconds",
+    "Estimated builder time saved by deleting abandoned builds, "
+    "from the average duration of successful builds",
+)
+
+
+class SharedBuild:
+    """A single build, shared by all the requests waiting for the same image
+
+    Owns the BuildExecutor, submits it to the build pool,
+    starts streaming its logs once the build is running,
+    and fans out every ProgressEvent to the queues of its subscribers.
+    """
+
+    def __init__(
+        self,
+        build,
+        registry,
+        metric_labels=None,
+        replay_limit=None,
+        on_built=None,
+        build_queue=None,
+        high_priority=False,
+        log_writer=None,
+    ):
+        self.build = build
+        self.registry = registry
+        # called once when the build completes successfully
+        self.on_built = on_built
+        # admission control, the build waits for its turn before it is submitted
+        self.build_queue = build_queue
+        self.high_priority = high_priority
+        # the last queue position event, sent to new subscribers
+        # but not kept for replay after the build starts
+        self.queue_event = None
+        # persistent log, replayed when the events in memory are incomplete
+        self.log_writer = log_writer
+        self.image_name = build.image_name
+        self.metric_labels = metric_labels or {}
+        # events emitted so far, replayed to late subscribers
+        self.events = deque(maxlen=replay_limit or None)
+        # whether old events were dropped from `events`
+        self.events_truncated = False
+        self.subscribers = set()
+        # subscribers waiting for the replay of the stored log,
+        # and the events held back for them in the meantime
+        self._replaying = {}
+        self.done = False
+        self.failed = False
+        # delete the build when nobody follows it anymore.
+        # Builds nobody is waiting for, e.g. build_only requests and prebuilds,
+        # set this to False to keep building.
+        self.reap_when_abandoned = True
+        # time.perf_counter() when the build was submitted
+        self.submitted_at = None
+        self._task = None
+        self._reap_handle = None
+
+    def subscribe(self):
+        """Subscribe to the events of this build
+
+        Returns a Queue that receives all events emitted so far,
+        followed by all future events.
+        """
+        q = Queue()
+        read_lines = None
+        if self.events_truncated and self.log_writer is not None:
+            try:
+                read_lines = self.log_writer.line_reader()
+            except OSError:
+                app_log.exception("Failed to open build log of %s", self.image_name)
+        if read_lines is not None:
+            # the log is read in the background,
+            # new events wait until it has been replayed
+            self._replaying[q] = []
+            asyncio.ensure_future(self._replay_log(q, read_lines, list(self.events)))
+        else:
+            for event in self.events:
+                q.put_nowait(event)
+        if self.queue_event is not None:
+            self._send(q, self.queue_event)
+        self.subscribers.add(q)
+        if self._reap_handle is not None:
+            app_log.info("Build of %s has subscribers again", self.image_name)
+            IOLoop.current().remove_timeout(self._reap_handle)
+            self._reap_handle = None
+        return q
+
+    def unsubscribe(self, q):
+        """Stop sending events to `q`
+
+        When the last subscriber leaves an unfinished build,
+        stop watching the build.
+        A later request for the same image will pick it up again.
+
+        If the registry reaps abandoned builds, the build is kept for
+        `abandoned_build_grace_period` first, and deleted if nobody subscribed again.
+        """
+        self.subscribers.discard(q)
+        self._replaying.pop(q, None)
+        if self.subscribers or self.done:
+            return
+        if self.reap_when_abandoned and self.registry.reap_abandoned_builds:
+            grace_period = self.registry.abandoned_build_grace_period
+            app_log.info(
+                "No more subscribers for build of %s, deleting it in %is",
+                self.image_name,
+                grace_period,
+            )
+            if self._reap_handle is None:
+                self._reap_handle = IOLoop.current().call_later(
+                    grace_period, self._reap
+                )
+            return
+        app_log.info("No more subscribers for build of %s", self.image_name)
+        self._stop_watching()
+
+    async def _replay_log(self, q, read_lines, events):
+        """Replay the stored log to `q`, followed by the events held back for it
+
+        `events` are the events in memory when `q` subscribed,
+        replayed instead if the log can't be read.
+        """
+        try:
+            lines = await IOLoop.current().run_in_executor(None, read_lines)
+        except Exception:
+            app_log.exception("Failed to read build log of %s", self.image_name)
+        else:
+            # status changes before the end of the build don't need replaying
+            events = [
+                ProgressEvent(ProgressEvent.Kind.LOG_MESSAGE, line) for line in lines
+            ]
+        held_back = self._replaying.pop(q, None)
+        if held_back is None:
+            # unsubscribed in the meantime
+            return
+        for event in events + held_back:
+            q.put_nowait(event)
+
+    def _send(self, q, event):
+        held_back = self._replaying.get(q)
+        if held_back is not None:
+            held_back.append(event)
+        else:
+            q.put_nowait(event)
+
+    def _stop_watching(self):
+        self.build.stop()
+        self.registry.remove(self)
+        if self._task is not None:
+            self._task.cancel()
+
+    def _reap(self):
+        """Delete the build, if it is still abandoned"""
+        self._reap_handle = None
+        if self.subscribers or self.done:
+            return
+        app_log.info("Deleting abandoned build of %s", self.image_name)
+        self._stop_watching()
+        BUILDS_REAPED.inc()
+        if self.submitted_at is None:
+            # still waiting in the build queue, nothing to delete
+            return
+        mean_build_time = self.registry.mean_build_time
+        if mean_build_time is not None:
+            elapsed = time.perf_counter() - self.submitted_at
+            BUILD_SECONDS_SAVED.inc(max(mean_build_time - elapsed, 0))
+        future = IOLoop.current().run_in_executor(None, self.build.cleanup)
+        future.add_done_callback(self._check_cleanup)
+
+    def _check_cleanup(self, future):
+        try:
+            future.result()
+        except Exception:
+            app_log.exception("Failed to delete abandoned build of %s", self.image_name)
+
+    def start(self, pool):
+        """Submit the build to `pool` and start fanning out its events"""
+        self._task = asyncio.ensure_future(self._watch(pool))
+        return self._task
+
+    def _publish(self, event, replay=True):
+        if replay:
+            if len(self.events) == self.events.maxlen:
+                self.events_truncated = True
+            self.events.append(event)
+            if self.log_writer is not None:
+                self._write_log(event)
+        for q in self.subscribers:
+            self._send(q, event)
+
+    def _publish_queue_position(self, position):
+        self.queue_event = ProgressEvent(
+            ProgressEvent.Kind.LOG_MESSAGE,
+            json.dumps(
+                {
+                    "phase": "waiting",
+                    "message": f"You are #{position} in the build queue\n",
+                }
+            ),
+        )
+        self._publish(self.queue_event, replay=False)
+
+    def _write_log(self, event):
+        if event.kind == ProgressEvent.Kind.LOG_MESSAGE:
+            self.log_writer.write(event.payload)
+        elif event.payload in (
+            ProgressEvent.BuildStatus.BUILT,
+            ProgressEvent.BuildStatus.FAILED,
+        ):
+            # record the outcome
+            self.log_writer.write(json.dumps({"phase": event.payload.value}))
+
+    async def _watch(self, pool):
+        try:
+            await self._wait_and_run(pool)
+        finally:
+            if self.log_writer is not None:
+                self.log_writer.close()
+
+    async def _wait_and_run(self, pool):
+        if self.build_queue is None:
+            await self._run(pool)
+            return
+
+        repo = self.build.repo_url
+        try:
+            await self.build_queue.acquire(
+                repo,
+                high_priority=self.high_priority,
+                on_position=self._publish_queue_position,
+            )
+        except asyncio.CancelledError:
+            self.registry.remove(self)
+            raise
+        self.queue_event = None
+        try:
+            await self._run(pool)
+        finally:
+            if self.done:
+                self.build_queue.release(repo)
+            else:
+                # nobody follows the build anymore, but it keeps running,
+                # and keeps its slot until it stops
+                self.build.on_finished(lambda: self.build_queue.release(repo))
+
+    async def _run(self, pool):
+        build = self.build
+
+        def _check_result(future):
+            try:
+                r = future.result()
+                app_log.debug("Build task completed: %s", r)
+            except Exception:
+                app_log.error("Build task failed", exc_info=True)
+                # make sure subscribers get a message
+                build.progress(
+                    ProgressEvent.Kind.LOG_MESSAGE,
+                    json.dumps(
+                        {
+                            "phase": ProgressEvent.BuildStatus.FAILED.value,
+                            "message": "Unhandled error watching for build events. Please try again.\n",
+                        }
+                    ),
+                )
+                build.progress(
+                    ProgressEvent.Kind.BUILD_STATUS_CHANGE,
+                    ProgressEvent.BuildStatus.FAILED,
+                )
+
+        with BUILDS_INPROGRESS.track_inprogress():
+            build_starttime = self.submitted_at = time.perf_counter()
+            submit_future = pool.submit(build.submit)
+            submit_future.add_done_callback(_check_result)
+            log_future = None
+
+            try:
+                while not self.done:
+                    progress = await build.q.get()
+                    if progress.kind == ProgressEvent.Kind.BUILD_STATUS_CHANGE:
+                        if progress.payload == ProgressEvent.BuildStatus.RUNNING:
+                            # start capturing build logs once the pod is running,
+                            # once for all subscribers
+                            if log_future is None:
+                                log_future = pool.submit(build.stream_logs)
+                                log_future.add_done_callback(_check_result)
+                        elif progress.payload == ProgressEvent.BuildStatus.BUILT:
+                            self.done = True
+                            if self.on_built is not None:
+                                self.on_built()
+                        elif progress.payload == ProgressEvent.BuildStatus.FAILED:
+                            self.done = True
+                            self.failed = True
+                    elif progress.kind == ProgressEvent.Kind.LOG_MESSAGE:
+                        if progress.phase in ("failure", "failed"):
+                            self.failed = True
+                    self._publish(progress)
+            finally:
+                self.registry.remove(self)
+
+            if self.done:
+                status = "failure" if self.failed else "success"
+                duration = time.perf_counter() - build_starttime
+                BUILD_TIME.labels(status=status).observe(duration)
+                if not self.failed:
+                    self.registry.record_build_time(duration)
+                BUILD_COUNT.labels(status=status, **self.metric_labels).inc()
+
+
+class BuildRegistry(LoggingConfigurable):
+    """In-process registry of builds in progress, keyed by image name"""
+
+    replay_limit = Integer(
+        10000,
+        config=True,
+        help="""
+        Maximum number of events of a build kept for replay to requests
+        joining a build that is already in progress.
+
+        0 means no limit.
+        """,
+    )
+
+    build_queue = Instance(
+        BuildQueue,
+        allow_none=True,
+        help="Queue in which builds wait for their turn, None to start them right away",
+    )
+
+    log_store = Instance(
+        BuildLogStore,
+        allow_none=True,
+        help="Store for the logs of builds, None to not store them",
+    )
+
+    reap_abandoned_builds = Bool(
+        False,
+        config=True,
+        help="""
+        Delete builds when every request following them has disconnected.
+
+        By default, builds nobody follows anymore keep running until they finish,
+        and a later request for the same image picks them up again.
+        Builds requested with `build_only` and prebuilds are never deleted.
+        """,
+    )
+
+    abandoned_build_grace_period = Integer(
+        60,
+        config=True,
+        help="""
+        Time (in seconds) to wait after the last request following a build
+        disconnected before deleting the build, with `reap_abandoned_builds`.
+
+        Requests for the same image within this time resume following the build.
+        """,
+    )
+
+    def __init__(self, **kwargs):
+        super().__init__(**kwargs)
+        self.builds = {}
+        # moving average of the duration of successful builds
+        self.mean_build_time = None
+
+    def record_build_time(self, duration):
+        """Account for the duration of a successful build in `mean_build_time`"""
+        if self.mean_build_time is None:
+            self.mean_build_time = duration
+        else:
+            self.mean_build_time += 0.1 * (duration - self.mean_build_time)
+
+    def get(self, image_name):
+        """Return the SharedBuild in progress for `image_name`, if any"""
+        return self.builds.get(image_name)
+
+    def start(
+        self, build, pool, metric_labels=None, on_built=None, high_priority=False
+    ):
+        """Start `build` in `pool` and register it for its image name
+
+        `on_built()` is called once if the build succeeds,
+        before the BUILT event is sent to subscribers.
+        With a `build_queue`, the build waits for its turn before it is submitted,
+        `high_priority` builds first.
+
+        Returns the SharedBuild, to which callers should subscribe.
+        """
+        if build.image_name in self.builds:
+            raise ValueError(f"Build of {build.image_name} already in progress")
+        log_writer = None
+        if self.log_store is not None:
+            log_writer = self.log_store.open(build.image_name)
+        shared_build = SharedBuild(
+            build,
+            registry=self,
+            metric_labels=metric_labels,
+            replay_limit=self.replay_limit,
+            on_built=on_built,
+            build_queue=self.build_queue,
+            high_priority=high_priority,
+            log_writer=log_writer,
+        )
+        self.builds[build.image_name] = shared_build
+        shared_build.start(pool)
+        return shared_build
+
+    def remove(self, shared_build):
+        """Forget about `shared_build`, if it is still the registered build"""
+        if self.builds.get(shared_build.image_name) is shared_build:
+            self.builds.pop(shared_build.image_name)
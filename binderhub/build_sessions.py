@@ -0,0 +1,159 @@
+"""
+Resumable build and launch event streams.
+
+Each request to /build/ starts a BuildSession,
+which runs the build and launch independently of the EventSource connection
+and records every event it emits.
+Events are sent with an id of the form `<session id>-<index>`,
+so when the connection drops, the browser reconnects with a Last-Event-ID header
+and the new request picks up the same session where the old one left off,
+instead of starting over.
+"""
+
+import asyncio
+import secrets
+
+from prometheus_client import Counter
+from tornado.ioloop import IOLoop
+from tornado.log import app_log
+from traitlets import Float, Integer
+from traitlets.config import LoggingConfigurable
+
+SESSION_COUNT = Counter(
+    "binderhub_build_session_count",
+    "Counter of build event streams, by whether they started or resumed a session",
+    ["kind"],
+)
+
+
+class BuildSession:
+    """The events of one build and launch, and the task producing them"""
+
+    def __init__(self, session_id, key):
+        self.id = session_id
+        # identifies the requests allowed to attach, e.g. (path, user)
+        self.key = key
+        # serialized events emitted so far
+        self.events = []
+        # the phase of each event, None if unknown
+        self.phases = []
+        self.done = False
+        self.task = None
+        self.clients = 0
+        self._changed = asyncio.Event()
+        self._expire_handle = None
+
+    def event_id(self, index):
+        """The EventSource id of the event at `index`"""
+        return f"{self.id}-{index}"
+
+    def append(self, data, phase=None):
+        """Record an event and wake up the clients"""
+        self.events.append(data)
+        self.phases.append(phase)
+        self._notify()
+
+    def finish(self):
+        """Record that there will be no more events"""
+        self.done = True
+        self._notify()
+
+    def _notify(self):
+        self._changed.set()
+        self._changed = asyncio.Event()
+
+    async def wait(self, index):
+        """Wait until there is an event at `index`, or the session is done"""
+        changed = self._changed
+        if index < len(self.events) or self.done:
+            return
+        await changed.wait()
+
+
+class BuildSessionRegistry(LoggingConfigurable):
+    """In-process registry of build sessions"""
+
+    session_ttl = Integer(
+        60,
+        config=True,
+        help="""
+        Time (in seconds) to keep a session after its last client disconnected,
+        for the client to reconnect.
+
+        Builds and launches of sessions that no client reconnects to
+        within this time are cancelled.
+        """,
+    )
+
+    flush_interval = Float(
+        0.05,
+        config=True,
+        help="""
+        Maximum time (in seconds) an event waits to be sent to a client,
+        so that bursts of log messages are sent in a single write.
+
+        Events that change the phase of the build are sent right away.
+        0 sends every event right away.
+        """,
+    )
+
+    flush_size = Integer(
+        64 * 1024,
+        config=True,
+        help="Number of bytes of events after which they are sent right away",
+    )
+
+    def __init__(self, **kwargs):
+        super().__init__(**kwargs)
+        self.sessions = {}
+
+    def create(self, key):
+        """Create a new session for requests identified by `key`"""
+        session_id = secrets.token_urlsafe(16)
+        session = self.sessions[session_id] = BuildSession(session_id, key)
+        SESSION_COUNT.labels(kind="started").inc()
+        return session
+
+    def get_by_event_id(self, event_id, key):
+        """Get the session of a Last-Event-ID and the index of the next event to send
+
+        Returns (session, index), or (None, 0) if there is no such session
+        or it doesn't belong to `key`.
+        """
+        session_id, _, index = event_id.rpartition("-")
+        session = self.sessions.get(session_id)
+        if session is None or session.key != key:
+            return None, 0
+        try:
+            index = int(index) + 1
+        except ValueError:
+            return None, 0
+        SESSION_COUNT.labels(kind="resumed").inc()
+        return session, index
+
+    def attach(self, session):
+        """Record that a client is following `session`"""
+        session.clients += 1
+        if session._expire_handle is not None:
+            IOLoop.current().remove_timeout(session._expire_handle)
+            session._expire_handle = None
+
+    def detach(self, session):
+        """Record that a client stopped following `session`
+
+        Starts the countdown to expiry of sessions without clients.
+        """
+        session.clients -= 1
+        if session.clients <= 0 and session._expire_handle is None:
+            session._expire_handle = IOLoop.current().call_later(
+                self.session_ttl, self._expire, session
+            )
+
+    def _expire(self, session):
+        session._expire_handle = None
+        if session.clients > 0:
+            return
+        self.sessions.pop(session.id, None)
+        if not session.done and session.task is not None:
+            app_log.info("No client reconnected to build session %s", session.id)
+            session.task.cancel()
@@ -7,6 +7,7 @@ import hashlib
 import json
 import re
 import string
+import sys
 import time
 from http.client import responses
 
@@ -14,47 +15,37 @@ import docker
 import escapism
 from prometheus_client import Counter, Gauge, Histogram
 from tornado.httpclient import HTTPClientError
-from tornado.ioloop import IOLoop
 from tornado.iostream import StreamClosedError
 from tornado.log import app_log
 from tornado.queues import Queue
-from tornado.web import Finish, HTTPError, authenticated
+from tornado.web import HTTPError, authenticated
 
 from .base import BaseHandler
 from .build import ProgressEvent
+from .build_registry import BUILD_SUBSCRIBERS
 from .quota import LaunchQuotaExceeded
+from .utils import SingleFlight
 
-# Separate buckets for builds and launches.
-# Builds and launches have very different characteristic times,
-# and there is a cost to having too many buckets in prometheus.
-BUILD_BUCKETS = [60, 120, 300, 600, 1800, 3600, 7200, float("inf")]
 LAUNCH_BUCKETS = [2, 5, 10, 20, 30, 60, 120, 300, 600, float("inf")]
-BUILD_TIME = Histogram(
-    "binderhub_build_time_seconds",
-    "Histogram of build times",
-    ["status"],
-    buckets=BUILD_BUCKETS,
-)
 LAUNCH_TIME = Histogram(
     "binderhub_launch_time_seconds",
     "Histogram of launch times",
     ["status", "retries"],
     buckets=LAUNCH_BUCKETS,
 )
-BUILD_COUNT = Counter(
-    "binderhub_build_count",
-    "Counter of builds by repo",
-    ["status", "provider", "repo"],
-)
 LAUNCH_COUNT = Counter(
     "binderhub_launch_count",
     "Counter of launches by repo",
     ["status", "provider", "repo"],
 )
-BUILDS_INPROGRESS = Gauge("binderhub_inprogress_builds", "Builds currently in progress")
 LAUNCHES_INPROGRESS = Gauge(
     "binderhub_inprogress_launches", "Launches currently in progress"
 )
+REF_RESOLUTION_COUNT = Counter(
+    "binderhub_ref_resolution_count",
+    "Counter of ref resolutions, by whether they were shared with a concurrent request",
+    ["provider", "shared"],
+)
 
 
 def _get_image_basename_and_tag(full_name):
@@ -140,40 +131,228 @@ def _safe_build_slug(build_slug, limit, hash_length=6):
     ).lower()
 
 
+def _get_image_name(image_prefix, build_slug, ref):
+    """Full name of the image of a repo at a resolved ref"""
+    # Enforces max 255 characters before image
+    safe_build_slug = _safe_build_slug(build_slug, limit=255 - len(image_prefix))
+    return (
+        "{prefix}{build_slug}:{ref}".format(
+            prefix=image_prefix, build_slug=safe_build_slug, ref=ref
+        )
+        .replace("_", "-")
+        .lower()
+    )
+
+
+async def _image_exists(settings, image_name):
+    """Check whether `image_name` has already been built
+
+    Looks in the registry, or in the local docker daemon without a registry.
+    """
+    if settings["use_registry"]:
+        registry = settings["registry"]
+        image_without_tag, image_tag = _get_image_basename_and_tag(image_name)
+        for _ in range(3):
+            try:
+                return await registry.image_exists(image_without_tag, image_tag)
+            except HTTPClientError:
+                app_log.exception(
+                    "Failed to get image manifest for %s",
+                    image_name,
+                )
+        return False
+    else:
+        # Check if the image exists locally!
+        # Assume we're running in single-node mode or all binder pods are assigned to the same node!
+        docker_client = docker.from_env(version="auto")
+        try:
+            docker_client.images.get(image_name)
+        except docker.errors.ImageNotFound:
+            # image doesn't exist, so do a build!
+            return False
+        else:
+            return True
+
+
+async def _start_build(
+    settings, provider, ref, image_name, metric_labels, high_priority=False
+):
+    """Get the build of `image_name` in progress, or start it
+
+    Returns (shared_build, started),
+    where `started` is False if another request already started the build.
+    """
+    build_registry = settings["build_registry"]
+    shared_build = build_registry.get(image_name)
+    if shared_build is not None:
+        return shared_build, False
+
+    BuildClass = settings.get("build_class")
+    build = BuildClass(
+        # All other properties should be set in traitlets config
+        parent=settings["traitlets_parent"],
+        q=Queue(),
+        name=_generate_build_name(provider.get_build_slug(), ref, prefix="build-"),
+        repo_url=provider.get_repo_url(),
+        ref=ref,
+        image_name=image_name,
+        git_credentials=provider.git_credentials,
+    )
+    on_built = None
+    if settings["use_registry"]:
+        registry = settings["registry"]
+        image_without_tag, image_tag = _get_image_basename_and_tag(image_name)
+        push_token = await registry.get_credentials(image_without_tag, image_tag)
+        if push_token:
+            build.registry_credentials = push_token
+        if build.cache_from_previous:
+            # reuse the layers of the last image of this repo
+            previous_tag = registry.latest_tag(image_without_tag)
+            if previous_tag and previous_tag != image_tag:
+                # the full name, with the registry
+                build.cache_from = [image_name.rsplit(":", 1)[0] + f":{previous_tag}"]
+        prepuller = settings.get("image_prepuller")
+
+        def mark_built():
+            registry.mark_image_built(image_without_tag, image_tag)
+            if prepuller is not None:
+                # pull the new image onto user nodes before it is launched
+                prepuller.image_built(image_name)
+
+        on_built = mark_built
+    else:
+        build.push_secret = ""
+
+    # check again, another request may have started
+    # the same build while we were waiting for credentials
+    shared_build = build_registry.get(image_name)
+    if shared_build is not None:
+        return shared_build, False
+    shared_build = build_registry.start(
+        build,
+        settings["build_pool"],
+        metric_labels=metric_labels,
+        on_built=on_built,
+        high_priority=high_priority,
+    )
+    return shared_build, True
+
+
 class BuildHandler(BaseHandler):
     """A handler for working with GitHub."""
 
     # emit keepalives every 25 seconds to avoid idle connections being closed
     KEEPALIVE_INTERVAL = 25
-    build = None
-
-    async def emit(self, data):
-        """Emit an eventstream event"""
+    shared_build = None
+    build_q = None
+    # the session this request runs, if it started one
+    session = None
+    # the session this request streams events from
+    _attached_session = None
+    _stream_closed = False
+
+    # ref resolutions in progress, by provider class and resolution key
+    _ref_resolutions = SingleFlight()
+
+    async def emit(self, data, phase=None):
+        """Emit an eventstream event
+
+        Events are recorded in the session,
+        and sent to the clients following it by `stream_session`.
+        `phase` is the phase of an already serialized event, if known.
+        """
         if type(data) is not str:
             serialized_data = json.dumps(data)
+            phase = data.get("phase")
         else:
             serialized_data = data
-        try:
-            self.write(f"data: {serialized_data}\n\n")
-            await self.flush()
-        except StreamClosedError:
-            # Log extra when builds drop, as this may correlate with bot traffic
-            # (also lots of impatient humans and slow builds)
-            app_log.warning(
-                "Stream closed while handling %s, ip=%s, user_agent=%r",
-                self.request.uri,
-                self.request.remote_ip,
-                self.request.headers.get("User-Agent", None),
-            )
-            # raise Finish to halt the handler
-            raise Finish()
+        self.session.append(serialized_data, phase=phase)
+
+    async def stream_session(self, session, index=0):
+        """Send the events of `session` from `index` on, until it is done
+
+        Writes are coalesced: events are flushed to the client
+        when `flush_size` bytes are buffered, `flush_interval` seconds after
+        the first buffered event, on phase changes and at the end of the session.
+        """
+        sessions = self.settings["build_sessions"]
+        sessions.attach(session)
+        self._attached_session = session
+        last_phase = None
+        buffered = 0
+        flush_deadline = None
+        while not self._stream_closed:
+            flush_now = False
+            while index < len(session.events):
+                chunk = (
+                    f"id: {session.event_id(index)}\n"
+                    f"data: {session.events[index]}\n\n"
+                )
+                self.write(chunk)
+                buffered += len(chunk)
+                phase = session.phases[index]
+                if phase is not None:
+                    if phase != last_phase:
+                        flush_now = True
+                    last_phase = phase
+                index += 1
+            if buffered == 0:
+                if session.done:
+                    return
+                await session.wait(index)
+                continue
+
+            now = time.monotonic()
+            if flush_deadline is None:
+                flush_deadline = now + sessions.flush_interval
+            if not (
+                flush_now
+                or session.done
+                or buffered >= sessions.flush_size
+                or now >= flush_deadline
+            ):
+                # wait a little for more events to send along
+                try:
+                    await asyncio.wait_for(
+                        session.wait(index), timeout=flush_deadline - now
+                    )
+                except asyncio.TimeoutError:
+                    pass
+                continue
+
+            buffered = 0
+            flush_deadline = None
+            try:
+                await self.flush()
+            except StreamClosedError:
+                # Log extra when builds drop, as this may correlate with bot traffic
+                # (also lots of impatient humans and slow builds)
+                app_log.warning(
+                    "Stream closed while handling %s, ip=%s, user_agent=%r",
+                    self.request.uri,
+                    self.request.remote_ip,
+                    self.request.headers.get("User-Agent", None),
+                )
+                return
+
+    def _detach_session(self):
+        if self._attached_session is not None:
+            self.settings["build_sessions"].detach(self._attached_session)
+            self._attached_session = None
+
+    def on_connection_close(self):
+        """Stop following the session when the client goes away
+
+        The build and launch go on for a while, in case the client reconnects.
+        """
+        super().on_connection_close()
+        self._stream_closed = True
+        self._detach_session()
 
     def on_finish(self):
         """Stop keepalive when finish has been called"""
         self._keepalive = False
-        if self.build:
-            # if we have a build, tell it to stop watching
-            self.build.stop()
+        self._detach_session()
 
     async def keep_alive(self):
         """Constantly emit keepalive events
@@ -253,6 +432,27 @@ class BuildHandler(BaseHandler):
 
         return build_only
 
+    async def resolve_ref(self, provider):
+        """Resolve the ref of a provider
+
+        Concurrent requests for providers with the same resolution key
+        share a single resolution, and only its result: the resolved ref.
+        """
+        key = provider.get_resolution_key()
+        if key is None:
+            ref = await provider.get_resolved_ref()
+            shared = False
+        else:
+            ref, shared = await self._ref_resolutions.run(
+                (type(provider), key), provider.get_resolved_ref
+            )
+            if shared:
+                provider.use_resolved_ref(ref)
+        REF_RESOLUTION_COUNT.labels(
+            provider=provider.name, shared=str(shared).lower()
+        ).inc()
+        return ref
+
     def redirect(self, *args, **kwargs):
         # disable redirect to login, which won't work for EventSource
         raise HTTPError(403)
@@ -286,6 +486,27 @@ class BuildHandler(BaseHandler):
                 repo, ref, etc.)
 
         """
+        sessions = self.settings["build_sessions"]
+        # identifies the requests allowed to resume a session
+        user = self.current_user
+        if isinstance(user, dict):
+            user = user["name"]
+        session_key = (self.request.path, user)
+
+        last_event_id = self.request.headers.get("Last-Event-ID")
+        if last_event_id:
+            session, index = sessions.get_by_event_id(last_event_id, session_key)
+            if session is not None:
+                if session.done and index >= len(session.events):
+                    # the client has seen everything,
+                    # 204 tells EventSource clients to stop reconnecting
+                    self.set_status(204)
+                    return
+                app_log.info("Resuming build session %s at %s", session.id, index)
+                asyncio.create_task(self.keep_alive())
+                await self.stream_session(session, index)
+                return
+
         prefix = "/build/" + provider_prefix
         spec = self.get_spec_from_request(prefix)
 
@@ -294,6 +515,52 @@ class BuildHandler(BaseHandler):
         self.check_build_token(build_token, f"{provider_prefix}/{spec}")
         self.check_rate_limit()
 
+        # run the build and launch independently of this connection,
+        # so a reconnecting client can pick them up again
+        self.session = session = sessions.create(session_key)
+        session.task = asyncio.ensure_future(
+            self.run_session(provider_prefix, spec)
+        )
+        # create a heartbeat
+        asyncio.create_task(self.keep_alive())
+        await self.stream_session(session)
+
+    async def run_session(self, provider_prefix, spec):
+        """Build and launch, recording events in the session"""
+        try:
+            await self.build_and_launch(provider_prefix, spec)
+        except asyncio.CancelledError:
+            app_log.info("Cancelled build session %s", self.session.id)
+            raise
+        except LaunchQuotaExceeded:
+            # already reported
+            pass
+        except Exception as e:
+            # report errors like send_error would have
+            if isinstance(e, HTTPError):
+                status_code = e.status_code
+            else:
+                app_log.exception("Error in build session %s", self.session.id)
+                status_code = 500
+            message = self.extract_message(sys.exc_info())
+            if not message:
+                message = responses.get(status_code, "Unknown HTTP Error")
+            await self.emit(
+                {
+                    "phase": "failed",
+                    "status_code": status_code,
+                    "message": message + "\n",
+                }
+            )
+        finally:
+            if self.shared_build:
+                # if we are following a build, stop following it.
+                # The build stops watching when nobody follows it anymore.
+                self.shared_build.unsubscribe(self.build_q)
+            self.session.finish()
+
+    async def build_and_launch(self, provider_prefix, spec):
+        """Build the image for a spec if needed, and launch it"""
         # Verify if the provider is valid for EventSource.
         # EventSource cannot handle HTTP errors, so we must validate and send
         # error messages on the eventsource.
@@ -301,8 +568,6 @@ class BuildHandler(BaseHandler):
             await self.fail(f"No provider found for prefix {provider_prefix}")
             return
 
-        # create a heartbeat
-        asyncio.create_task(self.keep_alive())
         spec = spec.rstrip("/")
         key = f"{provider_prefix}:{spec}"
 
@@ -336,7 +601,7 @@ class BuildHandler(BaseHandler):
         }
 
         try:
-            ref = await provider.get_resolved_ref()
+            ref = await self.resolve_ref(provider)
         except Exception as e:
             await self.fail(f"Error resolving ref for {key}: {e}")
             return
@@ -363,7 +628,7 @@ class BuildHandler(BaseHandler):
                     unresolved_ref = provider.unresolved_ref
                     try:
                         provider = self.get_provider(provider_prefix, spec=spec)
-                        ref = await provider.get_resolved_ref()
+                        ref = await self.resolve_ref(provider)
                     except Exception as e:
                         # if this fails, leave ref as None, which will fail below
                         self.log.error(f"Error redirecting {key} to HEAD: {e}")
@@ -405,53 +670,10 @@ class BuildHandler(BaseHandler):
             spec=resolved_spec,
         )
 
-        # generate a complete build name (for GitHub: `build-{user}-{repo}-{ref}`)
-
-        image_prefix = self.settings["image_prefix"]
-
-        # Enforces max 255 characters before image
-        safe_build_slug = _safe_build_slug(
-            provider.get_build_slug(), limit=255 - len(image_prefix)
-        )
-
-        build_name = _generate_build_name(
-            provider.get_build_slug(), ref, prefix="build-"
+        image_name = self.image_name = _get_image_name(
+            self.settings["image_prefix"], provider.get_build_slug(), ref
         )
-
-        image_name = self.image_name = (
-            "{prefix}{build_slug}:{ref}".format(
-                prefix=image_prefix, build_slug=safe_build_slug, ref=ref
-            )
-            .replace("_", "-")
-            .lower()
-        )
-
-        image_without_tag, image_tag = _get_image_basename_and_tag(image_name)
-        if self.settings["use_registry"]:
-            for _ in range(3):
-                try:
-                    image_manifest = await self.registry.get_image_manifest(
-                        image_without_tag, image_tag
-                    )
-                    image_found = bool(image_manifest)
-                    break
-                except HTTPClientError:
-                    app_log.exception(
-                        "Failed to get image manifest for %s",
-                        image_name,
-                    )
-                    image_found = False
-        else:
-            # Check if the image exists locally!
-            # Assume we're running in single-node mode or all binder pods are assigned to the same node!
-            docker_client = docker.from_env(version="auto")
-            try:
-                docker_client.images.get(image_name)
-            except docker.errors.ImageNotFound:
-                # image doesn't exist, so do a build!
-                image_found = False
-            else:
-                image_found = True
+        image_found = await _image_exists(self.settings, image_name)
 
         try:
             self.launch_options = provider.get_launch_options()
@@ -491,132 +713,79 @@ class BuildHandler(BaseHandler):
         except LaunchQuotaExceeded:
             return
 
-        # Prepare to build
-        q = Queue()
-
-        BuildClass = self.settings.get("build_class")
-
-        build = BuildClass(
-            # All other properties should be set in traitlets config
-            parent=self.settings["traitlets_parent"],
-            q=q,
-            name=build_name,
-            repo_url=repo_url,
-            ref=ref,
-            image_name=image_name,
-            git_credentials=provider.git_credentials,
+        # join the build of this image if another request already started it
+        shared_build, started = await _start_build(
+            self.settings,
+            provider,
+            ref,
+            image_name,
+            metric_labels=self.repo_metric_labels,
+            high_priority=provider.has_higher_quota(),
         )
-        if self.settings["use_registry"]:
-            push_token = await self.registry.get_credentials(
-                image_without_tag, image_tag
-            )
-            if push_token:
-                build.registry_credentials = push_token
+        if started:
+            BUILD_SUBSCRIBERS.labels(kind="started").inc()
         else:
-            build.push_secret = ""
-
-        self.build = build
-
-        with BUILDS_INPROGRESS.track_inprogress():
-            done = False
-            failed = False
+            app_log.info("Joining build of %s already in progress", image_name)
+            BUILD_SUBSCRIBERS.labels(kind="joined").inc()
 
-            def _check_result(future):
-                nonlocal done
-                nonlocal failed
-                try:
-                    r = future.result()
-                    app_log.debug("Build task completed: %s", r)
-                except Exception:
-                    app_log.error("Build task failed", exc_info=True)
-                    done = True
-                    failed = True
-                    # make sure to wake the `await q.get()` below with a message
-                    build.progress(
-                        ProgressEvent.Kind.LOG_MESSAGE,
-                        json.dumps(
-                            {
-                                "phase": ProgressEvent.BuildStatus.FAILED.value,
-                                "message": "Unhandled error watching for build events. Please try again.\n",
-                            }
-                        ),
-                    )
-
-            build_starttime = time.perf_counter()
-            pool = self.settings["build_pool"]
-            # Start building
-            submit_future = pool.submit(build.submit)
-            submit_future.add_done_callback(_check_result)
-            IOLoop.current().add_callback(lambda: submit_future)
+        self.shared_build = shared_build
+        q = self.build_q = shared_build.subscribe()
+        if build_only:
+            # the image is wanted even if this request goes away
+            shared_build.reap_when_abandoned = False
 
-            log_future = None
+        done = False
+        failed = False
 
-            # initial waiting event
-            await self.emit(
-                {
-                    "phase": "waiting",
-                    "message": "Waiting for build to start...\n",
-                }
-            )
+        # initial waiting event
+        await self.emit(
+            {
+                "phase": "waiting",
+                "message": "Waiting for build to start...\n",
+            }
+        )
 
-            while not done:
-                progress = await q.get()
-                # FIXME: If pod goes into an unrecoverable stage, such as ImagePullBackoff or
-                # whatever, we should fail properly.
-                if progress.kind == ProgressEvent.Kind.BUILD_STATUS_CHANGE:
-                    phase = progress.payload.value
-                    if progress.payload == ProgressEvent.BuildStatus.PENDING:
-                        # nothing to do, just waiting
-                        continue
-                    elif progress.payload == ProgressEvent.BuildStatus.BUILT:
-                        if build_only:
-                            message = "Done! Image built\n"
-                            phase = "ready"
-                        else:
-                            message = "Built image, launching...\n"
-                        event = {
-                            "phase": phase,
-                            "message": message,
-                            "imageName": image_name,
-                        }
-                        BUILD_TIME.labels(status="success").observe(
-                            time.perf_counter() - build_starttime
-                        )
-                        BUILD_COUNT.labels(
-                            status="success", **self.repo_metric_labels
-                        ).inc()
-                        done = True
-                    elif progress.payload == ProgressEvent.BuildStatus.RUNNING:
-                        # start capturing build logs once the pod is running
-                        if log_future is None:
-                            log_future = pool.submit(build.stream_logs)
-                            log_future.add_done_callback(_check_result)
-                        continue
-                    elif progress.payload == ProgressEvent.BuildStatus.BUILT:
-                        # Do nothing, is ok!
-                        continue
-                    elif progress.payload == ProgressEvent.BuildStatus.FAILED:
-                        event = {"phase": phase}
-                    elif progress.payload == ProgressEvent.BuildStatus.UNKNOWN:
-                        event = {"phase": phase}
+        while not done:
+            progress = await q.get()
+            if progress.kind == ProgressEvent.Kind.BUILD_STATUS_CHANGE:
+                phase = progress.payload.value
+                if progress.payload in (
+                    ProgressEvent.BuildStatus.PENDING,
+                    ProgressEvent.BuildStatus.RUNNING,
+                ):
+                    # nothing to do, just waiting
+                    # (build logs are streamed by the shared build)
+                    continue
+                elif progress.payload == ProgressEvent.BuildStatus.BUILT:
+                    if build_only:
+                        message = "Done! Image built\n"
+                        phase = "ready"
                     else:
-                        raise ValueError(
-                            f"Found unknown phase {phase} in ProgressEvent"
-                        )
-                elif progress.kind == ProgressEvent.Kind.LOG_MESSAGE:
-                    # The logs are coming out of repo2docker, so we expect
-                    # them to be JSON structured anyway
-                    event = progress.payload
-                    payload = json.loads(event)
-                    if payload.get("phase") in ("failure", "failed"):
-                        failed = True
-                        BUILD_TIME.labels(status="failure").observe(
-                            time.perf_counter() - build_starttime
-                        )
-                        BUILD_COUNT.labels(
-                            status="failure", **self.repo_metric_labels
-                        ).inc()
-                await self.emit(event)
+                        message = "Built image, launching...\n"
+                    event = {
+                        "phase": phase,
+                        "message": message,
+                        "imageName": image_name,
+                    }
+                    done = True
+                elif progress.payload == ProgressEvent.BuildStatus.FAILED:
+                    event = {"phase": phase}
+                    # the shared build stops watching after a failure,
+                    # no more events will come
+                    failed = True
+                    done = True
+                elif progress.payload == ProgressEvent.BuildStatus.UNKNOWN:
+                    event = {"phase": phase}
+                else:
+                    raise ValueError(f"Found unknown phase {phase} in ProgressEvent")
+            elif progress.kind == ProgressEvent.Kind.LOG_MESSAGE:
+                # The logs are coming out of repo2docker, so we expect
+                # them to be JSON structured anyway
+                event = progress.payload
+                phase = progress.phase or None
+                if phase in ("failure", "failed"):
+                    failed = True
+            await self.emit(event, phase=phase)
 
         if build_only:
             return
@@ -627,16 +796,6 @@ class BuildHandler(BaseHandler):
                 await self.launch(provider)
             self.emit_launch_event(provider, spec, ref)
 
-        # Don't close the eventstream immediately.
-        # (javascript) eventstream clients reconnect automatically on dropped connections,
-        # so if the server closes the connection first,
-        # the client will reconnect which starts a new build.
-        # If we sleep here, that makes it more likely that a well-behaved
-        # client will close its connection first.
-        # The duration of this shouldn't matter because
-        # well-behaved clients will close connections after they receive the launch event.
-        await asyncio.sleep(60)
-
     def emit_launch_event(self, provider, spec, ref):
         """Emit a single launch event to the activity log"""
         host = (
@@ -693,6 +852,28 @@ class BuildHandler(BaseHandler):
             await self.fail(e.message)
             raise
 
+    def get_launch_args(self, provider, client_ip):
+        """The extra_args of a launch: environment, annotations and launch options"""
+        extra_args = {
+            'environment': {},
+            'extra_annotations': {
+                'binder.jupyter.org/provider': provider.name,
+                'binder.jupyter.org/spec': provider.spec,
+            }
+        }
+        for k,v in {
+                'repo_url': self.ref_url,
+                'ref_url': self.ref_url,
+                'launch_host': self.binder_launch_host,
+                'request': self.binder_request,
+                'persistent_request': self.binder_persistent_request,
+                'client_ip': client_ip,
+            }.items():
+            extra_args['environment']['BINDER_'+k.upper()] = v
+            extra_args['extra_annotations']['binder.jupyter.org/'+k] = v
+        extra_args.update(self.launch_options or {})
+        return extra_args
+
     async def launch(self, provider):
         """Ask JupyterHub to launch the image."""
         quota_check = await self.check_quota(provider)
@@ -709,6 +890,27 @@ class BuildHandler(BaseHandler):
                 quota_check.total,
             )
 
+        warm_pool = self.settings.get("warm_pool")
+        if warm_pool is not None:
+            # an idle server already running the image, if any.
+            # Warm servers are started before the request claiming them,
+            # without its client IP.
+            server_info = await warm_pool.claim(
+                self.image_name,
+                self.repo_url,
+                extra_args=self.get_launch_args(provider, client_ip=""),
+                repo_config=provider.repo_config(self.settings),
+            )
+            if server_info is not None:
+                LAUNCH_COUNT.labels(
+                    status="success",
+                    **self.repo_metric_labels,
+                ).inc()
+                app_log.info("Launched %s from the warm pool", self.repo_url)
+                self.settings["image_prepuller"].record_launch(self.image_name)
+                await self.emit_ready(server_info)
+                return
+
         await self.emit(
             {
                 "phase": "launching",
@@ -717,6 +919,7 @@ class BuildHandler(BaseHandler):
         )
 
         client_ip = self.request.remote_ip
+        extra_args = self.get_launch_args(provider, client_ip)
 
         launcher = self.settings["launcher"]
         retry_delay = launcher.retry_delay
@@ -746,24 +949,6 @@ class BuildHandler(BaseHandler):
                         }
                     )
 
-                extra_args = {
-                    'environment': {},
-                    'extra_annotations': {
-                        'binder.jupyter.org/provider': provider.name,
-                        'binder.jupyter.org/spec': provider.spec,
-                    }
-                }
-                for k,v in {
-                        'repo_url': self.ref_url,
-                        'ref_url': self.ref_url,
-                        'launch_host': self.binder_launch_host,
-                        'request': self.binder_request,
-                        'persistent_request': self.binder_persistent_request,
-                        'client_ip': client_ip,
-                    }.items():
-                    extra_args['environment']['BINDER_'+k.upper()] = v
-                    extra_args['extra_annotations']['binder.jupyter.org/'+k] = v
-                extra_args.update(self.launch_options)
                 server_info = await launcher.launch(
                     image=self.image_name,
                     username=username,
@@ -824,7 +1009,12 @@ class BuildHandler(BaseHandler):
                     **self.repo_metric_labels,
                 ).inc()
                 app_log.info("Launched %s in %.0fs", self.repo_url, duration)
+                self.settings["image_prepuller"].record_launch(self.image_name)
                 break
+        await self.emit_ready(server_info)
+
+    async def emit_ready(self, server_info):
+        """Tell the client where its server is running"""
         event = {
             "phase": "ready",
             "message": f"server running at {server_info['url']}\n",
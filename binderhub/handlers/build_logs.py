@@ -0,0 +1,31 @@
+import os
+
+from jupyterhub.services.auth import HubOAuth
+from tornado import web
+
+from ..base import BaseHandler
+from ..build_logs import log_filename
+
+
+class BuildLogsHandler(BaseHandler, web.StaticFileHandler):
+    """Serve the compressed log of the last build of an image
+
+    Supports range requests, to resume downloads of large logs.
+    """
+
+    def initialize(self, path):
+        # BaseHandler.initialize doesn't pass arguments on
+        web.StaticFileHandler.initialize(self, path)
+        if self.settings["auth_enabled"]:
+            self.hub_auth = HubOAuth.instance(config=self.settings["traitlets_config"])
+
+    @classmethod
+    def get_absolute_path(cls, root, path):
+        return os.path.abspath(os.path.join(root, log_filename(path)))
+
+    def get_content_type(self):
+        return "application/gzip"
+
+    @web.authenticated
+    async def get(self, image_name, include_body=True):
+        await super().get(image_name, include_body=include_body)
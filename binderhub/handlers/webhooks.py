@@ -0,0 +1,138 @@
+"""
+Push webhooks, starting prebuilds of pushed commits.
+"""
+
+import hashlib
+import hmac
+import json
+import urllib.parse
+
+from tornado import web
+from tornado.log import app_log
+
+from ..base import BaseHandler
+from ..prebuild import prebuild
+from ..repoproviders import GitHubRepoProvider, GitLabRepoProvider
+
+# the sha of a deleted ref
+_NULL_SHA = "0" * 40
+
+
+class WebhookHandler(BaseHandler):
+    """Base class for push webhooks
+
+    Subclasses verify the request and call `prebuild(spec, sha)`.
+    Requests are authenticated by their signature, not by a user.
+    """
+
+    provider_class = None
+
+    def check_xsrf_cookie(self):
+        pass
+
+    def write_status(self, status, status_code=200):
+        self.set_status(status_code)
+        self.set_header("Content-Type", "application/json")
+        self.write(json.dumps({"status": status}))
+
+    def get_provider_prefix(self):
+        """The prefix of the provider of pushed repos, if it is enabled"""
+        for prefix, provider_class in self.settings["repo_providers"].items():
+            if issubclass(provider_class, self.provider_class):
+                return prefix
+        return None
+
+    async def prebuild(self, spec, sha):
+        """Start a prebuild of `spec`, which is pushed commit `sha`"""
+        provider_prefix = self.get_provider_prefix()
+        if provider_prefix is None:
+            raise web.HTTPError(404, f"{self.provider_class.__name__} is not enabled")
+        provider = self.get_provider(provider_prefix, spec=spec)
+        if provider.is_banned():
+            app_log.info("Not prebuilding banned spec %s", spec)
+            self.write_status("banned", 403)
+            return
+        if not provider.allows_prebuild():
+            app_log.info("Not prebuilding spec %s, not in prebuild_specs", spec)
+            self.write_status("not allowed", 403)
+            return
+        # the signed payload tells us what the ref resolves to
+        provider.resolved_ref = sha
+        status = await prebuild(self.settings, provider)
+        app_log.info("Prebuild of %s/%s: %s", provider_prefix, spec, status)
+        self.write_status(status, 202)
+
+
+class GitHubWebhookHandler(WebhookHandler):
+    """Start prebuilds on pushes to GitHub repos
+
+    Configure the webhook with content type application/json
+    and BinderHub.github_webhook_secret as secret.
+    """
+
+    provider_class = GitHubRepoProvider
+
+    def verify_signature(self):
+        secret = self.settings["github_webhook_secret"]
+        signature = self.request.headers.get("X-Hub-Signature-256", "")
+        expected = (
+            "sha256="
+            + hmac.new(
+                secret.encode("utf8"), self.request.body, hashlib.sha256
+            ).hexdigest()
+        )
+        if not hmac.compare_digest(signature.encode("utf8"), expected.encode("utf8")):
+            raise web.HTTPError(403, "Invalid webhook signature")
+
+    async def post(self):
+        self.verify_signature()
+        event = self.request.headers.get("X-GitHub-Event", "")
+        if event == "ping":
+            self.write_status("pong")
+            return
+        if event != "push":
+            self.write_status("ignored")
+            return
+        try:
+            payload = json.loads(self.request.body)
+            full_name = payload["repository"]["full_name"]
+            sha = payload["after"]
+        except (ValueError, KeyError, TypeError):
+            raise web.HTTPError(400, "Invalid push payload")
+        if payload.get("deleted") or sha == _NULL_SHA:
+            self.write_status("ignored")
+            return
+        await self.prebuild(f"{full_name}/{sha}", sha)
+
+
+class GitLabWebhookHandler(WebhookHandler):
+    """Start prebuilds on pushes to GitLab repos
+
+    Configure the webhook with BinderHub.gitlab_webhook_secret as secret token.
+    """
+
+    provider_class = GitLabRepoProvider
+
+    def verify_signature(self):
+        secret = self.settings["gitlab_webhook_secret"]
+        token = self.request.headers.get("X-Gitlab-Token", "")
+        if not hmac.compare_digest(token.encode("utf8"), secret.encode("utf8")):
+            raise web.HTTPError(403, "Invalid webhook token")
+
+    async def post(self):
+        self.verify_signature()
+        event = self.request.headers.get("X-Gitlab-Event", "")
+        if event not in ("Push Hook", "Tag Push Hook"):
+            self.write_status("ignored")
+            return
+        try:
+            payload = json.loads(self.request.body)
+            namespace = payload["project"]["path_with_namespace"]
+            sha = payload.get("checkout_sha") or payload["after"]
+        except (ValueError, KeyError, TypeError):
+            raise web.HTTPError(400, "Invalid push payload")
+        if not sha or sha == _NULL_SHA:
+            self.write_status("ignored")
+            return
+        quoted_namespace = urllib.parse.quote(namespace, safe="")
+        await self.prebuild(f"{quoted_namespace}/{sha}", sha)
@@ -225,6 +225,16 @@ class KubernetesHealthHandler(HealthHandler):
             "app=jupyterhub,component=singleuser-server",
             "component=binderhub-build",
         ]
+        pod_cache = self.settings.get("pod_cache")
+        if pod_cache is not None:
+            pods = [
+                pod_cache.list_pods(namespace, label_selector)
+                for label_selector in label_selectors
+            ]
+            if all(p is not None for p in pods):
+                return pods
+            app_log.warning("Pod cache is out of date, listing pods")
+
         requests = [
             asyncio.wrap_future(
                 pool.submit(
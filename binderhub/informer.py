@@ -0,0 +1,336 @@
+"""
+A local cache of kubernetes pods, kept up to date by a single watch.
+
+Instead of every build watching its own pod,
+one thread watches all pods matching a label selector
+and dispatches changes to handlers registered per pod name
+on the main event loop.
+"""
+
+import json
+import threading
+import time
+from collections import Counter, defaultdict
+
+from kubernetes import client, watch
+from tornado.ioloop import IOLoop
+from tornado.log import app_log
+from traitlets import Any, Integer, Unicode
+from traitlets.config import LoggingConfigurable
+from urllib3.exceptions import ReadTimeoutError
+
+from .utils import KUBE_REQUEST_TIMEOUT
+
+
+class PodInformer(LoggingConfigurable):
+    """Watch the pods matching a label selector in a namespace
+
+    Pods are stored as the raw JSON dicts returned by the kubernetes API.
+
+    All state is only modified on the main event loop,
+    the watch thread only reads from kubernetes and schedules callbacks.
+    """
+
+    api = Any(
+        help="Kubernetes API object to make requests (kubernetes.client.CoreV1Api())",
+    )
+
+    namespace = Unicode(help="Kubernetes namespace to watch")
+
+    label_selector = Unicode(help="Label selector of the pods to watch")
+
+    watch_timeout = Integer(
+        300,
+        help="""
+        Timeout (in seconds) of a single watch request.
+        The watch is restarted from the last seen resourceVersion when it times out.
+        """,
+        config=True,
+    )
+
+    retry_delay = Integer(
+        5,
+        help="Delay (in seconds) before restarting the watch after an error.",
+        config=True,
+    )
+
+    def __init__(self, **kwargs):
+        super().__init__(**kwargs)
+        self.main_loop = IOLoop.current()
+        # pod name -> pod dict
+        self.pods = {}
+        # pod name -> list of callbacks
+        self._handlers = defaultdict(list)
+        # index name -> (function returning the keys of a pod, Counter of keys)
+        self._indexes = {}
+        self._stop_event = threading.Event()
+        self._thread = None
+        # time of the last successful list or watch event, None until the first list
+        self.last_sync = None
+
+    def start(self):
+        """Start watching in a background thread"""
+        if self._thread is not None:
+            return
+        self._thread = threading.Thread(
+            target=self._run,
+            name=f"informer-{self.label_selector}",
+            daemon=True,
+        )
+        self._thread.start()
+
+    def stop(self):
+        """Stop watching"""
+        self._stop_event.set()
+
+    def add_handler(self, name, callback):
+        """Call `callback(event_type, pod)` for every change to the pod `name`
+
+        If `name` is None, `callback` is called for changes to any pod.
+        If the pod is already known, `callback` is called right away with an
+        ``ADDED`` event, so the caller doesn't miss the current state.
+        Must be called on the main event loop.
+        """
+        self._handlers[name].append(callback)
+        if name is None:
+            for pod in list(self.pods.values()):
+                callback("ADDED", pod)
+        elif name in self.pods:
+            callback("ADDED", self.pods[name])
+
+    def add_count_index(self, index_name, get_keys):
+        """Maintain a count of pods per key
+
+        `get_keys(pod)` returns the collection of keys a pod is counted under.
+        Counts are read with `count(index_name, key)`.
+        """
+        counts = Counter()
+        for pod in self.pods.values():
+            counts.update(set(get_keys(pod)))
+        self._indexes[index_name] = (get_keys, counts)
+
+    def count(self, index_name, key):
+        """Number of pods counted under `key` in the index `index_name`"""
+        return self._indexes[index_name][1][key]
+
+    def is_fresh(self, max_age):
+        """Whether the cache was known to be in sync less than `max_age` seconds ago"""
+        if self.last_sync is None:
+            # not listed yet, no pods is not the same as no data
+            return False
+        return time.monotonic() - self.last_sync < max_age
+
+    def _update_indexes(self, old_pod, new_pod):
+        for get_keys, counts in self._indexes.values():
+            old_keys = set(get_keys(old_pod)) if old_pod is not None else set()
+            new_keys = set(get_keys(new_pod)) if new_pod is not None else set()
+            for key in old_keys - new_keys:
+                counts[key] -= 1
+                if counts[key] <= 0:
+                    # drop keys without pods, so the index doesn't grow forever
+                    del counts[key]
+            for key in new_keys - old_keys:
+                counts[key] += 1
+
+    def remove_handler(self, name, callback):
+        """Stop calling `callback` for changes to the pod `name`"""
+        handlers = self._handlers.get(name, [])
+        if callback in handlers:
+            handlers.remove(callback)
+        if not handlers:
+            self._handlers.pop(name, None)
+
+    def _dispatch(self, event_type, pod):
+        name = pod["metadata"]["name"]
+        # copy, handlers may remove themselves
+        callbacks = self._handlers.get(name, []) + self._handlers.get(None, [])
+        for callback in callbacks:
+            try:
+                callback(event_type, pod)
+            except Exception:
+                app_log.exception(
+                    "Error handling %s event for pod %s", event_type, name
+                )
+
+    def _handle_list(self, pods):
+        """Replace the cache with the result of a full list"""
+        old_pods = self.pods
+        self.pods = pods
+        self.last_sync = time.monotonic()
+        for get_keys, counts in self._indexes.values():
+            counts.clear()
+            for pod in pods.values():
+                counts.update(set(get_keys(pod)))
+        # pods that disappeared while we weren't watching
+        for name, pod in old_pods.items():
+            if name not in pods:
+                self._dispatch("DELETED", pod)
+        for name, pod in pods.items():
+            if old_pods.get(name) != pod:
+                self._dispatch("MODIFIED" if name in old_pods else "ADDED", pod)
+
+    def _handle_event(self, event_type, pod):
+        """Apply a single watch event to the cache"""
+        name = pod["metadata"]["name"]
+        if event_type == "DELETED":
+            old_pod = self.pods.pop(name, None)
+            self._update_indexes(old_pod, None)
+        else:
+            old_pod = self.pods.get(name)
+            self.pods[name] = pod
+            self._update_indexes(old_pod, pod)
+        self.last_sync = time.monotonic()
+        self._dispatch(event_type, pod)
+
+    def _handle_sync(self):
+        self.last_sync = time.monotonic()
+
+    def _list(self):
+        """List all pods, returns the resourceVersion to start watching from"""
+        resp = self.api.list_namespaced_pod(
+            self.namespace,
+            label_selector=self.label_selector,
+            _request_timeout=KUBE_REQUEST_TIMEOUT,
+            _preload_content=False,
+        )
+        pod_list = json.loads(resp.read())
+        pods = {pod["metadata"]["name"]: pod for pod in pod_list["items"]}
+        self.main_loop.add_callback(self._handle_list, pods)
+        return pod_list["metadata"]["resourceVersion"]
+
+    def _watch(self, resource_version):
+        """Watch from `resource_version` until the watch times out
+
+        Returns the last seen resourceVersion,
+        or None if we need to list again.
+        """
+        w = watch.Watch()
+        try:
+            for event in w.stream(
+                self.api.list_namespaced_pod,
+                self.namespace,
+                label_selector=self.label_selector,
+                resource_version=resource_version,
+                allow_watch_bookmarks=True,
+                timeout_seconds=self.watch_timeout,
+                _request_timeout=(KUBE_REQUEST_TIMEOUT, self.watch_timeout + 5),
+            ):
+                if self._stop_event.is_set():
+                    return None
+                event_type = event["type"]
+                pod = event["raw_object"]
+                if event_type == "ERROR":
+                    if pod.get("code") == 410:
+                        # our resourceVersion is too old
+                        app_log.info("Pod watch for %s expired", self.label_selector)
+                        return None
+                    raise client.rest.ApiException(
+                        status=pod.get("code"), reason=pod.get("message")
+                    )
+                resource_version = pod["metadata"]["resourceVersion"]
+                if event_type == "BOOKMARK":
+                    self.main_loop.add_callback(self._handle_sync)
+                else:
+                    self.main_loop.add_callback(self._handle_event, event_type, pod)
+        except client.rest.ApiException as e:
+            if e.status == 410:
+                return None
+            raise
+        finally:
+            w.stop()
+        # the watch ended without error, we were in sync until now
+        self.main_loop.add_callback(self._handle_sync)
+        return resource_version
+
+    def _run(self):
+        app_log.info("Watching pods with %s in %s", self.label_selector, self.namespace)
+        resource_version = None
+        while not self._stop_event.is_set():
+            try:
+                if resource_version is None:
+                    resource_version = self._list()
+                resource_version = self._watch(resource_version)
+            except ReadTimeoutError:
+                # just retry after timeout, don't fail
+                app_log.warning("Timeout in pod watch for %s", self.label_selector)
+            except Exception:
+                app_log.exception("Error in pod watch for %s", self.label_selector)
+                resource_version = None
+                self._stop_event.wait(self.retry_delay)
+        app_log.info("Stopped watching pods with %s", self.label_selector)
+
+
+class PodCache(LoggingConfigurable):
+    """Shared pod informers, one per namespace and label selector
+
+    Owned by the BinderHub application, so that the health checks, launch quotas,
+    build scheduling and build cleanup all read from the same watches
+    instead of each listing pods on their own.
+    """
+
+    api = Any(
+        help="Kubernetes API object to make requests (kubernetes.client.CoreV1Api())",
+    )
+
+    max_age = Integer(
+        600,
+        help="""
+        Maximum time (in seconds) since a watch was last known to be in sync
+        for its pods to be returned by `list_pods`.
+
+        Consumers list pods from the API themselves when the cache is older than this.
+        """,
+        config=True,
+    )
+
+    def __init__(self, **kwargs):
+        super().__init__(**kwargs)
+        # (namespace, label_selector) -> PodInformer
+        self.informers = {}
+        self._started = False
+
+    def get_informer(self, namespace, label_selector):
+        """Get the informer for pods matching `label_selector` in `namespace`
+
+        Creates (and starts, if the cache is running) the informer if needed.
+        Must be called on the main event loop.
+        """
+        key = (namespace, label_selector)
+        if key not in self.informers:
+            informer = PodInformer(
+                parent=self,
+                api=self.api,
+                namespace=namespace,
+                label_selector=label_selector,
+            )
+            self.informers[key] = informer
+            if self._started:
+                informer.start()
+        return self.informers[key]
+
+    def list_pods(self, namespace, label_selector):
+        """List the cached pods matching `label_selector` in `namespace`
+
+        Returns a list of pod dicts,
+        or None if there is no informer for these pods,
+        it hasn't listed them yet, or it is out of date,
+        so that callers list pods from the API instead of seeing no pods.
+        Safe to call from any thread.
+        """
+        informer = self.informers.get((namespace, label_selector))
+        if informer is None or not informer.is_fresh(self.max_age):
+            return None
+        # dict.copy is atomic, the watch may be updating the pods on the main thread
+        return list(informer.pods.copy().values())
+
+    def start(self):
+        """Start all informers"""
+        self._started = True
+        for informer in self.informers.values():
+            informer.start()
+
+    def stop(self):
+        """Stop all informers"""
+        self._started = False
+        for informer in self.informers.values():
+            informer.stop()
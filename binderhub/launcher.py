@@ -18,7 +18,7 @@ from jupyterhub.utils import maybe_future
 from tornado import gen, web
 from tornado.httpclient import AsyncHTTPClient, HTTPError, HTTPRequest
 from tornado.log import app_log
-from traitlets import Bool, Integer, Unicode, default
+from traitlets import Any, Bool, Integer, Unicode, default
 from traitlets.config import LoggingConfigurable
 
 from .utils import url_path_join
@@ -95,6 +95,54 @@ class Launcher(LoggingConfigurable):
         """,
     )
 
+    prefer_nodes_with_image = Bool(
+        False,
+        config=True,
+        help="""
+        Prefer to place servers on nodes which already have the image.
+
+        Passes the nodes to the spawner in the `node_affinity_preferred` user option,
+        which BinderSpawnerMixin applies to the pod.
+        Requires listing the nodes of the cluster.
+        """,
+    )
+    image_locality_weight = Integer(
+        50,
+        config=True,
+        help="""
+        Weight (1-100) of the preference for nodes which already have the image,
+        relative to other preferred scheduling terms.
+        """,
+    )
+    node_image_index = Any(
+        None,
+        allow_none=True,
+        help="NodeImageIndex of the images present on each node, if any",
+    )
+
+    def get_node_affinity(self, image):
+        """Preferred node affinity terms placing `image` on nodes that have it"""
+        if self.node_image_index is None:
+            return []
+        nodes = self.node_image_index.nodes_with_image(image)
+        if not nodes:
+            return []
+        return [
+            {
+                "weight": self.image_locality_weight,
+                "preference": {
+                    # node names, which may differ from their hostname label
+                    "matchFields": [
+                        {
+                            "key": "metadata.name",
+                            "operator": "In",
+                            "values": sorted(nodes),
+                        }
+                    ]
+                },
+            }
+        ]
+
     async def api_request(self, url, *args, **kwargs):
         """Make an API request to JupyterHub"""
         headers = kwargs.setdefault("headers", {})
@@ -140,6 +188,10 @@ class Launcher(LoggingConfigurable):
         body = json.loads(resp.body.decode("utf-8"))
         return body
 
+    async def delete_user(self, username):
+        """Delete a temporary user, stopping their server"""
+        await self.api_request(f"users/{quote(username, safe='@~')}", method="DELETE")
+
     def unique_name_from_repo(self, repo_url):
         """Generate a unique name for a git repo url
 
@@ -250,6 +302,9 @@ class Launcher(LoggingConfigurable):
         }
         if extra_args:
             data.update(extra_args)
+        node_affinity = self.get_node_affinity(image)
+        if node_affinity:
+            data["node_affinity_preferred"] = node_affinity
 
         # server name to be used in logs
         _server_name = f" {server_name}" if server_name else ""
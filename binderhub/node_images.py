@@ -0,0 +1,111 @@
+"""
+Index of the images present on each node.
+
+Built from `node.status.images`, to place launches on nodes
+that don't need to pull the image first.
+"""
+
+import asyncio
+
+import kubernetes.config
+from kubernetes import client
+from prometheus_client import Gauge
+from tornado.ioloop import IOLoop
+from traitlets import Any, Dict, Integer, default
+from traitlets.config import LoggingConfigurable
+
+from .utils import KUBE_REQUEST_TIMEOUT
+
+INDEXED_NODES = Gauge(
+    "binderhub_node_image_index_nodes", "Nodes in the index of images on nodes"
+)
+
+_DEFAULT_REGISTRY_PREFIXES = ("docker.io/library/", "docker.io/")
+
+
+def _image_names(name):
+    """The names under which an image reported by a node can be looked up
+
+    Nodes report the full name, including the default registry,
+    while images may be launched as e.g. `user/image:tag`.
+    """
+    yield name
+    for prefix in _DEFAULT_REGISTRY_PREFIXES:
+        if name.startswith(prefix):
+            yield name[len(prefix) :]
+            break
+
+
+class NodeImageIndex(LoggingConfigurable):
+    """Periodically list the nodes, and the images present on each of them"""
+
+    kube = Any(help="kubernetes API client")
+
+    @default("kube")
+    def _default_kube(self):
+        try:
+            kubernetes.config.load_incluster_config()
+        except kubernetes.config.ConfigException:
+            kubernetes.config.load_kube_config()
+        return client.CoreV1Api()
+
+    node_selector = Dict(
+        {},
+        config=True,
+        help="""
+        Labels of the nodes to index, e.g. `{"hub.jupyter.org/node-purpose": "user"}`.
+
+        All nodes are indexed by default.
+        """,
+    )
+
+    refresh_interval = Integer(
+        60,
+        config=True,
+        help="Time (in seconds) between listings of the nodes",
+    )
+
+    def __init__(self, **kwargs):
+        super().__init__(**kwargs)
+        # image name -> names of schedulable nodes with the image
+        self._nodes_by_image = {}
+
+    def nodes_with_image(self, image_name):
+        """Names of the nodes on which `image_name` is present"""
+        return self._nodes_by_image.get(image_name, set())
+
+    def _list_nodes(self):
+        label_selector = ",".join(f"{k}={v}" for k, v in self.node_selector.items())
+        return self.kube.list_node(
+            label_selector=label_selector,
+            _request_timeout=KUBE_REQUEST_TIMEOUT,
+        ).items
+
+    def update(self, nodes):
+        """Rebuild the index from a list of V1Nodes"""
+        nodes_by_image = {}
+        indexed = 0
+        for node in nodes:
+            if node.spec and node.spec.unschedulable:
+                continue
+            indexed += 1
+            for image in node.status.images or []:
+                for name in image.names or []:
+                    for key in _image_names(name):
+                        nodes_by_image.setdefault(key, set()).add(node.metadata.name)
+        self._nodes_by_image = nodes_by_image
+        INDEXED_NODES.set(indexed)
+
+    async def refresh(self):
+        """List the nodes and update the index"""
+        nodes = await IOLoop.current().run_in_executor(None, self._list_nodes)
+        self.update(nodes)
+
+    async def run(self):
+        """Refresh the index every `refresh_interval` seconds"""
+        while True:
+            try:
+                await self.refresh()
+            except Exception:
+                self.log.exception("Failed to list nodes for the image index")
+            await asyncio.sleep(self.refresh_interval)
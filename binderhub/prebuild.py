@@ -0,0 +1,101 @@
+"""
+Builds that nobody is waiting for yet.
+
+Prebuilds are started e.g. by a push webhook, so the image of a new commit
+is already in the registry by the time someone clicks the badge.
+They go through the same BuildRegistry as builds started by /build/ requests,
+so a request for the same image joins the prebuild instead of starting another one.
+"""
+
+import asyncio
+
+from prometheus_client import Counter
+from tornado.log import app_log
+
+from .build import ProgressEvent
+from .builder import _get_image_name, _image_exists, _start_build
+
+PREBUILD_COUNT = Counter(
+    "binderhub_prebuild_count",
+    "Counter of prebuild requests, by source and whether they started a build",
+    ["source", "status"],
+)
+
+_DONE = (ProgressEvent.BuildStatus.BUILT, ProgressEvent.BuildStatus.FAILED)
+
+# follow prebuilds until they are done, keeping references to the tasks
+_prebuild_tasks = set()
+
+
+async def _follow(shared_build):
+    """Stay subscribed to a prebuild until it is done
+
+    Builds stop when they have no subscribers left.
+    """
+    q = shared_build.subscribe()
+    try:
+        while True:
+            event = await q.get()
+            if (
+                event.kind == ProgressEvent.Kind.BUILD_STATUS_CHANGE
+                and event.payload in _DONE
+            ):
+                app_log.info(
+                    "Prebuild of %s %s", shared_build.image_name, event.payload.value
+                )
+                return
+    finally:
+        shared_build.unsubscribe(q)
+
+
+async def prebuild(settings, provider, source="webhook", wait=False):
+    """Build the image of a provider's repo, unless it exists or is being built
+
+    `settings` are the tornado settings of the BinderHub application.
+    With `wait`, only return once a started build is done.
+
+    Returns the status of the prebuild:
+
+    - "started" if a build was started
+    - "building" if the image is already being built
+    - "exists" if the image is already built
+    - "unresolved" if the ref could not be resolved
+    """
+    ref = await provider.get_resolved_ref()
+    if ref is None:
+        status = "unresolved"
+    else:
+        image_name = _get_image_name(
+            settings["image_prefix"], provider.get_build_slug(), ref
+        )
+        if settings["build_registry"].get(image_name) is not None:
+            status = "building"
+        elif await _image_exists(settings, image_name):
+            status = "exists"
+        else:
+            shared_build, started = await _start_build(
+                settings,
+                provider,
+                ref,
+                image_name,
+                metric_labels={
+                    "provider": provider.name,
+                    "repo": provider.get_repo_url(),
+                },
+                # builds someone is waiting for go first
+                high_priority=False,
+            )
+            # nobody may be waiting for the image yet, keep building
+            shared_build.reap_when_abandoned = False
+            if started:
+                status = "started"
+                app_log.info("Started prebuild of %s", image_name)
+                task = asyncio.ensure_future(_follow(shared_build))
+                _prebuild_tasks.add(task)
+                task.add_done_callback(_prebuild_tasks.discard)
+            else:
+                status = "building"
+    PREBUILD_COUNT.labels(source=source, status=status).inc()
+    if wait and status == "started":
+        await task
+    return status
@@ -0,0 +1,347 @@
+"""
+Pre-pulling of images onto user nodes.
+
+The first launch of an image on a node pulls the image inside the spawn,
+which is usually most of the launch time.
+The ImagePrePuller pulls freshly built images, and the most launched ones,
+onto the user nodes that don't have them yet,
+with short-lived pods pinned to each node.
+"""
+
+import asyncio
+import hashlib
+import os
+import time
+from collections import Counter, deque
+
+import kubernetes.config
+from kubernetes import client
+from prometheus_client import Counter as MetricCounter
+from prometheus_client import Gauge
+from tornado.ioloop import IOLoop
+from traitlets import Any, Bool, Dict, Integer, List, Unicode, default
+from traitlets.config import LoggingConfigurable
+
+from .utils import KUBE_REQUEST_TIMEOUT
+
+PREPULL_COUNT = MetricCounter(
+    "binderhub_prepull_count",
+    "Counter of image pre-pulls onto nodes, by outcome",
+    ["status"],
+)
+PREPULLS_INPROGRESS = Gauge(
+    "binderhub_inprogress_prepulls", "Image pre-pull pods currently running"
+)
+
+
+def _node_has_image(node, image_name):
+    """Whether a node reports having pulled `image_name`"""
+    for image in node.status.images or []:
+        for name in image.names or []:
+            # nodes report images with their registry, e.g. docker.io/library/...
+            if name == image_name or name.endswith("/" + image_name):
+                return True
+    return False
+
+
+def _tolerates(tolerations, taint):
+    """Whether one of `tolerations` tolerates `taint`"""
+    for toleration in tolerations:
+        if toleration.get("effect") and toleration["effect"] != taint.effect:
+            continue
+        if toleration.get("operator") == "Exists":
+            if not toleration.get("key") or toleration["key"] == taint.key:
+                return True
+        elif toleration.get("key") == taint.key:
+            if toleration.get("value", "") == (taint.value or ""):
+                return True
+    return False
+
+
+class ImagePrePuller(LoggingConfigurable):
+    """Pull images onto user nodes ahead of launches
+
+    Call `image_built(image_name)` when an image has been built,
+    and `record_launch(image_name)` for every launch,
+    and run `run()` to periodically pull the most launched images.
+    """
+
+    enabled = Bool(
+        False,
+        config=True,
+        help="Pre-pull freshly built and popular images onto user nodes",
+    )
+
+    kube = Any(help="kubernetes API client")
+
+    @default("kube")
+    def _default_kube(self):
+        try:
+            kubernetes.config.load_incluster_config()
+        except kubernetes.config.ConfigException:
+            kubernetes.config.load_kube_config()
+        return client.CoreV1Api()
+
+    namespace = Unicode(
+        help="Kubernetes namespace in which to run the pre-pull pods", config=True
+    )
+
+    @default("namespace")
+    def _default_namespace(self):
+        return os.getenv("BUILD_NAMESPACE", "default")
+
+    node_selector = Dict(
+        {},
+        config=True,
+        help="""
+        Labels of the nodes on which to pre-pull images,
+        e.g. `{"hub.jupyter.org/node-purpose": "user"}`.
+
+        Images are pre-pulled on all schedulable nodes by default.
+        """,
+    )
+
+    tolerations = List(
+        [
+            {
+                "key": "hub.jupyter.org/dedicated",
+                "operator": "Equal",
+                "value": "user",
+                "effect": "NoSchedule",
+            },
+            # GKE currently does not permit creating taints on a node pool
+            # with a `/` in the key field
+            {
+                "key": "hub.jupyter.org_dedicated",
+                "operator": "Equal",
+                "value": "user",
+                "effect": "NoSchedule",
+            },
+        ],
+        config=True,
+        help="""
+        Tolerations of the pre-pull pods, in the format of the Kubernetes API.
+
+        Nodes with NoSchedule or NoExecute taints that are not tolerated are skipped.
+        Defaults to the tolerations of user pods on nodes dedicated to users.
+        """,
+    )
+
+    image_pull_secrets = List(
+        [], help="Pull secrets for the pre-pulled images", config=True
+    )
+
+    concurrency = Integer(
+        4,
+        config=True,
+        help="Maximum number of pre-pull pods to run at the same time",
+    )
+
+    pull_timeout = Integer(
+        900,
+        config=True,
+        help="Time (in seconds) after which a pre-pull pod is deleted, pulled or not",
+    )
+
+    poll_interval = Integer(
+        5,
+        config=True,
+        help="Time (in seconds) between checks of whether a pre-pull pod is done",
+    )
+
+    top_images = Integer(
+        10,
+        config=True,
+        help="""
+        Number of the most launched images to pre-pull every `interval`.
+
+        0 only pre-pulls freshly built images.
+        """,
+    )
+
+    launch_window = Integer(
+        3600,
+        config=True,
+        help="Time (in seconds) over which launches are counted to find the most launched images",
+    )
+
+    interval = Integer(
+        600,
+        config=True,
+        help="Time (in seconds) between pre-pulls of the most launched images",
+    )
+
+    def __init__(self, **kwargs):
+        super().__init__(**kwargs)
+        # (time, image name) of recent launches
+        self._launches = deque()
+        # (image name, node name) being pulled
+        self._pulling = set()
+        self._semaphore = asyncio.Semaphore(self.concurrency)
+        self._tasks = set()
+
+    def record_launch(self, image_name):
+        """Count a launch of `image_name`"""
+        if self.enabled and self.top_images:
+            self._launches.append((time.monotonic(), image_name))
+
+    def popular_images(self):
+        """The images launched the most within `launch_window`"""
+        cutoff = time.monotonic() - self.launch_window
+        while self._launches and self._launches[0][0] < cutoff:
+            self._launches.popleft()
+        counts = Counter(image_name for _, image_name in self._launches)
+        return [image_name for image_name, _ in counts.most_common(self.top_images)]
+
+    def image_built(self, image_name):
+        """Start pre-pulling a freshly built image"""
+        if not self.enabled:
+            return
+        task = asyncio.ensure_future(self.prepull(image_name))
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+
+    def _list_nodes(self):
+        label_selector = ",".join(f"{k}={v}" for k, v in self.node_selector.items())
+        return self.kube.list_node(
+            label_selector=label_selector,
+            _request_timeout=KUBE_REQUEST_TIMEOUT,
+        ).items
+
+    async def prepull(self, image_name):
+        """Pull `image_name` onto every node that doesn't have it yet"""
+        try:
+            nodes = await IOLoop.current().run_in_executor(None, self._list_nodes)
+        except Exception:
+            self.log.exception("Failed to list nodes to pre-pull %s", image_name)
+            return
+        node_names = []
+        for node in nodes:
+            if node.spec.unschedulable:
+                continue
+            if any(
+                taint.effect in ("NoSchedule", "NoExecute")
+                and not _tolerates(self.tolerations, taint)
+                for taint in node.spec.taints or []
+            ):
+                continue
+            if _node_has_image(node, image_name):
+                PREPULL_COUNT.labels(status="present").inc()
+                continue
+            node_names.append(node.metadata.name)
+        await asyncio.gather(
+            *(self._prepull_on_node(image_name, node_name) for node_name in node_names)
+        )
+
+    def _pod_name(self, image_name, node_name):
+        digest = hashlib.sha256(f"{image_name}\0{node_name}".encode("utf8"))
+        return "prepull-" + digest.hexdigest()[:16]
+
+    def _make_pod(self, pod_name, image_name, node_name):
+        return client.V1Pod(
+            metadata=client.V1ObjectMeta(
+                name=pod_name,
+                labels={"component": "binderhub-prepull"},
+                annotations={"binder-image": image_name},
+            ),
+            spec=client.V1PodSpec(
+                # pulling the image is all we want, run nothing
+                containers=[
+                    client.V1Container(
+                        name="prepull",
+                        image=image_name,
+                        command=["/bin/sh", "-c", "true"],
+                    )
+                ],
+                node_name=node_name,
+                tolerations=self.tolerations,
+                restart_policy="Never",
+                image_pull_secrets=[
+                    client.V1LocalObjectReference(name=secret)
+                    for secret in self.image_pull_secrets
+                ],
+                automount_service_account_token=False,
+            ),
+        )
+
+    async def _run_pod(self, pod_name, image_name, node_name):
+        """Create a pre-pull pod, wait for it to finish, and delete it
+
+        Returns the final phase of the pod.
+        """
+        loop = IOLoop.current()
+        pod = self._make_pod(pod_name, image_name, node_name)
+        try:
+            await loop.run_in_executor(
+                None,
+                lambda: self.kube.create_namespaced_pod(
+                    self.namespace, pod, _request_timeout=KUBE_REQUEST_TIMEOUT
+                ),
+            )
+        except client.rest.ApiException as e:
+            if e.status != 409:
+                raise
+            # left over from a previous attempt, follow it
+        phase = "Pending"
+        deadline = time.monotonic() + self.pull_timeout
+        try:
+            while time.monotonic() < deadline:
+                pod = await loop.run_in_executor(
+                    None,
+                    lambda: self.kube.read_namespaced_pod(
+                        pod_name, self.namespace, _request_timeout=KUBE_REQUEST_TIMEOUT
+                    ),
+                )
+                phase = pod.status.phase
+                if phase in {"Succeeded", "Failed"}:
+                    break
+                await asyncio.sleep(self.poll_interval)
+        finally:
+            try:
+                await loop.run_in_executor(None, self._delete_pod, pod_name)
+            except client.rest.ApiException as e:
+                if e.status != 404:
+                    raise
+        return phase
+
+    def _delete_pod(self, pod_name):
+        self.kube.delete_namespaced_pod(
+            pod_name,
+            self.namespace,
+            body=client.V1DeleteOptions(grace_period_seconds=0),
+            _request_timeout=KUBE_REQUEST_TIMEOUT,
+        )
+
+    async def _prepull_on_node(self, image_name, node_name):
+        key = (image_name, node_name)
+        if key in self._pulling:
+            return
+        self._pulling.add(key)
+        try:
+            async with self._semaphore:
+                pod_name = self._pod_name(image_name, node_name)
+                self.log.info("Pre-pulling %s on %s", image_name, node_name)
+                with PREPULLS_INPROGRESS.track_inprogress():
+                    phase = await self._run_pod(pod_name, image_name, node_name)
+            if phase == "Succeeded":
+                PREPULL_COUNT.labels(status="pulled").inc()
+            else:
+                self.log.warning(
+                    "Pre-pull of %s on %s ended in phase %s",
+                    image_name,
+                    node_name,
+                    phase,
+                )
+                PREPULL_COUNT.labels(status="failed").inc()
+        except Exception:
+            self.log.exception("Failed to pre-pull %s on %s", image_name, node_name)
+            PREPULL_COUNT.labels(status="failed").inc()
+        finally:
+            self._pulling.discard(key)
+
+    async def run(self):
+        """Pre-pull the most launched images every `interval` seconds"""
+        while self.top_images:
+            await asyncio.sleep(self.interval)
+            for image_name in self.popular_images():
+                await self.prepull(image_name)
@@ -9,7 +9,7 @@ from collections import namedtuple
 
 import kubernetes.config
 from kubernetes import client
-from traitlets import Any, Integer, Unicode, default
+from traitlets import Any, Integer, Unicode, default, observe
 from traitlets.config import LoggingConfigurable
 
 from .utils import KUBE_REQUEST_TIMEOUT
@@ -35,6 +35,13 @@ class LaunchQuotaExceeded(Exception):
 ServerQuotaCheck = namedtuple("ServerQuotaCheck", ["total", "matching", "quota"])
 
 
+def _pod_images_without_tag(pod):
+    """The images (without tag) run by the containers of a pod"""
+    return {
+        container["image"].rsplit(":", 1)[0] for container in pod["spec"]["containers"]
+    }
+
+
 class LaunchQuota(LoggingConfigurable):
     executor = Any(
         allow_none=True, help="Optional Executor to use for blocking operations"
@@ -94,6 +101,60 @@ class KubernetesLaunchQuota(LaunchQuota):
     def _default_namespace(self):
         return os.getenv("BUILD_NAMESPACE", "default")
 
+    pod_informer = Any(
+        None,
+        allow_none=True,
+        help="""
+        PodInformer watching the singleuser server pods.
+
+        If set, pods are counted from the informer's index
+        instead of listing all pods on every check.
+        """,
+    )
+
+    @observe("pod_informer")
+    def _pod_informer_changed(self, change):
+        if change.new is not None:
+            change.new.add_count_index("image", _pod_images_without_tag)
+
+    pod_informer_max_age = Integer(
+        600,
+        help="""
+        Maximum time (in seconds) since the pod informer was last known to be in sync
+        for its counts to be used.
+
+        If the informer is older than this, e.g. because its watch is failing,
+        pods are listed instead.
+        """,
+        config=True,
+    )
+
+    async def _count_pods(self, image_no_tag):
+        """Count all singleuser pods, and the ones running `image_no_tag`"""
+        if self.pod_informer is not None:
+            if self.pod_informer.is_fresh(self.pod_informer_max_age):
+                return (
+                    len(self.pod_informer.pods),
+                    self.pod_informer.count("image", image_no_tag),
+                )
+            self.log.warning("Pod informer is out of date, listing pods")
+
+        f = self.executor.submit(
+            self.api.list_namespaced_pod,
+            self.namespace,
+            label_selector="app=jupyterhub,component=singleuser-server",
+            _request_timeout=KUBE_REQUEST_TIMEOUT,
+            _preload_content=False,
+        )
+        resp = await asyncio.wrap_future(f)
+        pods = json.loads(resp.read())["items"]
+        # is the container running the same image as us?
+        # if so, count one for the current repo.
+        matching_pods = sum(
+            1 for pod in pods if image_no_tag in _pod_images_without_tag(pod)
+        )
+        return len(pods), matching_pods
+
     async def check_repo_quota(self, image_name, repo_config, repo_url):
         # the image name (without tag) is unique per repo
         # use this to count the number of pods running with a given repo
@@ -108,19 +169,7 @@ class KubernetesLaunchQuota(LaunchQuota):
 
         # Fetch info on currently running users *only* if quotas are set
         if pod_quota is not None or repo_quota:
-            matching_pods = 0
-
-            # TODO: run a watch to keep this up to date in the background
-            f = self.executor.submit(
-                self.api.list_namespaced_pod,
-                self.namespace,
-                label_selector="app=jupyterhub,component=singleuser-server",
-                _request_timeout=KUBE_REQUEST_TIMEOUT,
-                _preload_content=False,
-            )
-            resp = await asyncio.wrap_future(f)
-            pods = json.loads(resp.read())["items"]
-            total_pods = len(pods)
+            total_pods, matching_pods = await self._count_pods(image_no_tag)
 
             if pod_quota is not None and total_pods >= pod_quota:
                 # check overall quota first
@@ -132,15 +181,6 @@ class KubernetesLaunchQuota(LaunchQuota):
                     status="pod_quota",
                 )
 
-            for pod in pods:
-                for container in pod["spec"]["containers"]:
-                    # is the container running the same image as us?
-                    # if so, count one for the current repo.
-                    image = container["image"].rsplit(":", 1)[0]
-                    if image == image_no_tag:
-                        matching_pods += 1
-                        break
-
             if repo_quota and matching_pods >= repo_quota:
                 self.log.error(
                     f"{repo_url} has exceeded quota: {matching_pods}/{repo_quota} ({total_pods} total)"
@@ -1,13 +1,23 @@
 """Rate limiting utilities"""
 
+import asyncio
+import heapq
+import math
 import time
 
-from traitlets import Dict, Float, Integer, default
+from traitlets import CaselessStrEnum, Dict, Integer, List
 from traitlets.config import LoggingConfigurable
 
 
 class RateLimitExceeded(Exception):
-    """Exception raised when rate limit is exceeded"""
+    """Exception raised when rate limit is exceeded
+
+    `retry_after` is the number of seconds after which a request may succeed.
+    """
+
+    def __init__(self, message, retry_after=None):
+        super().__init__(message)
+        self.retry_after = retry_after
 
 
 class RateLimiter(LoggingConfigurable):
@@ -21,11 +31,32 @@ class RateLimiter(LoggingConfigurable):
     If the rate limit is exhausted, a RateLimitExceeded exception is raised,
     otherwise a summary of the current rate limit remaining is returned.
 
-    Rate limits are reset to zero at the end of `period_seconds`,
-    not a sliding window,
-    so the entire rate limit can be consumed instantly
+    How requests are counted depends on `algorithm`.
+    With the default fixed windows, rate limits are reset to zero
+    at the end of `period_seconds`, so the entire rate limit can be consumed instantly.
+
+    Expired limits are forgotten incrementally on each call,
+    so no single request pays for cleaning up all of them.
+    Run `run()` to also forget all of them every `clean_seconds`,
+    off the request path.
     """
 
+    algorithm = CaselessStrEnum(
+        ["fixed_window", "sliding_window", "token_bucket"],
+        default_value="fixed_window",
+        config=True,
+        help="""
+        How requests are counted against the limit.
+
+        - fixed_window: at most `limit` requests in each period of `period_seconds`,
+          starting with the first request.
+        - sliding_window: at most `limit` requests in the last `period_seconds`,
+          approximated by weighting the count of the previous period.
+        - token_bucket: up to `limit` requests at once,
+          refilled at a rate of `limit` per `period_seconds`.
+        """,
+    )
+
     period_seconds = Integer(
         3600,
         config=True,
@@ -38,59 +69,183 @@ class RateLimiter(LoggingConfigurable):
         help="""The number of requests to allow within period_seconds""",
     )
 
+    authenticated_limit = Integer(
+        None,
+        allow_none=True,
+        config=True,
+        help="""
+        The number of requests to allow within period_seconds
+        for each authenticated user.
+
+        None (default) means authenticated users are not rate limited.
+        """,
+    )
+
+    build_token_limit = Integer(
+        None,
+        allow_none=True,
+        config=True,
+        help="""
+        The number of requests with a valid build token to allow within period_seconds
+        for each ip address.
+
+        None (default) means requests with a build token are not rate limited.
+        """,
+    )
+
     clean_seconds = Integer(
         600,
         config=True,
-        help="""Interval on which to clean out old limits.
+        help="""Interval (in seconds) between background cleanups of all expired limits.
 
-        Avoids memory growth of unused limits
+        In between, expired limits are cleaned up incrementally,
+        at most `clean_batch_size` per request.
+        """,
+    )
+
+    clean_batch_size = Integer(
+        100,
+        config=True,
+        help="""Maximum number of expired limits to clean up per request.
+
+        Avoids memory growth of unused limits,
+        without pausing any single request for long.
         """,
     )
 
     _limits = Dict()
 
-    _last_cleaned = Float()
+    # heap of (expiry, key), for cleaning up expired limits
+    _expiry_heap = List()
 
-    @default("_last_cleaned")
-    def _default_last_cleaned(self):
-        return self.time()
+    def _expiry(self, limit):
+        """Time after which a limit is the same as a new one and can be forgotten"""
+        return limit.get("expires", limit["reset"])
 
-    def _clean_limits(self):
+    def _clean_limits(self, batch_size=None):
+        """Forget up to `batch_size` expired limits, all of them if None"""
         now = self.time()
-        self._last_cleaned = now
-        self._limits = {
-            key: limit for key, limit in self._limits.items() if limit["reset"] > now
-        }
+        cleaned = 0
+        while (
+            self._expiry_heap
+            and self._expiry_heap[0][0] <= now
+            and (batch_size is None or cleaned < batch_size)
+        ):
+            _, key = heapq.heappop(self._expiry_heap)
+            cleaned += 1
+            limit = self._limits.get(key)
+            if limit is None:
+                continue
+            expiry = self._expiry(limit)
+            if expiry <= now:
+                del self._limits[key]
+            else:
+                # limit was extended since the entry was pushed
+                heapq.heappush(self._expiry_heap, (expiry, key))
+
+    def clean(self):
+        """Forget all expired limits"""
+        self._clean_limits()
+
+    async def run(self):
+        """Forget all expired limits every `clean_seconds`"""
+        while True:
+            await asyncio.sleep(self.clean_seconds)
+            self.clean()
 
     @staticmethod
     def time():
         """Mostly here to enable override in tests"""
         return time.time()
 
-    def increment(self, key):
+    def _new_limit(self, key, limit, now):
+        state = {"remaining": limit, "reset": now + self.period_seconds}
+        if self.algorithm == "sliding_window":
+            state["count"] = 0
+            state["previous_count"] = 0
+            state["window_start"] = now
+            state["expires"] = now + 2 * self.period_seconds
+        elif self.algorithm == "token_bucket":
+            state["tokens"] = float(limit)
+            state["updated"] = now
+            state["reset"] = now
+        self._limits[key] = state
+        heapq.heappush(self._expiry_heap, (self._expiry(state), key))
+        return state
+
+    def _fixed_window(self, state, limit, now):
+        if state["reset"] < now:
+            # reset expired
+            state["remaining"] = limit
+            state["reset"] = now + self.period_seconds
+        # keep decrementing, so we have a track of excess requests
+        # which indicate abuse
+        state["remaining"] -= 1
+        return state["reset"]
+
+    def _sliding_window(self, state, limit, now):
+        period = self.period_seconds
+        elapsed_windows = (now - state["window_start"]) // period
+        if elapsed_windows >= 1:
+            state["previous_count"] = state["count"] if elapsed_windows == 1 else 0
+            state["count"] = 0
+            state["window_start"] += elapsed_windows * period
+        state["count"] += 1
+        window_end = state["window_start"] + period
+        # the fraction of the previous window still within the sliding window
+        weight = (window_end - now) / period
+        used = state["previous_count"] * weight + state["count"]
+        state["remaining"] = limit - math.ceil(used)
+        state["reset"] = window_end
+        state["expires"] = window_end + period
+        return window_end
+
+    def _token_bucket(self, state, limit, now):
+        rate = limit / self.period_seconds
+        tokens = min(limit, state["tokens"] + (now - state["updated"]) * rate)
+        tokens -= 1
+        state["remaining"] = math.floor(tokens)
+        # rejected requests take what is left of the next token, but no more,
+        # so retrying clients don't push their refill further out
+        tokens = max(tokens, 0)
+        state["tokens"] = tokens
+        state["updated"] = now
+        # when the bucket will be full again
+        state["reset"] = now + math.ceil((limit - tokens) / rate)
+        # when the next token is available
+        return now + math.ceil((1 - tokens) / rate)
+
+    def increment(self, key, limit=None):
         """Check rate limit for a key
 
         key: key for recording rate limit. Each key tracks a different rate limit.
+        limit: number of requests allowed for this key, if not `self.limit`.
         Returns: {"remaining": int_remaining, "reset": int_timestamp}
         Raises: RateLimitExceeded if the request would exceed the rate limit.
         """
+        if limit is None:
+            limit = self.limit
         now = int(self.time())
-        if now - self._last_cleaned > self.clean_seconds:
-            self._clean_limits()
-
-        if key not in self._limits or self._limits[key]["reset"] < now:
-            # no limit recorded, or reset expired
-            self._limits[key] = {
-                "remaining": self.limit,
-                "reset": now + self.period_seconds,
-            }
-        limit = self._limits[key]
-        # keep decrementing, so we have a track of excess requests
-        # which indicate abuse
-        limit["remaining"] -= 1
-        if limit["remaining"] < 0:
-            seconds_until_reset = int(limit["reset"] - now)
+        if self._expiry_heap and self._expiry_heap[0][0] <= now:
+            self._clean_limits(self.clean_batch_size)
+
+        state = self._limits.get(key)
+        if state is None:
+            state = self._new_limit(key, limit, now)
+
+        # time after which a rejected request may succeed
+        if self.algorithm == "sliding_window":
+            retry_at = self._sliding_window(state, limit, now)
+        elif self.algorithm == "token_bucket":
+            retry_at = self._token_bucket(state, limit, now)
+        else:
+            retry_at = self._fixed_window(state, limit, now)
+
+        summary = {"remaining": state["remaining"], "reset": state["reset"]}
+        if state["remaining"] < 0:
+            retry_after = max(int(retry_at - now), 1)
             raise RateLimitExceeded(
-                f"Rate limit exceeded (by {-limit['remaining']}) for {key!r}, reset in {seconds_until_reset}s."
+                f"Rate limit exceeded (by {-state['remaining']}) for {key!r}, retry in {retry_after}s.",
+                retry_after=retry_after,
             )
-        return limit
+        return summary
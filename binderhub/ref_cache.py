@@ -0,0 +1,206 @@
+"""
+Caches for resolved refs of repo providers.
+
+The in-memory cache is private to each BinderHub process.
+The SQLite cache is stored in a file,
+so it survives restarts and can be shared by replicas on a common volume.
+"""
+
+import json
+import sqlite3
+import time
+
+from prometheus_client import Counter
+from tornado.ioloop import IOLoop
+from traitlets import Float, Integer, Unicode
+from traitlets.config import LoggingConfigurable
+
+from .utils import Cache
+
+REF_CACHE_COUNT = Counter(
+    "binderhub_ref_cache_count",
+    "Counter of lookups in the resolved ref caches by result",
+    ["cache", "result"],
+)
+
+
+class RefCache(LoggingConfigurable):
+    """Base class for a cache of resolved refs
+
+    Values must be JSON-serializable.
+    """
+
+    name = Unicode(help="Name of the cache, e.g. 'github'")
+
+    max_size = Integer(
+        1024,
+        help="Maximum number of entries in the cache",
+        config=True,
+    )
+
+    max_age = Float(
+        0,
+        help="""
+        Maximum age (in seconds) of entries in the cache.
+
+        0 means entries don't expire. Set by the repo provider for each cache.
+        """,
+    )
+
+    refresh_interval = Float(
+        300,
+        help="""
+        Minimum time (in seconds) between writes refreshing the age of an entry
+        that was revalidated, e.g. by a 304 Not Modified response.
+
+        Entries with a `max_age` are refreshed at least every `max_age / 2`.
+        """,
+        config=True,
+    )
+
+    def __init__(self, **kwargs):
+        super().__init__(**kwargs)
+        # key -> time.monotonic() of the last write, to skip redundant refreshes
+        self._written = Cache(self.max_size)
+
+    async def get(self, key):
+        """Get a cached value, or None"""
+        value = await self._get(key)
+        REF_CACHE_COUNT.labels(
+            cache=self.name, result="miss" if value is None else "hit"
+        ).inc()
+        return value
+
+    async def set(self, key, value):
+        """Store a value in the cache, refreshing its age"""
+        self._written.set(key, time.monotonic())
+        await self._set(key, value)
+
+    async def refresh(self, key, value):
+        """Refresh the age of a revalidated entry, if it was written a while ago
+
+        Revalidation is on the hot path of resolving refs,
+        most revalidations don't need to write the entry again.
+        """
+        interval = self.refresh_interval
+        if self.max_age:
+            interval = min(interval, self.max_age / 2)
+        written = self._written.get(key)
+        if written is not None and time.monotonic() - written < interval:
+            return
+        await self.set(key, value)
+
+    async def _get(self, key):
+        raise NotImplementedError()
+
+    async def _set(self, key, value):
+        raise NotImplementedError()
+
+
+class MemoryRefCache(RefCache):
+    """LRU cache in the memory of the BinderHub process"""
+
+    def __init__(self, **kwargs):
+        super().__init__(**kwargs)
+        self._cache = Cache(self.max_size, max_age=self.max_age)
+
+    async def _get(self, key):
+        return self._cache.get(key)
+
+    async def _set(self, key, value):
+        self._cache.set(key, value)
+
+    async def refresh(self, key, value):
+        # cheap, keep the LRU order exact
+        self._cache.set(key, value)
+
+
+class SQLiteRefCache(RefCache):
+    """Cache stored in a SQLite database
+
+    Entries are evicted by least recent update,
+    since updating the database on every read would make reads expensive.
+    """
+
+    path = Unicode(
+        "binderhub-ref-cache.sqlite",
+        config=True,
+        help="""
+        Path of the SQLite database file.
+
+        Put this on a persistent volume to keep resolved refs across restarts,
+        or on a volume shared by all replicas to share them.
+        """,
+    )
+
+    timeout = Float(
+        5,
+        config=True,
+        help="Time (in seconds) to wait for the database lock held by another process",
+    )
+
+    def __init__(self, **kwargs):
+        super().__init__(**kwargs)
+        self._initialized = False
+
+    def _connect(self):
+        db = sqlite3.connect(self.path, timeout=self.timeout)
+        if not self._initialized:
+            with db:
+                db.execute(
+                    "CREATE TABLE IF NOT EXISTS ref_cache ("
+                    " name TEXT, key TEXT, value TEXT, updated REAL,"
+                    " PRIMARY KEY (name, key))"
+                )
+                db.execute(
+                    "CREATE INDEX IF NOT EXISTS ref_cache_updated"
+                    " ON ref_cache (name, updated)"
+                )
+            self._initialized = True
+        return db
+
+    def _get_sync(self, key):
+        db = self._connect()
+        try:
+            row = db.execute(
+                "SELECT value, updated FROM ref_cache WHERE name = ? AND key = ?",
+                (self.name, key),
+            ).fetchone()
+            if row is None:
+                return None
+            value, updated = row
+            if self.max_age and updated + self.max_age < time.time():
+                with db:
+                    db.execute(
+                        "DELETE FROM ref_cache WHERE name = ? AND key = ?",
+                        (self.name, key),
+                    )
+                return None
+            return json.loads(value)
+        finally:
+            db.close()
+
+    def _set_sync(self, key, value):
+        db = self._connect()
+        try:
+            with db:
+                db.execute(
+                    "INSERT OR REPLACE INTO ref_cache (name, key, value, updated)"
+                    " VALUES (?, ?, ?, ?)",
+                    (self.name, key, json.dumps(value), time.time()),
+                )
+                # evict the oldest entries beyond max_size
+                db.execute(
+                    "DELETE FROM ref_cache WHERE name = ? AND key IN ("
+                    " SELECT key FROM ref_cache WHERE name = ?"
+                    " ORDER BY updated DESC LIMIT -1 OFFSET ?)",
+                    (self.name, self.name, self.max_size),
+                )
+        finally:
+            db.close()
+
+    async def _get(self, key):
+        return await IOLoop.current().run_in_executor(None, self._get_sync, key)
+
+    async def _set(self, key, value):
+        await IOLoop.current().run_in_executor(None, self._set_sync, key, value)
@@ -6,13 +6,16 @@ import base64
 import json
 import os
 import re
+import time
 from urllib.parse import urlparse
 
 from tornado import httpclient
 from tornado.httputil import url_concat
-from traitlets import Bool, Dict, Unicode, default
+from traitlets import Bool, Dict, Float, Integer, Unicode, default
 from traitlets.config import LoggingConfigurable
 
+from .utils import Cache, SingleFlight
+
 DEFAULT_DOCKER_REGISTRY_URL = "https://registry-1.docker.io"
 DEFAULT_DOCKER_AUTH_URL = "https://index.docker.io/v1/"
 
@@ -206,6 +209,95 @@ class DockerRegistry(LoggingConfigurable):
         # instead of returning 404
         return self.url.endswith(".docker.io")
 
+    manifest_cache_size = Integer(
+        10000,
+        config=True,
+        help="""
+        Maximum number of images remembered to exist in the registry.
+
+        Images are only ever pushed, never deleted, by BinderHub,
+        so a found image doesn't need to be checked again.
+        Set to 0 to check the registry for every launch.
+        """,
+    )
+
+    manifest_negative_cache_ttl = Float(
+        10,
+        config=True,
+        help="""
+        Time (in seconds) to remember that an image was not found in the registry.
+
+        Entries for an image are dropped as soon as a build of it completes.
+        Set to 0 to not remember missing images.
+        """,
+    )
+
+    token_expiry_margin = Float(
+        30,
+        config=True,
+        help="""
+        Time (in seconds) before the expiry of a registry token
+        after which it is no longer reused.
+
+        Tokens without an `expires_in` are assumed to be valid for 60 seconds,
+        as in the Docker registry token specification.
+        """,
+    )
+
+    def __init__(self, **kwargs):
+        super().__init__(**kwargs)
+        # (token_url, service, scope) -> (token, expiry time)
+        self._tokens = {}
+        self._token_requests = SingleFlight()
+        # (image, tag) -> True, for images known to exist
+        self._found_images = Cache(max(self.manifest_cache_size, 1))
+        # (image, tag) -> True, for images recently found missing
+        self._missing_images = Cache(
+            max(self.manifest_cache_size, 1),
+            max_age=self.manifest_negative_cache_ttl,
+        )
+        # image -> tag most recently pushed, or else first found
+        self._latest_tags = Cache(max(self.manifest_cache_size, 1))
+
+    def latest_tag(self, image):
+        """The tag of `image` most recently pushed, or else first found, if any"""
+        return self._latest_tags.get(image)
+
+    async def image_exists(self, image, tag):
+        """
+        Check whether an image exists in the registry.
+
+        Like `bool(await get_image_manifest(image, tag))`,
+        but remembers the result according to
+        `manifest_cache_size` and `manifest_negative_cache_ttl`.
+        """
+        key = (image, tag)
+        if self.manifest_cache_size and self._found_images.get(key):
+            return True
+        if self.manifest_negative_cache_ttl and self._missing_images.get(key):
+            return False
+        exists = bool(await self.get_image_manifest(image, tag))
+        if exists:
+            self._remember_image(image, tag)
+            if self._latest_tags.get(image) is None:
+                # a tag pushed by this BinderHub is more recent
+                self._latest_tags.set(image, tag)
+        elif self.manifest_negative_cache_ttl:
+            self._missing_images.set(key, True)
+        return exists
+
+    def _remember_image(self, image, tag):
+        key = (image, tag)
+        if key in self._missing_images:
+            self._missing_images.pop(key)
+        if self.manifest_cache_size:
+            self._found_images.set(key, True)
+
+    def mark_image_built(self, image, tag):
+        """Record that an image has been pushed to the registry"""
+        self._remember_image(image, tag)
+        self._latest_tags.set(image, tag)
+
     def _parse_www_authenticate_header(self, header):
         # Header takes the form
         # WWW-Authenticate: Bearer realm="https://uk-london-1.ocir.io/12345678/docker/token",service="uk-london-1.ocir.io",scope=""
@@ -225,6 +317,41 @@ class DockerRegistry(LoggingConfigurable):
             ) from None
 
     async def _get_token(self, client, token_url, service, scope):
+        """Get a bearer token for `scope`, reusing it until it is about to expire
+
+        Concurrent requests for the same token share a single fetch.
+        """
+        key = (token_url, service, scope)
+        now = time.monotonic()
+        if key in self._tokens:
+            token, expiry = self._tokens[key]
+            if now < expiry:
+                return token
+            self._tokens.pop(key, None)
+        (token, expires_in), _ = await self._token_requests.run(
+            key, self._fetch_token, client, token_url, service, scope
+        )
+        if expires_in is None:
+            expires_in = 60
+        if expires_in > self.token_expiry_margin:
+            self._tokens[key] = (token, now + expires_in - self.token_expiry_margin)
+        # drop expired tokens, so the cache doesn't grow forever
+        for cached_key, (_, expiry) in list(self._tokens.items()):
+            if expiry <= now:
+                self._tokens.pop(cached_key, None)
+        return token
+
+    def _forget_token(self, token):
+        """Stop reusing `token`, e.g. after it was rejected"""
+        for key, (cached_token, _) in list(self._tokens.items()):
+            if cached_token == token:
+                self._tokens.pop(key, None)
+
+    async def _fetch_token(self, client, token_url, service, scope):
+        """Fetch a new bearer token
+
+        Returns (token, expires_in), expires_in is None if not given.
+        """
         auth_req = httpclient.HTTPRequest(
             url_concat(
                 token_url,
@@ -248,7 +375,7 @@ class DockerRegistry(LoggingConfigurable):
             token = response_body["access_token"]
         else:
             raise ValueError(f"No token in response from registry: {response_body}")
-        return token
+        return token, response_body.get("expires_in")
 
     async def _get_image_manifest_from_www_authenticate(
         self, client, www_auth_header, url
@@ -263,6 +390,8 @@ class DockerRegistry(LoggingConfigurable):
         try:
             resp = await client.fetch(req)
         except httpclient.HTTPError as e:
+            if e.code in (401, 403):
+                self._forget_token(token)
             if e.code == 404:
                 return None
             else:
@@ -305,6 +434,9 @@ class DockerRegistry(LoggingConfigurable):
         try:
             resp = await client.fetch(req)
         except httpclient.HTTPError as e:
+            if token and e.code in (401, 403):
+                # the token may have been revoked, get a new one next time
+                self._forget_token(token)
             if e.code == 404:
                 # 404 means it doesn't exist
                 return None
@@ -355,7 +487,7 @@ class GoogleArtifactRegistry(DockerRegistry):
     def _default_token_url(self):
         return "http://metadata.google.internal/computeMetadata/v1/instance/service-accounts/default/token"
 
-    async def _get_token(self, client, token_url, service, scope):
+    async def _fetch_token(self, client, token_url, service, scope):
         auth_req = httpclient.HTTPRequest(
             token_url, headers={"Metadata-Flavor": "Google"}
         )
@@ -367,7 +499,7 @@ class GoogleArtifactRegistry(DockerRegistry):
             token = response_body["access_token"]
         else:
             raise ValueError(f"No token in response from registry: {response_body}")
-        return token
+        return token, response_body.get("expires_in")
 
 
 class FakeRegistry(DockerRegistry):
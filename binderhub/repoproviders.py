@@ -9,6 +9,7 @@ control services and providers.
 """
 
 import asyncio
+import fnmatch
 import json
 import os
 import re
@@ -25,11 +26,12 @@ import escapism
 from prometheus_client import Gauge
 from tornado.httpclient import AsyncHTTPClient, HTTPError, HTTPRequest
 from tornado.httputil import url_concat
-from traitlets import Bool, Dict, List, Set, Unicode, default
+from traitlets import Bool, Dict, Integer, List, Set, Type, Unicode, default
 from traitlets.config import LoggingConfigurable
 
 from kubernetes import client
 
+from .ref_cache import MemoryRefCache, RefCache
 from .utils import Cache
 
 GITHUB_RATE_LIMIT = Gauge(
@@ -105,6 +107,19 @@ class RepoProvider(LoggingConfigurable):
         config=True,
     )
 
+    prebuild_specs = List(
+        help="""
+        List of specs that push webhooks may prebuild.
+
+        Should be a list of regexes (not regex objects) that match specs,
+        including the pushed commit, e.g. `^binder-examples/`.
+        Pushes to other repos are rejected,
+        so that not every signed push starts a build.
+        Banned specs are never prebuilt.
+        """,
+        config=True,
+    )
+
     spec_config = List(
         help="""
         List of dictionaries that define per-repository configuration.
@@ -152,6 +167,17 @@ class RepoProvider(LoggingConfigurable):
         # banned_specs: not banned.
         return False
 
+    def allows_prebuild(self):
+        """
+        Return true if the given spec may be prebuilt by push webhooks
+        """
+        for prebuild in self.prebuild_specs:
+            # Ignore case, because most git providers do not
+            # count DS-100/textbook as different from ds-100/textbook
+            if re.match(prebuild, self.spec, re.IGNORECASE):
+                return True
+        return False
+
     def has_higher_quota(self):
         """
         Return true if the given spec has a higher quota
@@ -200,6 +226,20 @@ class RepoProvider(LoggingConfigurable):
     async def get_resolved_ref(self):
         raise NotImplementedError("Must be overridden in child class")
 
+    def get_resolution_key(self):
+        """Return a key identifying the resolution of the ref, or None
+
+        Concurrent requests for specs with the same key share one resolution,
+        e.g. specs differing only in case for case-insensitive hosts.
+        Providers return a key only if resolving sets no state
+        other than the resolved ref. None resolves every request on its own.
+        """
+        return None
+
+    def use_resolved_ref(self, resolved_ref):
+        """Use a ref resolved for another provider with the same resolution key"""
+        self.resolved_ref = resolved_ref
+
     async def get_resolved_spec(self):
         """Return the spec with resolved ref."""
         raise NotImplementedError("Must be overridden in child class")
@@ -657,6 +697,50 @@ class GitRepoProvider(RepoProvider):
         help="""Specify allowed git protocols. Default: http[s], git, ssh.""",
     )
 
+    ls_remote_cache_ttl = Integer(
+        60,
+        config=True,
+        help="""Time (in seconds) to cache refs resolved with `git ls-remote`.
+
+        New commits pushed to a branch are only seen after this time.
+        0 disables the cache.
+        """,
+    )
+
+    ls_remote_negative_cache_ttl = Integer(
+        30,
+        config=True,
+        help="""Time (in seconds) to cache refs that `git ls-remote` could not find.
+
+        0 disables caching of missing refs.
+        """,
+    )
+
+    max_concurrent_ls_remote = Integer(
+        10,
+        config=True,
+        help="""Maximum number of `git ls-remote` processes running at the same time.""",
+    )
+
+    ls_remote_all_refs = Bool(
+        False,
+        config=True,
+        help="""Resolve refs by listing all refs of a repository.
+
+        One `git ls-remote` lists all branches and tags of a repository,
+        and the whole list is cached, so resolving other refs of the same repository
+        doesn't need another `git ls-remote` until the cache expires.
+
+        Listing all refs can be slow for repositories with very many refs.
+        """,
+    )
+
+    # cache of ls-remote results shared by all providers:
+    # key -> (expiry time, value)
+    _ls_remote_cache = Cache(1024)
+    # (event loop, semaphore) limiting concurrent ls-remote processes
+    _ls_remote_semaphore = None
+
     def __init__(self, *args, **kwargs):
         super().__init__(*args, **kwargs)
         self.escaped_url, unresolved_ref = self.spec.split("/", 1)
@@ -680,6 +764,82 @@ class GitRepoProvider(RepoProvider):
                 "`unresolved_ref` must be specified in the url for the basic git provider"
             )
 
+    async def _ls_remote(self, *patterns):
+        """Run `git ls-remote` on the repo
+
+        Returns a list of (sha, refname) tuples, in the order of git's output.
+        """
+        command = ["git", "ls-remote", "--", self.repo, *patterns]
+        async with self._get_ls_remote_semaphore():
+            proc = await asyncio.create_subprocess_exec(
+                *command, stdout=asyncio.subprocess.PIPE, stderr=asyncio.subprocess.PIPE
+            )
+            stdout, stderr = await proc.communicate()
+            retcode = await proc.wait()
+        if retcode:
+            raise RuntimeError(
+                f"Unable to run git ls-remote to get the `resolved_ref`: {stderr.decode()}"
+            )
+        refs = []
+        for line in stdout.decode().splitlines():
+            parts = line.split(None, 1)
+            if parts:
+                refs.append((parts[0], parts[-1]))
+        return refs
+
+    def _get_ls_remote_semaphore(self):
+        # semaphores are bound to an event loop
+        loop = asyncio.get_running_loop()
+        cls = GitRepoProvider
+        if cls._ls_remote_semaphore is None or cls._ls_remote_semaphore[0] is not loop:
+            cls._ls_remote_semaphore = (
+                loop,
+                asyncio.Semaphore(self.max_concurrent_ls_remote),
+            )
+        return cls._ls_remote_semaphore[1]
+
+    def _get_cached(self, key):
+        """Get (found, value) from the ls-remote cache"""
+        entry = self._ls_remote_cache.get(key)
+        if entry is None:
+            return False, None
+        expires, value = entry
+        if expires < time.monotonic():
+            return False, None
+        return True, value
+
+    def _set_cached(self, key, value):
+        if value is None:
+            ttl = self.ls_remote_negative_cache_ttl
+        else:
+            ttl = self.ls_remote_cache_ttl
+        if ttl > 0:
+            self._ls_remote_cache.set(key, (time.monotonic() + ttl, value))
+
+    async def _resolve_ref_ls_remote(self):
+        """Resolve a head/tag with `git ls-remote`"""
+        if self.ls_remote_all_refs:
+            key = ("all", self.repo)
+            found, refs = self._get_cached(key)
+            if not found:
+                refs = await self._ls_remote()
+                self._set_cached(key, refs)
+            # match refs like `git ls-remote -- repo pattern` does:
+            # the pattern matches the end of the refname, after a `/`
+            pattern = "*/" + self.unresolved_ref
+            for sha, refname in refs:
+                if fnmatch.fnmatchcase("/" + refname, pattern):
+                    return sha
+            return None
+
+        key = ("ref", self.repo, self.unresolved_ref)
+        found, resolved_ref = self._get_cached(key)
+        if not found:
+            refs = await self._ls_remote(self.unresolved_ref)
+            resolved_ref = refs[0][0] if refs else None
+            self._set_cached(key, resolved_ref)
+        return resolved_ref
+
     async def get_resolved_ref(self):
         if hasattr(self, "resolved_ref"):
             return self.resolved_ref
@@ -689,19 +849,9 @@ class GitRepoProvider(RepoProvider):
             self.resolved_ref = self.unresolved_ref
         else:
             # The ref is a head/tag and we resolve it using `git ls-remote`
-            command = ["git", "ls-remote", "--", self.repo, self.unresolved_ref]
-            proc = await asyncio.create_subprocess_exec(
-                *command, stdout=asyncio.subprocess.PIPE, stderr=asyncio.subprocess.PIPE
-            )
-            stdout, stderr = await proc.communicate()
-            retcode = await proc.wait()
-            if retcode:
-                raise RuntimeError(
-                    f"Unable to run git ls-remote to get the `resolved_ref`: {stderr.decode()}"
-                )
-            if not stdout:
+            resolved_ref = await self._resolve_ref_ls_remote()
+            if resolved_ref is None:
                 return None
-            resolved_ref = stdout.decode().split(None, 1)[0]
             if not self.is_valid_sha1(resolved_ref):
                 raise ValueError(
                     f"resolved_ref {resolved_ref} is not a valid sha1 hexadecimal hash"
@@ -718,6 +868,9 @@ class GitRepoProvider(RepoProvider):
     def get_repo_url(self):
         return self.repo
 
+    def get_resolution_key(self):
+        return f"{self.repo}/{self.unresolved_ref}"
+
     async def get_resolved_ref_url(self):
         # not possible to construct ref url of unknown git provider
         return self.get_repo_url()
@@ -856,6 +1009,10 @@ class GitLabRepoProvider(RepoProvider):
     def get_repo_url(self):
         return f"https://{self.hostname}/{self.namespace}.git"
 
+    def get_resolution_key(self):
+        # project paths are case-insensitive, refs are not
+        return f"{self.hostname}/{self.namespace.lower()}/{self.unresolved_ref}"
+
     async def get_resolved_ref_url(self):
         if not hasattr(self, "resolved_ref"):
             self.resolved_ref = await self.get_resolved_ref()
@@ -880,14 +1037,43 @@ class GitHubRepoProvider(RepoProvider):
         "ref": {"enabled": True, "default": "HEAD"},
     }
 
-    # shared cache for resolved refs
-    cache = Cache(1024)
+    ref_cache_class = Type(
+        MemoryRefCache,
+        klass=RefCache,
+        config=True,
+        help="""The class used to cache resolved refs
+
+        Defaults to an in-memory cache in each BinderHub process.
+        Use `binderhub.ref_cache.SQLiteRefCache` to keep resolved refs
+        across restarts and share them between replicas.
+        """,
+    )
+
+    # caches shared by all providers, by (cache class, name)
+    _ref_caches = {}
+
+    def _get_ref_cache(self, name, max_age=0):
+        key = (self.ref_cache_class, name)
+        if key not in self._ref_caches:
+            self._ref_caches[key] = self.ref_cache_class(
+                config=self.config, name=name, max_age=max_age
+            )
+        return self._ref_caches[key]
+
+    @property
+    def cache(self):
+        """shared cache for resolved refs"""
+        return self._get_ref_cache("github")
+
+    @property
+    def cache_404(self):
+        """separate cache with max age for 404 results
 
-    # separate cache with max age for 404 results
-    # 404s don't have ETags, so we want them to expire at some point
-    # to avoid caching a 404 forever since e.g. a missing repo or branch
-    # may be created later
-    cache_404 = Cache(1024, max_age=300)
+        404s don't have ETags, so we want them to expire at some point
+        to avoid caching a 404 forever since e.g. a missing repo or branch
+        may be created later
+        """
+        return self._get_ref_cache("github_404", max_age=300)
 
     hostname = Unicode(
         "github.com",
@@ -972,6 +1158,10 @@ class GitHubRepoProvider(RepoProvider):
     def get_repo_url(self):
         return f"https://{self.hostname}/{self.user}/{self.repo}"
 
+    def get_resolution_key(self):
+        # owners and repos are case-insensitive, refs are not
+        return f"{self.hostname}/{self.user.lower()}/{self.repo.lower()}/{self.unresolved_ref}"
+
     async def get_resolved_ref_url(self):
         if not hasattr(self, "resolved_ref"):
             self.resolved_ref = await self.get_resolved_ref()
@@ -1073,12 +1263,12 @@ class GitHubRepoProvider(RepoProvider):
             ref=self.unresolved_ref,
         )
         self.log.debug("Fetching %s", api_url)
-        cached = self.cache.get(api_url)
+        cached = await self.cache.get(api_url)
         if cached:
             etag = cached["etag"]
             self.log.debug("Cache hit for %s: %s", api_url, etag)
         else:
-            cache_404 = self.cache_404.get(api_url)
+            cache_404 = await self.cache_404.get(api_url)
             if cache_404:
                 self.log.debug("Cache hit for 404 on %s", api_url)
                 return None
@@ -1087,13 +1277,13 @@ class GitHubRepoProvider(RepoProvider):
         resp = await self.github_api_request(api_url, etag=etag)
         if resp is None:
             self.log.debug("Caching 404 on %s", api_url)
-            self.cache_404.set(api_url, True)
+            await self.cache_404.set(api_url, True)
             return None
         if resp.code == 304:
             self.log.info("Using cached ref for %s: %s", api_url, cached["sha"])
             self.resolved_ref = cached["sha"]
             # refresh cache entry
-            self.cache.move_to_end(api_url)
+            await self.cache.refresh(api_url, cached)
             return self.resolved_ref
         elif cached:
             self.log.debug("Cache outdated for %s", api_url)
@@ -1106,7 +1296,7 @@ class GitHubRepoProvider(RepoProvider):
             return None
         # store resolved ref and cache for later
         self.resolved_ref = ref_info["sha"]
-        self.cache.set(
+        await self.cache.set(
             api_url,
             {
                 "etag": resp.headers.get("ETag"),
@@ -1174,6 +1364,9 @@ class GistRepoProvider(GitHubRepoProvider):
     def get_repo_url(self):
         return f"https://{self.hostname}/{self.user}/{self.gist_id}.git"
 
+    def get_resolution_key(self):
+        return f"{self.hostname}/{self.gist_id.lower()}/{self.unresolved_ref}"
+
     async def get_resolved_ref_url(self):
         if not hasattr(self, "resolved_ref"):
             self.resolved_ref = await self.get_resolved_ref()
@@ -1444,6 +1637,14 @@ class CuratedRepoProvider(RepoProvider):
             return None
         return await self.provider.get_resolved_ref()
 
+    def get_resolution_key(self):
+        if not self.provider:
+            return None
+        return self.provider.get_resolution_key()
+
+    def use_resolved_ref(self, resolved_ref):
+        self.provider.use_resolved_ref(resolved_ref)
+
     async def get_resolved_spec(self):
         if not self.provider:
             return None
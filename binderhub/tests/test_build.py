@@ -348,6 +348,90 @@ def test_sticky_builds_affinity():
     ].preference.match_expressions[0].values[0] in ("node-a", "node-b")
 
 
+def test_sticky_builds_bounded_load():
+    nodes = ["node-a", "node-b"]
+    builds = {}
+
+    def list_pods(namespace, label_selector):
+        if label_selector == "component=image-builder,app=binder":
+            return [{"spec": {"nodeName": name}} for name in nodes]
+        return list(builds.values())
+
+    def make_build(repo_url):
+        return KubernetesBuildExecutor(
+            q=mock.MagicMock(),
+            api=mock.MagicMock(),
+            pod_cache=mock.MagicMock(list_pods=list_pods),
+            name="test_build",
+            namespace="build_namespace",
+            repo_url=repo_url,
+            ref="ref",
+            build_image="image",
+            image_name="name",
+            sticky_builds=True,
+        )
+
+    def preferred_node(affinity):
+        terms = (
+            affinity.node_affinity.preferred_during_scheduling_ignored_during_execution
+        )
+        return terms[0].preference.match_expressions[0].values[0]
+
+    build = make_build("repo")
+    first_choice = preferred_node(build.get_affinity())
+    assert build.sticky_node == first_choice
+
+    # the first choice is busy, e.g. building other refs of the same repo
+    for i in range(4):
+        builds[f"build-{i}"] = {
+            "metadata": {"annotations": {"binder-sticky-node": first_choice}},
+            "spec": {},
+            "status": {"phase": "Pending"},
+        }
+    second_choice = preferred_node(make_build("repo").get_affinity())
+    assert second_choice != first_choice
+
+    # finished builds don't count
+    for pod in builds.values():
+        pod["status"]["phase"] = "Succeeded"
+    assert preferred_node(make_build("repo").get_affinity()) == first_choice
+
+
+def test_sticky_builds_without_pod_cache():
+    api = _list_image_builder_pods_mock()
+    namespace = f"build-{uuid4()}"
+
+    def make_build():
+        return KubernetesBuildExecutor(
+            q=mock.MagicMock(),
+            api=api,
+            name="test_build",
+            namespace=namespace,
+            repo_url="repo",
+            ref="ref",
+            build_image="image",
+            image_name="name",
+            sticky_builds=True,
+        )
+
+    build = make_build()
+    build.get_affinity()
+    other_build = make_build()
+    other_build.get_affinity()
+    selectors = [
+        call[1]["label_selector"] for call in api.list_namespaced_pod.call_args_list
+    ]
+    # listings are shared by builds
+    assert selectors.count("component=image-builder,app=binder") == 1
+    assert selectors.count("component=binderhub-build") == 1
+
+    # builds placed since the listing count on the node they were sent to
+    builds = make_build()._builds_per_node()
+    assert sum(builds.values()) == 4
+    assert builds[build.sticky_node] >= 2
+    assert len(api.list_namespaced_pod.call_args_list) == 2
+
+
 def test_build_memory_limits():
     # Setup some mock objects for the response from the k8s API
     mock_k8s_api = _list_image_builder_pods_mock()
@@ -618,3 +702,41 @@ def test_extra_r2d_options():
         "--user-id=1000",
         "--repo-dir=/srv/repo",
     ]
+
+
+def test_cache_from_r2d_options():
+    bex = BuildExecutor(image_name="test:new", ref="main", cache_from=["test:old"])
+    assert "--cache-from=test:old" in bex.get_r2d_cmd_options()
+
+
+def test_progress_event_phase():
+    event = ProgressEvent.from_log_line('{"phase": "building", "message": "hi"}')
+    assert event.phase == "building"
+    assert json.loads(event.payload)["message"] == "hi"
+
+    event = ProgressEvent.from_log_line("not json")
+    assert event.phase == "unknown"
+    assert json.loads(event.payload) == {"phase": "unknown", "message": "not json"}
+
+    # parsed lazily for events created elsewhere
+    event = ProgressEvent(ProgressEvent.Kind.LOG_MESSAGE, '{"phase": "failed"}')
+    assert event.phase == "failed"
+    event = ProgressEvent(
+        ProgressEvent.Kind.BUILD_STATUS_CHANGE, ProgressEvent.BuildStatus.BUILT
+    )
+    assert event.phase == "built"
+
+
+async def test_progress_batched():
+    q = Queue()
+    build = BuildExecutor(q=q)
+    with mock.patch.object(build.main_loop, "add_callback") as add_callback:
+        for i in range(3):
+            build.put_event(
+                ProgressEvent.from_log_line(json.dumps({"message": str(i)}))
+            )
+    # one callback for all events put before the main thread got to them
+    add_callback.assert_called_once_with(build._put_pending_events)
+    build._put_pending_events()
+    assert q.qsize() == 3
+    assert json.loads(q.get_nowait().payload) == {"message": "0"}
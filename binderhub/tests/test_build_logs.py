@@ -0,0 +1,98 @@
+"""Test storing build logs"""
+
+import asyncio
+import gzip
+import json
+import os
+
+from binderhub.build import ProgressEvent
+from binderhub.build_logs import BuildLogStore, log_filename
+from binderhub.build_registry import SharedBuild
+from binderhub.handlers.build_logs import BuildLogsHandler
+
+
+def test_log_filename():
+    assert (
+        log_filename("prefix/binder-repo:abc") == "prefix_2Fbinder-repo_3Aabc.jsonl.gz"
+    )
+    # can't escape the log directory
+    path = BuildLogsHandler.get_absolute_path("/logs", "../../etc/passwd")
+    assert os.path.dirname(path) == "/logs"
+
+
+def test_build_logs_not_stored_by_default():
+    # the /build-logs endpoint is only served when a path is set
+    store = BuildLogStore()
+    assert store.path == ""
+    assert store.open("image:abc") is None
+
+
+async def test_build_log_writer(tmp_path):
+    store = BuildLogStore(path=str(tmp_path))
+    writer = store.open("image:abc")
+    writer.write(json.dumps({"phase": "building", "message": "step 1\n"}))
+    writer.write(json.dumps({"phase": "building", "message": "step 2\n"}))
+    # readable while the build is running
+    assert [json.loads(line)["message"] for line in writer.read_lines()] == [
+        "step 1\n",
+        "step 2\n",
+    ]
+    assert not os.path.exists(store.log_path("image:abc"))
+
+    writer.close()
+    with gzip.open(store.log_path("image:abc"), "rt") as f:
+        assert len(f.readlines()) == 2
+
+
+async def test_build_log_max_size(tmp_path):
+    store = BuildLogStore(path=str(tmp_path), max_log_size=100)
+    writer = store.open("image:abc")
+    for i in range(1000):
+        writer.write(json.dumps({"message": os.urandom(64).hex()}))
+    writer.close()
+    lines = writer.read_lines()
+    assert len(lines) < 1000
+    assert json.loads(lines[-1])["message"] == "Build log truncated\n"
+
+
+async def test_build_log_prune(tmp_path):
+    store = BuildLogStore(path=str(tmp_path), max_total_size=0)
+    for i, name in enumerate(["old", "new"]):
+        writer = store.open(name)
+        writer.write(json.dumps({"message": name}))
+        writer.close()
+        os.utime(writer.path, (i, i))
+    store.max_total_size = os.path.getsize(store.log_path("new"))
+    store._prune()
+    assert os.listdir(tmp_path) == [log_filename("new")]
+
+
+class _Build:
+    image_name = "image:abc"
+
+
+async def test_replay_from_log(tmp_path):
+    store = BuildLogStore(path=str(tmp_path))
+    shared_build = SharedBuild(
+        _Build(), registry=None, replay_limit=2, log_writer=store.open("image:abc")
+    )
+    for i in range(5):
+        shared_build._publish(
+            ProgressEvent(
+                ProgressEvent.Kind.LOG_MESSAGE, json.dumps({"message": str(i)})
+            )
+        )
+    assert len(shared_build.events) == 2
+    q = shared_build.subscribe()
+    # published while the log is being read
+    shared_build._publish(
+        ProgressEvent(ProgressEvent.Kind.LOG_MESSAGE, json.dumps({"message": "5"}))
+    )
+    messages = []
+    for i in range(6):
+        event = await asyncio.wait_for(q.get(), timeout=10)
+        messages.append(json.loads(event.payload)["message"])
+    assert messages == ["0", "1", "2", "3", "4", "5"]
+    assert q.qsize() == 0
+    shared_build.log_writer.close()
+    await asyncio.sleep(0)
@@ -0,0 +1,253 @@
+"""Test sharing builds between requests"""
+
+import asyncio
+import json
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from unittest import mock
+
+import pytest
+from tornado.queues import Queue
+
+from binderhub.build import BuildExecutor, ProgressEvent
+from binderhub.build_queue import BuildQueue
+from binderhub.build_registry import BuildRegistry
+
+
+class GatedBuild(BuildExecutor):
+    """Build that only finishes when told to"""
+
+    submitted = 0
+
+    def submit(self):
+        GatedBuild.submitted += 1
+        self.progress(
+            ProgressEvent.Kind.BUILD_STATUS_CHANGE, ProgressEvent.BuildStatus.RUNNING
+        )
+        self.release.wait(10)
+        if self.stop_event.is_set():
+            return
+        self.progress(
+            ProgressEvent.Kind.BUILD_STATUS_CHANGE, ProgressEvent.BuildStatus.BUILT
+        )
+
+    def stream_logs(self):
+        self.progress(
+            ProgressEvent.Kind.LOG_MESSAGE,
+            json.dumps({"phase": "building", "message": "step 1\n"}),
+        )
+
+
+def _make_build(image_name="test/image:abc"):
+    build = GatedBuild(
+        q=Queue(),
+        name="build-test",
+        repo_url="https://example.com/repo",
+        ref="abc",
+        image_name=image_name,
+    )
+    build.release = threading.Event()
+    return build
+
+
+async def _collect(q):
+    events = []
+    while True:
+        event = await q.get()
+        events.append(event)
+        if event.payload in (
+            ProgressEvent.BuildStatus.BUILT,
+            ProgressEvent.BuildStatus.FAILED,
+        ):
+            return events
+
+
+METRIC_LABELS = {"provider": "test", "repo": "https://example.com/repo"}
+
+
+@pytest.fixture
+def pool():
+    pool = ThreadPoolExecutor(2)
+    yield pool
+    pool.shutdown(wait=False)
+
+
+async def test_shared_build_fan_out(pool):
+    GatedBuild.submitted = 0
+    registry = BuildRegistry()
+    build = _make_build()
+    shared_build = registry.start(build, pool, metric_labels=METRIC_LABELS)
+    assert registry.get(build.image_name) is shared_build
+
+    q1 = shared_build.subscribe()
+    # wait for the log message before a second request joins
+    while len(shared_build.events) < 2:
+        await asyncio.sleep(0.01)
+    q2 = registry.get(build.image_name).subscribe()
+
+    build.release.set()
+    events1, events2 = await asyncio.wait_for(
+        asyncio.gather(_collect(q1), _collect(q2)), timeout=10
+    )
+    assert [e.payload for e in events1] == [e.payload for e in events2]
+    assert events1[-1].payload == ProgressEvent.BuildStatus.BUILT
+    assert GatedBuild.submitted == 1
+    # finished builds are no longer registered
+    assert registry.get(build.image_name) is None
+
+
+async def test_last_unsubscribe_stops_build(pool):
+    registry = BuildRegistry()
+    build = _make_build()
+    shared_build = registry.start(build, pool)
+    q1 = shared_build.subscribe()
+    q2 = shared_build.subscribe()
+
+    shared_build.unsubscribe(q1)
+    assert not build.stop_event.is_set()
+    assert registry.get(build.image_name) is shared_build
+
+    shared_build.unsubscribe(q2)
+    assert build.stop_event.is_set()
+    assert registry.get(build.image_name) is None
+    build.release.set()
+
+
+async def test_start_twice(pool):
+    registry = BuildRegistry()
+    build = _make_build()
+    shared_build = registry.start(build, pool)
+    with pytest.raises(ValueError):
+        registry.start(_make_build(), pool)
+    shared_build.unsubscribe(shared_build.subscribe())
+    build.release.set()
+
+
+async def test_build_queue_round_robin():
+    queue = BuildQueue(concurrent_build_limit=1)
+    started = []
+    positions = {}
+
+    async def build(name, repo, high_priority=False):
+        await queue.acquire(
+            repo,
+            high_priority=high_priority,
+            on_position=lambda n: positions.__setitem__(name, n),
+        )
+        started.append(name)
+
+    await build("a1", "a")
+    tasks = [
+        asyncio.ensure_future(build(name, name[0])) for name in ("a2", "a3", "b1", "b2")
+    ]
+    tasks.append(asyncio.ensure_future(build("c1", "c", high_priority=True)))
+    await asyncio.sleep(0)
+    assert len(queue) == 5
+    assert positions == {"c1": 1, "a2": 2, "b1": 3, "a3": 4, "b2": 5}
+
+    for _ in range(5):
+        queue.release(started[-1][0])
+        await asyncio.sleep(0)
+    await asyncio.gather(*tasks)
+    assert started == ["a1", "c1", "a2", "b1", "a3", "b2"]
+    # the last waiter moved up the queue
+    assert positions["b2"] == 1
+
+
+async def test_build_queue_per_repo_limit():
+    queue = BuildQueue(concurrent_build_limit=2, per_repo_limit=1)
+    await queue.acquire("a")
+    waiting = asyncio.ensure_future(queue.acquire("a"))
+    # other repos aren't blocked by a busy repo
+    await asyncio.wait_for(queue.acquire("b"), timeout=1)
+    assert not waiting.done()
+
+    # cancelled builds leave the queue
+    waiting.cancel()
+    await asyncio.sleep(0)
+    assert len(queue) == 0
+    queue.release("a")
+    queue.release("b")
+    assert queue.total_running == 0
+
+
+async def test_queued_build_position(pool):
+    queue = BuildQueue(concurrent_build_limit=1)
+    registry = BuildRegistry(build_queue=queue)
+    first = _make_build()
+    registry.start(first, pool, metric_labels=METRIC_LABELS).subscribe()
+    second = _make_build("test/other:abc")
+    shared_build = registry.start(second, pool, metric_labels=METRIC_LABELS)
+    q = shared_build.subscribe()
+    event = await asyncio.wait_for(q.get(), timeout=10)
+    assert json.loads(event.payload)["message"] == "You are #1 in the build queue\n"
+    # not kept for replay
+    assert len(shared_build.events) == 0
+
+    first.release.set()
+    second.release.set()
+    events = await asyncio.wait_for(_collect(q), timeout=10)
+    assert events[-1].payload == ProgressEvent.BuildStatus.BUILT
+    assert queue.total_running == 0
+
+
+async def test_abandoned_build_keeps_queue_slot(pool):
+    queue = BuildQueue(concurrent_build_limit=1)
+    registry = BuildRegistry(build_queue=queue)
+    build = _make_build()
+    build.on_finished = mock.Mock()
+    shared_build = registry.start(build, pool)
+    q = shared_build.subscribe()
+    while shared_build.submitted_at is None:
+        await asyncio.sleep(0.01)
+
+    shared_build.unsubscribe(q)
+    await asyncio.sleep(0.05)
+    # the build keeps running, and keeps its slot
+    assert queue.total_running == 1
+    (release,) = build.on_finished.call_args[0]
+    release()
+    assert queue.total_running == 0
+    build.release.set()
+
+
+async def test_abandoned_build_is_reaped(pool):
+    registry = BuildRegistry(reap_abandoned_builds=True, abandoned_build_grace_period=0)
+    build = _make_build()
+    build.cleanup = mock.Mock()
+    shared_build = registry.start(build, pool)
+    q = shared_build.subscribe()
+    while shared_build.submitted_at is None:
+        await asyncio.sleep(0.01)
+
+    shared_build.unsubscribe(q)
+    # kept for the grace period, in case someone comes back
+    assert not build.stop_event.is_set()
+    assert registry.get(build.image_name) is shared_build
+    q = shared_build.subscribe()
+    await asyncio.sleep(0.05)
+    assert registry.get(build.image_name) is shared_build
+
+    shared_build.unsubscribe(q)
+    for _ in range(50):
+        if build.cleanup.called:
+            break
+        await asyncio.sleep(0.01)
+    build.cleanup.assert_called_once_with()
+    assert build.stop_event.is_set()
+    assert registry.get(build.image_name) is None
+    build.release.set()
+
+
+async def test_build_only_is_not_reaped(pool):
+    registry = BuildRegistry(reap_abandoned_builds=True, abandoned_build_grace_period=0)
+    build = _make_build()
+    build.cleanup = mock.Mock()
+    shared_build = registry.start(build, pool)
+    shared_build.reap_when_abandoned = False
+    shared_build.unsubscribe(shared_build.subscribe())
+    # stops watching right away, but leaves the build running
+    assert build.stop_event.is_set()
+    await asyncio.sleep(0.05)
+    build.cleanup.assert_not_called()
+    build.release.set()
@@ -0,0 +1,104 @@
+"""Test resumable build event streams"""
+
+import asyncio
+
+from binderhub.build_sessions import BuildSessionRegistry
+from binderhub.builder import BuildHandler
+
+
+async def test_session_resume():
+    sessions = BuildSessionRegistry()
+    session = sessions.create(("/build/gh/a/b/HEAD", "anonymous"))
+    session.append("a")
+    session.append("b")
+
+    found, index = sessions.get_by_event_id(
+        session.event_id(0), ("/build/gh/a/b/HEAD", "anonymous")
+    )
+    assert found is session
+    assert session.events[index:] == ["b"]
+
+    # other requests can't attach
+    assert sessions.get_by_event_id(
+        session.event_id(0), ("/build/gh/c/d/HEAD", "anonymous")
+    ) == (None, 0)
+    assert sessions.get_by_event_id("nosuchsession-0", session.key) == (None, 0)
+
+
+async def test_session_wait():
+    sessions = BuildSessionRegistry()
+    session = sessions.create("key")
+    waiter = asyncio.ensure_future(session.wait(0))
+    await asyncio.sleep(0)
+    assert not waiter.done()
+    session.append("a")
+    await asyncio.wait_for(waiter, timeout=1)
+    # returns right away for events that are already there
+    await asyncio.wait_for(session.wait(0), timeout=1)
+
+    waiter = asyncio.ensure_future(session.wait(1))
+    session.finish()
+    await asyncio.wait_for(waiter, timeout=1)
+
+
+async def test_session_expires():
+    sessions = BuildSessionRegistry(session_ttl=0)
+    session = sessions.create("key")
+    session.task = asyncio.ensure_future(asyncio.sleep(10))
+    sessions.attach(session)
+    sessions.detach(session)
+    # reconnecting in time keeps the session alive
+    sessions.attach(session)
+    await asyncio.sleep(0.01)
+    assert session.id in sessions.sessions
+
+    sessions.detach(session)
+    await asyncio.sleep(0.01)
+    assert session.id not in sessions.sessions
+    assert session.task.cancelled()
+
+
+class _FakeHandler:
+    """Collects what BuildHandler.stream_session writes"""
+
+    _stream_closed = False
+
+    def __init__(self, sessions):
+        self.settings = {"build_sessions": sessions}
+        self.buffer = []
+        self.flushes = []
+
+    def write(self, chunk):
+        self.buffer.append(chunk)
+
+    async def flush(self):
+        self.flushes.append(self.buffer)
+        self.buffer = []
+
+
+async def test_stream_session_coalesces():
+    sessions = BuildSessionRegistry(flush_interval=0.05)
+    session = sessions.create("key")
+    handler = _FakeHandler(sessions)
+    stream = asyncio.ensure_future(BuildHandler.stream_session(handler, session))
+
+    session.append('{"phase": "building", "message": "1"}', phase="building")
+    await asyncio.sleep(0.01)
+    # phase changes are sent right away
+    assert len(handler.flushes) == 1
+
+    for i in range(10):
+        session.append('{"phase": "building", "message": "log"}', phase="building")
+        await asyncio.sleep(0)
+    assert len(handler.flushes) == 1
+    # log messages in the same phase are sent together
+    await asyncio.sleep(0.1)
+    assert len(handler.flushes) == 2
+    assert len(handler.flushes[1]) == 10
+    assert handler.flushes[1][-1].startswith(f"id: {session.event_id(10)}\n")
+
+    session.append('{"phase": "built"}', phase="built")
+    session.finish()
+    await asyncio.wait_for(stream, timeout=1)
+    assert len(handler.flushes) == 3
+    assert session.clients == 1
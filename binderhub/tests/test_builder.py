@@ -1,6 +1,16 @@
+import asyncio
+from unittest import mock
+
 import pytest
 
-from binderhub.builder import _generate_build_name, _get_image_basename_and_tag
+from binderhub.builder import (
+    BuildHandler,
+    _generate_build_name,
+    _get_image_basename_and_tag,
+    _start_build,
+)
+from binderhub.repoproviders import GitHubRepoProvider
+from binderhub.utils import SingleFlight
 
 
 @pytest.mark.parametrize(
@@ -56,3 +66,88 @@ def test_build_name(build_slug, ref):
 
     last_char = build_name[-1]
     assert last_char not in ("-", "_", ".")
+
+
+async def test_resolve_ref_shared():
+    handler = mock.Mock(_ref_resolutions=SingleFlight())
+    release = asyncio.Event()
+    calls = []
+
+    async def get_resolved_ref():
+        calls.append(1)
+        await release.wait()
+        return "abc"
+
+    first = GitHubRepoProvider(spec="Owner/Repo/HEAD")
+    first.get_resolved_ref = get_resolved_ref
+    # same repo, different case
+    second = GitHubRepoProvider(spec="owner/repo/HEAD")
+    second.get_resolved_ref = get_resolved_ref
+    # different ref
+    third = GitHubRepoProvider(spec="owner/repo/main")
+    third.get_resolved_ref = get_resolved_ref
+
+    tasks = [
+        asyncio.ensure_future(BuildHandler.resolve_ref(handler, provider))
+        for provider in (first, second, third)
+    ]
+    await asyncio.sleep(0)
+    release.set()
+    assert await asyncio.gather(*tasks) == ["abc", "abc", "abc"]
+    assert len(calls) == 2
+    # the request that joined has the ref on its own provider
+    assert second.resolved_ref == "abc"
+
+
+async def test_start_build_cache_from_previous():
+    registry = mock.Mock()
+    registry.get_credentials = mock.AsyncMock(return_value=None)
+    registry.latest_tag.return_value = "old"
+    build_registry = mock.Mock()
+    build_registry.get.return_value = None
+    build = mock.Mock(cache_from_previous=True)
+    settings = {
+        "build_registry": build_registry,
+        "build_class": mock.Mock(return_value=build),
+        "build_pool": None,
+        "traitlets_parent": None,
+        "use_registry": True,
+        "registry": registry,
+    }
+    provider = GitHubRepoProvider(spec="owner/repo/HEAD")
+    image_name = "gcr.io/project/binder-owner-repo:new"
+
+    _, started = await _start_build(settings, provider, "new", image_name, {})
+    assert started
+    # looked up in the registry without the host, but pulled with it
+    registry.latest_tag.assert_called_once_with("project/binder-owner-repo")
+    assert build.cache_from == ["gcr.io/project/binder-owner-repo:old"]
+
+
+async def test_launch_from_warm_pool():
+    warm_pool = mock.Mock()
+    warm_pool.claim = mock.AsyncMock(return_value={"url": "http://hub/user/x/"})
+    handler = mock.Mock(
+        settings={"warm_pool": warm_pool, "image_prepuller": mock.Mock()},
+        image_name="test/image:abc",
+        repo_url="https://github.com/owner/repo",
+        repo_metric_labels={"provider": "gh", "repo": "owner/repo"},
+        launch_options={"volumes": [{"name": "mount1"}]},
+    )
+    handler.check_quota = mock.AsyncMock(return_value=None)
+    handler.emit_ready = mock.AsyncMock()
+    handler.get_launch_args = lambda provider, client_ip: BuildHandler.get_launch_args(
+        handler, provider, client_ip
+    )
+    provider = GitHubRepoProvider(spec="owner/repo/HEAD")
+
+    await BuildHandler.launch(handler, provider)
+    # quota is checked before claiming a warm server
+    handler.check_quota.assert_awaited_once_with(provider)
+    extra_args = warm_pool.claim.call_args[1]["extra_args"]
+    assert extra_args["volumes"] == [{"name": "mount1"}]
+    assert extra_args["environment"]["BINDER_CLIENT_IP"] == ""
+    handler.settings["image_prepuller"].record_launch.assert_called_once_with(
+        "test/image:abc"
+    )
+    handler.emit_ready.assert_awaited_once_with({"url": "http://hub/user/x/"})
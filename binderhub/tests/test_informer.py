@@ -0,0 +1,295 @@
+"""Test the shared pod informer"""
+
+import asyncio
+import datetime
+import json
+from unittest import mock
+
+from tornado.queues import Queue
+
+from binderhub.build import KubernetesBuildExecutor, KubernetesCleaner, ProgressEvent
+from binderhub.informer import PodCache, PodInformer
+
+
+def _pod(name, phase="Pending", resource_version="1"):
+    return {
+        "metadata": {"name": name, "resourceVersion": resource_version},
+        "status": {"phase": phase},
+    }
+
+
+def test_informer_list():
+    api = mock.MagicMock()
+    api.list_namespaced_pod.return_value.read.return_value = json.dumps(
+        {
+            "metadata": {"resourceVersion": "42"},
+            "items": [_pod("a"), _pod("b", "Running")],
+        }
+    )
+    informer = PodInformer(api=api, namespace="ns", label_selector="x=y")
+    informer.main_loop = mock.MagicMock()
+    assert informer._list() == "42"
+    callback, pods = informer.main_loop.add_callback.call_args[0]
+    callback(pods)
+    assert sorted(informer.pods) == ["a", "b"]
+    assert informer.last_sync > 0
+
+
+def test_informer_handlers():
+    informer = PodInformer(namespace="ns", label_selector="x=y")
+    events = []
+
+    def handler(event_type, pod):
+        events.append((event_type, pod["status"]["phase"]))
+
+    informer._handle_event("ADDED", _pod("a"))
+    informer._handle_event("ADDED", _pod("b"))
+    # replays the current state
+    informer.add_handler("a", handler)
+    assert events == [("ADDED", "Pending")]
+
+    informer._handle_event("MODIFIED", _pod("a", "Running"))
+    informer._handle_event("MODIFIED", _pod("b", "Running"))
+    assert events[-1] == ("MODIFIED", "Running")
+    assert len(events) == 2
+
+    # relist without "a" reports it as deleted
+    informer._handle_list({"b": _pod("b", "Running")})
+    assert events[-1] == ("DELETED", "Running")
+    assert "a" not in informer.pods
+
+    informer.remove_handler("a", handler)
+    informer._handle_event("ADDED", _pod("a"))
+    assert len(events) == 3
+
+
+def test_build_with_informer():
+    informer = PodInformer(namespace="ns", label_selector="x=y")
+    mock_k8s_api = mock.MagicMock()
+    mock_k8s_api.list_namespaced_pod.return_value.read.return_value = json.dumps(
+        {"items": []}
+    )
+    build = KubernetesBuildExecutor(
+        q=Queue(),
+        api=mock_k8s_api,
+        name="test_build",
+        namespace="build_namespace",
+        repo_url="repo",
+        ref="ref",
+        build_image="image",
+        image_name="name",
+        memory_limit=0,
+        docker_host="http://mydockerregistry.local",
+        node_selector={},
+        pod_informer=informer,
+    )
+    build.main_loop = mock.MagicMock()
+    build.progress = mock.MagicMock()
+    # returns right away instead of watching the pod
+    build.submit()
+    assert mock_k8s_api.create_namespaced_pod.call_count == 1
+    # pods are not listed for scheduling without sticky builds
+    mock_k8s_api.list_namespaced_pod.assert_not_called()
+    build.main_loop.add_callback.assert_called_once_with(
+        informer.add_handler, "test_build", build._handle_pod_event
+    )
+
+    informer.add_handler("test_build", build._handle_pod_event)
+    informer._handle_event("ADDED", _pod("test_build", "Running"))
+    build.progress.assert_called_with(
+        ProgressEvent.Kind.BUILD_STATUS_CHANGE, ProgressEvent.BuildStatus.RUNNING
+    )
+    informer._handle_event("DELETED", _pod("test_build", "Succeeded"))
+    build.progress.assert_called_with(
+        ProgressEvent.Kind.BUILD_STATUS_CHANGE, ProgressEvent.BuildStatus.BUILT
+    )
+    assert "test_build" not in informer._handlers
+
+
+def test_pod_cache():
+    cache = PodCache(api=mock.MagicMock())
+    assert cache.list_pods("ns", "component=binderhub-build") is None
+
+    informer = cache.get_informer("ns", "component=binderhub-build")
+    assert cache.get_informer("ns", "component=binderhub-build") is informer
+    # not in sync yet, even if the monotonic clock is below max_age
+    with mock.patch("time.monotonic", return_value=120):
+        assert cache.list_pods("ns", "component=binderhub-build") is None
+
+    informer._handle_list({"a": _pod("a")})
+    assert cache.list_pods("ns", "component=binderhub-build") == [_pod("a")]
+    assert cache.list_pods("other", "component=binderhub-build") is None
+
+
+def test_cleaner_with_pod_cache():
+    cache = PodCache(api=mock.MagicMock())
+    informer = cache.get_informer("ns", "component=binderhub-build")
+    old_pod = _pod("old", "Running")
+    old_pod["status"]["startTime"] = "2000-01-01T00:00:00Z"
+    new_pod = _pod("new", "Running")
+    new_pod["status"]["startTime"] = datetime.datetime.now(
+        tz=datetime.timezone.utc
+    ).isoformat()
+    informer._handle_list(
+        {
+            "done": _pod("done", "Succeeded"),
+            "old": old_pod,
+            "new": new_pod,
+        }
+    )
+    kube = mock.MagicMock()
+    cleaner = KubernetesCleaner(kube=kube, namespace="ns", pod_cache=cache)
+    cleaner.cleanup()
+    kube.list_namespaced_pod.assert_not_called()
+    deleted = {c.kwargs["name"] for c in kube.delete_namespaced_pod.call_args_list}
+    assert deleted == {"done", "old"}
+
+
+def test_informer_handler_for_all_pods():
+    informer = PodInformer(namespace="ns", label_selector="x=y")
+    events = []
+
+    def handler(event_type, pod):
+        events.append((event_type, pod["metadata"]["name"]))
+
+    informer._handle_event("ADDED", _pod("a"))
+    informer.add_handler(None, handler)
+    assert events == [("ADDED", "a")]
+    informer._handle_event("ADDED", _pod("b"))
+    assert events[-1] == ("ADDED", "b")
+
+
+def test_cleaner_paginated_list():
+    kube = mock.MagicMock()
+    pages = []
+    for name, token in [("a", "next"), ("b", None)]:
+        pod = mock.MagicMock()
+        pod.metadata.name = name
+        pod.metadata.annotations = {}
+        pod.status.phase = "Succeeded"
+        page = mock.MagicMock(items=[pod])
+        page.metadata._continue = token
+        pages.append(page)
+    kube.list_namespaced_pod.side_effect = pages
+    cleaner = KubernetesCleaner(kube=kube, namespace="ns", list_page_size=1)
+    cleaner.cleanup()
+    calls = kube.list_namespaced_pod.call_args_list
+    assert [c.kwargs["_continue"] for c in calls] == [None, "next"]
+    assert calls[0].kwargs["limit"] == 1
+    deleted = {c.kwargs["name"] for c in kube.delete_namespaced_pod.call_args_list}
+    assert deleted == {"a", "b"}
+
+
+async def test_cleaner_follows_informer():
+    informer = PodInformer(namespace="ns", label_selector="component=binderhub-build")
+    kube = mock.MagicMock()
+    cleaner = KubernetesCleaner(kube=kube, namespace="ns", pod_informer=informer)
+    running = _pod("running", "Running")
+    running["status"]["startTime"] = datetime.datetime.now(
+        tz=datetime.timezone.utc
+    ).isoformat()
+    informer._handle_event("ADDED", running)
+    cleaner.start()
+    # deletion scheduled at its max age
+    handle, delay = cleaner._deletions["running"]
+    assert 0 < delay <= cleaner.max_age
+
+    # deleted as soon as it stops
+    informer._handle_event("MODIFIED", _pod("running", "Succeeded"))
+    assert cleaner._deletions["running"][1] == 0
+    for _ in range(10):
+        if kube.delete_namespaced_pod.called:
+            break
+        await asyncio.sleep(0.1)
+    assert kube.delete_namespaced_pod.call_args.kwargs["name"] == "running"
+
+    informer._handle_event("DELETED", _pod("running", "Succeeded"))
+    assert "running" not in cleaner._deletions
+
+
+def test_build_fails_when_stuck():
+    informer = PodInformer(namespace="ns", label_selector="x=y")
+    build = KubernetesBuildExecutor(
+        q=Queue(),
+        api=mock.MagicMock(),
+        name="test_build",
+        namespace="build_namespace",
+        repo_url="repo",
+        ref="ref",
+        build_image="image",
+        image_name="name",
+        pod_informer=informer,
+        stuck_pod_timeout=60,
+    )
+    build.main_loop = mock.MagicMock()
+    build.progress = mock.MagicMock()
+    informer.add_handler("test_build", build._handle_pod_event)
+
+    pod = _pod("test_build")
+    pod["status"]["containerStatuses"] = [
+        {"state": {"waiting": {"reason": "ImagePullBackOff", "message": "nope"}}}
+    ]
+    informer._handle_event("MODIFIED", pod)
+    build.progress.assert_called_with(
+        ProgressEvent.Kind.BUILD_STATUS_CHANGE, ProgressEvent.BuildStatus.PENDING
+    )
+    # checks again at the deadline, in case the pod doesn't change
+    delay, callback = build.main_loop.call_later.call_args[0]
+    assert 0 < delay <= 60
+    assert callback == build._recheck_stuck
+
+    build._stuck_since -= 60
+    build._recheck_stuck()
+    build.progress.assert_called_with(
+        ProgressEvent.Kind.BUILD_STATUS_CHANGE, ProgressEvent.BuildStatus.FAILED
+    )
+    message = json.loads(build.progress.call_args_list[-2][0][1])
+    assert "ImagePullBackOff" in message["message"]
+    build.main_loop.run_in_executor.assert_called_once_with(None, build.cleanup)
+    assert "test_build" not in informer._handlers
+    assert build.stop_event.is_set()
+
+
+def test_build_finished_with_informer():
+    informer = PodInformer(namespace="ns", label_selector="x=y")
+    build = KubernetesBuildExecutor(
+        q=Queue(),
+        api=mock.MagicMock(),
+        name="test_build",
+        namespace="build_namespace",
+        repo_url="repo",
+        ref="ref",
+        build_image="image",
+        image_name="name",
+        pod_informer=informer,
+    )
+    callback = mock.Mock()
+    informer._handle_event("ADDED", _pod("test_build", "Running"))
+    build._watch_finished(callback)
+    callback.assert_not_called()
+    informer._handle_event("MODIFIED", _pod("test_build", "Succeeded"))
+    callback.assert_called_once_with()
+    assert "test_build" not in informer._handlers
+
+    # already gone
+    callback = mock.Mock()
+    informer._handle_event("DELETED", _pod("test_build", "Succeeded"))
+    build._watch_finished(callback)
+    callback.assert_called_once_with()
+
+
+def test_stuck_state():
+    pod = _pod("a")
+    assert KubernetesBuildExecutor._stuck_state(pod) is None
+    pod["status"]["conditions"] = [
+        {
+            "type": "PodScheduled",
+            "status": "False",
+            "reason": "Unschedulable",
+            "message": "0/3 nodes are available",
+        }
+    ]
+    assert KubernetesBuildExecutor._stuck_state(pod) == (
+        "Unschedulable",
+        "0/3 nodes are available",
+    )
@@ -1,9 +1,11 @@
 """Test launcher"""
 
 import pytest
+from kubernetes import client
 from tornado import web
 
 from binderhub.launcher import Launcher
+from binderhub.node_images import NodeImageIndex
 
 
 async def my_pre_launch_hook(launcher, *args):
@@ -20,3 +22,24 @@ async def test_pre_launch_hook():
     assert excinfo.value.status_code == 400
     message = excinfo.value.log_message
     assert parameters == message.split(":", 1)[-1].lstrip().split(",")
+
+
+def test_node_affinity_for_image():
+    index = NodeImageIndex()
+    index.update(
+        [
+            client.V1Node(
+                metadata=client.V1ObjectMeta(name=name),
+                spec=client.V1NodeSpec(unschedulable=unschedulable),
+                status=client.V1NodeStatus(
+                    images=[client.V1ContainerImage(names=["docker.io/user/image:1"])]
+                ),
+            )
+            for name, unschedulable in [("b", False), ("a", False), ("c", True)]
+        ]
+    )
+    launcher = Launcher(node_image_index=index, image_locality_weight=10)
+    assert launcher.get_node_affinity("other/image:1") == []
+    (term,) = launcher.get_node_affinity("user/image:1")
+    assert term["weight"] == 10
+    assert term["preference"]["matchFields"][0]["values"] == ["a", "b"]
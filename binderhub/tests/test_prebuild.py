@@ -0,0 +1,238 @@
+"""Test prebuilds and the push webhooks starting them"""
+
+import asyncio
+import hashlib
+import hmac
+import json
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from unittest import mock
+
+import pytest
+from tornado.httpclient import HTTPClientError
+from tornado.httpserver import HTTPServer
+from tornado.simple_httpclient import SimpleAsyncHTTPClient
+from tornado.testing import bind_unused_port
+from tornado.web import Application
+from traitlets.config import Config
+
+from binderhub.build_registry import BuildRegistry
+from binderhub.handlers.webhooks import GitHubWebhookHandler, GitLabWebhookHandler
+from binderhub.prebuild import _prebuild_tasks, prebuild
+from binderhub.repoproviders import GitHubRepoProvider, GitLabRepoProvider
+from binderhub.warmer import ImageWarmer
+
+from .test_build_registry import GatedBuild
+
+SHA = "a" * 40
+
+
+class PrebuildTestBuild(GatedBuild):
+    release = threading.Event()
+
+
+class FakeRegistry:
+    def __init__(self, images=()):
+        self.images = set(images)
+
+    async def image_exists(self, image, tag):
+        return (image, tag) in self.images
+
+    async def get_credentials(self, image, tag):
+        return None
+
+    def mark_image_built(self, image, tag):
+        self.images.add((image, tag))
+
+
+@pytest.fixture
+def settings():
+    pool = ThreadPoolExecutor(2)
+    yield {
+        "image_prefix": "test-",
+        "use_registry": True,
+        "registry": FakeRegistry(),
+        "build_registry": BuildRegistry(),
+        "build_class": PrebuildTestBuild,
+        "build_pool": pool,
+        "traitlets_parent": None,
+    }
+    PrebuildTestBuild.release.set()
+    pool.shutdown(wait=False)
+
+
+def _provider(spec=f"owner/repo/{SHA}"):
+    provider = GitHubRepoProvider(spec=spec)
+    provider.resolved_ref = SHA
+    return provider
+
+
+async def test_prebuild(settings):
+    PrebuildTestBuild.release.clear()
+    assert await prebuild(settings, _provider()) == "started"
+    # requests for the same image join the build in progress
+    assert await prebuild(settings, _provider()) == "building"
+    assert len(settings["build_registry"].builds) == 1
+
+    PrebuildTestBuild.release.set()
+    await asyncio.wait_for(asyncio.gather(*_prebuild_tasks), timeout=10)
+    assert not settings["build_registry"].builds
+    assert await prebuild(settings, _provider()) == "exists"
+
+
+def test_warmer_specs(tmp_path):
+    specs_file = tmp_path / "specs.txt"
+    specs_file.write_text("# popular\ngh/owner/a/HEAD\n\ngh/owner/b/main\n")
+    warmer = ImageWarmer(
+        settings={}, specs=["gh/owner/b/main"], specs_file=str(specs_file)
+    )
+    assert warmer.get_specs() == ["gh/owner/b/main", "gh/owner/a/HEAD"]
+
+
+async def test_warmer(settings):
+    settings["repo_providers"] = {"gh": GitHubRepoProvider}
+    settings["traitlets_config"] = Config()
+    warmer = ImageWarmer(
+        settings=settings,
+        specs=[f"gh/owner/a/{SHA}", f"gh/owner/b/{SHA}", "nope/x"],
+        concurrency=1,
+    )
+    built = []
+
+    async def prebuild(settings, provider, source, wait):
+        built.append(provider.spec)
+        return "exists"
+
+    with mock.patch("binderhub.warmer.prebuild", prebuild):
+        await warmer.warm()
+    assert built == [f"owner/a/{SHA}", f"owner/b/{SHA}"]
+
+
+def _sign(secret, body):
+    return "sha256=" + hmac.new(secret.encode(), body, hashlib.sha256).hexdigest()
+
+
+@pytest.fixture
+async def webhook_url():
+    config = Config()
+    config.GitHubRepoProvider.prebuild_specs = ["^owner/repo/"]
+    config.GitLabRepoProvider.prebuild_specs = ["^group%2Fsub%2F"]
+    settings = {
+        "auth_enabled": False,
+        "github_webhook_secret": "gh-secret",
+        "gitlab_webhook_secret": "gl-secret",
+        "repo_providers": {"gh": GitHubRepoProvider, "gl": GitLabRepoProvider},
+        "traitlets_config": config,
+    }
+    app = Application(
+        [
+            (r"/webhooks/github", GitHubWebhookHandler),
+            (r"/webhooks/gitlab", GitLabWebhookHandler),
+        ],
+        **settings,
+    )
+    sock, port = bind_unused_port()
+    server = HTTPServer(app)
+    server.add_sockets([sock])
+    yield f"http://127.0.0.1:{port}/webhooks"
+    server.stop()
+
+
+async def _post(url, body, headers):
+    # the real client, not the mock recording responses
+    client = SimpleAsyncHTTPClient(force_instance=True)
+    try:
+        resp = await client.fetch(url, method="POST", body=body, headers=headers)
+    except HTTPClientError as e:
+        return e.code, None
+    finally:
+        client.close()
+    return resp.code, json.loads(resp.body)
+
+
+async def test_github_webhook(webhook_url):
+    body = json.dumps(
+        {
+            "ref": "refs/heads/main",
+            "after": SHA,
+            "repository": {"full_name": "owner/repo"},
+        }
+    ).encode()
+    headers = {"X-GitHub-Event": "push"}
+    with mock.patch(
+        "binderhub.handlers.webhooks.prebuild", return_value="started"
+    ) as prebuild:
+        code, _ = await _post(
+            webhook_url + "/github",
+            body,
+            dict(headers, **{"X-Hub-Signature-256": _sign("wrong", body)}),
+        )
+        assert code == 403
+        prebuild.assert_not_called()
+
+        code, reply = await _post(
+            webhook_url + "/github",
+            body,
+            dict(headers, **{"X-Hub-Signature-256": _sign("gh-secret", body)}),
+        )
+        assert code == 202
+        assert reply == {"status": "started"}
+        provider = prebuild.call_args[0][1]
+        assert provider.spec == f"owner/repo/{SHA}"
+        assert provider.resolved_ref == SHA
+
+
+async def test_github_webhook_not_allowed(webhook_url):
+    body = json.dumps(
+        {
+            "ref": "refs/heads/main",
+            "after": SHA,
+            "repository": {"full_name": "someone/else"},
+        }
+    ).encode()
+    headers = {
+        "X-GitHub-Event": "push",
+        "X-Hub-Signature-256": _sign("gh-secret", body),
+    }
+    with mock.patch("binderhub.handlers.webhooks.prebuild") as prebuild:
+        code, _ = await _post(webhook_url + "/github", body, headers)
+    assert code == 403
+    prebuild.assert_not_called()
+
+
+async def test_github_webhook_ping(webhook_url):
+    body = b"{}"
+    headers = {
+        "X-GitHub-Event": "ping",
+        "X-Hub-Signature-256": _sign("gh-secret", body),
+    }
+    code, reply = await _post(webhook_url + "/github", body, headers)
+    assert code == 200
+    assert reply == {"status": "pong"}
+
+
+async def test_gitlab_webhook(webhook_url):
+    body = json.dumps(
+        {
+            "checkout_sha": SHA,
+            "project": {"path_with_namespace": "group/sub/repo"},
+        }
+    ).encode()
+    headers = {"X-Gitlab-Event": "Push Hook"}
+    with mock.patch(
+        "binderhub.handlers.webhooks.prebuild", return_value="exists"
+    ) as prebuild:
+        code, _ = await _post(
+            webhook_url + "/gitlab", body, dict(headers, **{"X-Gitlab-Token": "x"})
+        )
+        assert code == 403
+
+        code, reply = await _post(
+            webhook_url + "/gitlab",
+            body,
+            dict(headers, **{"X-Gitlab-Token": "gl-secret"}),
+        )
+        assert code == 202
+        assert reply == {"status": "exists"}
+        provider = prebuild.call_args[0][1]
+        assert provider.spec == f"group%2Fsub%2Frepo/{SHA}"
@@ -0,0 +1,79 @@
+"""Test pre-pulling images onto nodes"""
+
+from unittest import mock
+
+from kubernetes import client
+
+from binderhub.prepull import ImagePrePuller
+
+IMAGE = "registry.example.com/binder-repo:abc"
+
+
+def _node(name, images=(), unschedulable=False, taints=None):
+    return client.V1Node(
+        metadata=client.V1ObjectMeta(name=name),
+        spec=client.V1NodeSpec(unschedulable=unschedulable, taints=taints),
+        status=client.V1NodeStatus(
+            images=[client.V1ContainerImage(names=[image]) for image in images]
+        ),
+    )
+
+
+def _kube(nodes):
+    kube = mock.Mock()
+    kube.list_node.return_value = client.V1NodeList(items=nodes)
+    kube.read_namespaced_pod.return_value = client.V1Pod(
+        status=client.V1PodStatus(phase="Succeeded")
+    )
+    return kube
+
+
+async def test_prepull_skips_nodes_with_image():
+    kube = _kube(
+        [
+            _node("has-image", images=[IMAGE]),
+            _node("cordoned", unschedulable=True),
+            _node(
+                "tainted",
+                taints=[client.V1Taint(key="gpu", value="true", effect="NoSchedule")],
+            ),
+            _node(
+                "new",
+                taints=[
+                    client.V1Taint(
+                        key="hub.jupyter.org/dedicated",
+                        value="user",
+                        effect="NoSchedule",
+                    ),
+                    client.V1Taint(key="preferred", effect="PreferNoSchedule"),
+                ],
+            ),
+        ]
+    )
+    prepuller = ImagePrePuller(
+        kube=kube, enabled=True, node_selector={"purpose": "user"}
+    )
+    await prepuller.prepull(IMAGE)
+
+    assert kube.list_node.call_args[1]["label_selector"] == "purpose=user"
+    assert kube.create_namespaced_pod.call_count == 1
+    pod = kube.create_namespaced_pod.call_args[0][1]
+    assert pod.spec.node_name == "new"
+    assert pod.spec.containers[0].image == IMAGE
+    # only what is configured is tolerated
+    assert [t.key for t in pod.spec.tolerations] == [
+        "hub.jupyter.org/dedicated",
+        "hub.jupyter.org_dedicated",
+    ]
+    # the pod is cleaned up once the image is pulled
+    assert kube.delete_namespaced_pod.call_args[0][0] == pod.metadata.name
+
+
+def test_popular_images():
+    prepuller = ImagePrePuller(kube=mock.Mock(), enabled=True, top_images=2)
+    for image in ["a", "b", "b", "c", "c", "c"]:
+        prepuller.record_launch(image)
+    assert prepuller.popular_images() == ["c", "b"]
+
+    prepuller.launch_window = -1
+    assert prepuller.popular_images() == []
@@ -6,6 +6,7 @@ from unittest import mock
 
 import pytest
 
+from binderhub.informer import PodInformer
 from binderhub.quota import KubernetesLaunchQuota, LaunchQuotaExceeded
 
 
@@ -92,3 +93,67 @@ async def test_kubernetes_quota_repo_exceeded(mock_pod_list_resp):
     assert excinfo.value.quota == 2
     assert excinfo.value.used == 2
     assert excinfo.value.status == "repo_quota"
+
+
+def _informer_from_resp(resp_future):
+    informer = PodInformer(namespace="ns", label_selector="component=singleuser-server")
+    pods = json.loads(resp_future.result().read())["items"]
+    for i, pod in enumerate(pods):
+        pod["metadata"] = {"name": f"pod-{i}"}
+    informer._handle_list({pod["metadata"]["name"]: pod for pod in pods})
+    return informer
+
+
+async def test_kubernetes_quota_informer(mock_pod_list_resp):
+    informer = _informer_from_resp(mock_pod_list_resp)
+    quota = KubernetesLaunchQuota(
+        api=mock.MagicMock(), executor=mock.MagicMock(), pod_informer=informer
+    )
+
+    r = await quota.check_repo_quota(
+        "example.org/test/kubernetes_quota", {"quota": 3}, "repo.url"
+    )
+    assert r.total == 3
+    assert r.matching == 2
+    quota.executor.submit.assert_not_called()
+
+    informer._handle_event("DELETED", informer.pods["pod-0"])
+    r = await quota.check_repo_quota(
+        "example.org/test/kubernetes_quota", {"quota": 3}, "repo.url"
+    )
+    assert r.total == 2
+    assert r.matching == 1
+
+
+async def test_kubernetes_quota_informer_unsynced(mock_pod_list_resp):
+    informer = PodInformer(namespace="ns", label_selector="component=singleuser-server")
+    quota = KubernetesLaunchQuota(
+        api=mock.MagicMock(), executor=mock.MagicMock(), pod_informer=informer
+    )
+    quota.executor.submit.return_value = mock_pod_list_resp
+
+    # e.g. on a freshly booted node
+    with mock.patch("time.monotonic", return_value=120):
+        r = await quota.check_repo_quota(
+            "example.org/test/kubernetes_quota", {"quota": 3}, "repo.url"
+        )
+    # not listed yet, counted from a full list
+    assert r.total == 3
+    assert r.matching == 2
+
+
+async def test_kubernetes_quota_informer_stale(mock_pod_list_resp):
+    informer = _informer_from_resp(mock_pod_list_resp)
+    informer.pods.clear()
+    informer.last_sync -= 1000
+    quota = KubernetesLaunchQuota(
+        api=mock.MagicMock(), executor=mock.MagicMock(), pod_informer=informer
+    )
+    quota.executor.submit.return_value = mock_pod_list_resp
+
+    r = await quota.check_repo_quota(
+        "example.org/test/kubernetes_quota", {"quota": 3}, "repo.url"
+    )
+    # counted from a full list
+    assert r.total == 3
+    assert r.matching == 2
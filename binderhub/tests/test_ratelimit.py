@@ -60,20 +60,113 @@ def test_rate_limit_clean():
     with mock.patch.object(r, "time", lambda: now + 30):
         limit2 = r.increment("4.3.2.1")
 
-    # force clean, shouldn't expire
-    r._last_cleaned = now - r.clean_seconds
+    # clean, shouldn't expire
     with mock.patch.object(r, "time", lambda: now + 35):
+        r.clean()
         limit2 = r.increment("4.3.2.1")
 
     assert "1.2.3.4" in r._limits
 
-    # force clean again, should expire
-    r._last_cleaned = now - r.clean_seconds
+    # clean again, should expire
     with mock.patch.object(r, "time", lambda: now + 65):
+        r.clean()
         limit2 = r.increment("4.3.2.1")
 
-    assert r._last_cleaned == now + 65
     assert "1.2.3.4" not in r._limits
     assert "4.3.2.1" in r._limits
     # 4.3.2.1 hasn't expired, still consuming rate limit
     assert limit2["remaining"] == 7
+
+
+def test_rate_limit_clean_incremental():
+    r = RateLimiter(limit=10, period_seconds=60, clean_batch_size=2)
+    now = r.time()
+    for i in range(5):
+        r.increment(f"1.2.3.{i}")
+
+    # only clean_batch_size limits are cleaned up per request
+    with mock.patch.object(r, "time", lambda: now + 65):
+        r.increment("4.3.2.1")
+        assert len(r._limits) == 4
+        r.increment("4.3.2.1")
+        r.increment("4.3.2.1")
+    assert list(r._limits) == ["4.3.2.1"]
+
+
+def test_rate_limit_custom_limit():
+    r = RateLimiter(limit=10, period_seconds=60)
+    limit = r.increment("user", limit=2)
+    assert limit["remaining"] == 1
+    r.increment("user", limit=2)
+    with pytest.raises(RateLimitExceeded):
+        r.increment("user", limit=2)
+
+
+def test_rate_limit_sliding_window():
+    r = RateLimiter(limit=10, period_seconds=60, algorithm="sliding_window")
+    now = int(r.time())
+    with mock.patch.object(r, "time", lambda: now):
+        for i in range(10):
+            limit = r.increment("1.2.3.4")
+        assert limit["remaining"] == 0
+        with pytest.raises(RateLimitExceeded):
+            r.increment("1.2.3.4")
+
+    # halfway through the next window,
+    # about half of the previous window still counts
+    with mock.patch.object(r, "time", lambda: now + 90):
+        limit = r.increment("1.2.3.4")
+    assert limit["remaining"] == 10 - 7
+
+    # two windows later, everything has expired
+    with mock.patch.object(r, "time", lambda: now + 185):
+        limit = r.increment("1.2.3.4")
+    assert limit["remaining"] == 9
+
+
+def test_rate_limit_token_bucket():
+    r = RateLimiter(limit=10, period_seconds=60, algorithm="token_bucket")
+    now = int(r.time())
+    with mock.patch.object(r, "time", lambda: now):
+        for i in range(10):
+            limit = r.increment("1.2.3.4")
+        assert limit == {"remaining": 0, "reset": now + 60}
+        # rejected requests don't push the next token further out
+        for i in range(3):
+            with pytest.raises(RateLimitExceeded) as excinfo:
+                r.increment("1.2.3.4")
+            assert excinfo.value.retry_after == 6
+
+    # one token every 6 seconds
+    with mock.patch.object(r, "time", lambda: now + 6):
+        limit = r.increment("1.2.3.4")
+    assert limit["remaining"] == 0
+    # three more tokens 18 seconds later
+    with mock.patch.object(r, "time", lambda: now + 24):
+        limit = r.increment("1.2.3.4")
+    assert limit["remaining"] == 2
+
+
+def test_rate_limit_retry_after():
+    r = RateLimiter(limit=1, period_seconds=60)
+    now = int(r.time())
+    with mock.patch.object(r, "time", lambda: now):
+        limit = r.increment("1.2.3.4")
+    with mock.patch.object(r, "time", lambda: now + 20):
+        with pytest.raises(RateLimitExceeded) as excinfo:
+            r.increment("1.2.3.4")
+    assert excinfo.value.retry_after == limit["reset"] - (now + 20)
+
+
+def test_rate_limit_no_full_clean_on_request():
+    r = RateLimiter(limit=10, period_seconds=60, clean_batch_size=2)
+    now = r.time()
+    for i in range(5):
+        r.increment(f"1.2.3.{i}")
+
+    # long after clean_seconds, requests still only clean up a batch
+    with mock.patch.object(r, "time", lambda: now + 10 * r.clean_seconds):
+        r.increment("4.3.2.1")
+        assert len(r._limits) == 4
+        r.clean()
+    assert list(r._limits) == ["4.3.2.1"]
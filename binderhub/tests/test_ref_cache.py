@@ -0,0 +1,68 @@
+"""Test caches of resolved refs"""
+
+from unittest import mock
+
+import pytest
+
+from binderhub.ref_cache import MemoryRefCache, SQLiteRefCache
+
+
+@pytest.fixture(params=["memory", "sqlite"])
+def make_cache(request, tmp_path):
+    def make_cache(**kwargs):
+        if request.param == "memory":
+            return MemoryRefCache(**kwargs)
+        return SQLiteRefCache(path=str(tmp_path / "refs.sqlite"), **kwargs)
+
+    return make_cache
+
+
+async def test_ref_cache_get_set(make_cache):
+    cache = make_cache(name="test")
+    assert await cache.get("a") is None
+    await cache.set("a", {"etag": "x", "sha": "abc"})
+    assert await cache.get("a") == {"etag": "x", "sha": "abc"}
+    # caches with different names don't share entries
+    other = make_cache(name="other")
+    assert await other.get("a") is None
+
+
+async def test_ref_cache_max_size(make_cache):
+    cache = make_cache(name="test", max_size=2)
+    with mock.patch("time.time", side_effect=[1, 2, 3]):
+        await cache.set("a", 1)
+        await cache.set("b", 2)
+        await cache.set("c", 3)
+    assert await cache.get("a") is None
+    assert await cache.get("b") == 2
+    assert await cache.get("c") == 3
+
+
+async def test_sqlite_ref_cache_max_age(tmp_path):
+    path = str(tmp_path / "refs.sqlite")
+    cache = SQLiteRefCache(path=path, name="test", max_age=10)
+    with mock.patch("time.time", return_value=100):
+        await cache.set("a", True)
+    with mock.patch("time.time", return_value=105):
+        assert await cache.get("a") is True
+    with mock.patch("time.time", return_value=111):
+        assert await cache.get("a") is None
+
+
+async def test_sqlite_ref_cache_persists(tmp_path):
+    path = str(tmp_path / "refs.sqlite")
+    await SQLiteRefCache(path=path, name="test").set("a", "abc")
+    # e.g. after a restart
+    assert await SQLiteRefCache(path=path, name="test").get("a") == "abc"
+
+
+async def test_sqlite_ref_cache_refresh(tmp_path):
+    cache = SQLiteRefCache(path=str(tmp_path / "refs.sqlite"), name="test")
+    await cache.set("a", "abc")
+    with mock.patch.object(cache, "_set") as _set:
+        # just written, no need to write it again
+        await cache.refresh("a", "abc")
+        _set.assert_not_called()
+        cache.refresh_interval = 0
+        await cache.refresh("a", "abc")
+        _set.assert_called_once_with("a", "abc")
@@ -1,9 +1,11 @@
 """Tests for the registry"""
 
+import asyncio
 import base64
 import json
 import secrets
 from random import randint
+from unittest import mock
 
 import pytest
 from tornado import httpclient
@@ -388,3 +390,84 @@ async def test_external_registry_helper_token(fake_external_registry):
     assert len(request_store) == 1
     assert request_store[0].method == "POST"
     assert request_store[0].uri == "/token/owner/my-repo:tag"
+
+
+async def test_image_exists_cache():
+    registry = DockerRegistry(url="https://registry.example.org")
+    with mock.patch.object(
+        registry, "get_image_manifest", return_value=None
+    ) as get_manifest:
+        assert not await registry.image_exists("myimage", "abc")
+        # missing images are remembered for a short time
+        assert not await registry.image_exists("myimage", "abc")
+        assert get_manifest.call_count == 1
+
+        # until the image is built
+        registry.mark_image_built("myimage", "abc")
+        assert await registry.image_exists("myimage", "abc")
+        assert get_manifest.call_count == 1
+
+        get_manifest.return_value = {"image": "other"}
+        assert await registry.image_exists("other", "abc")
+        assert await registry.image_exists("other", "abc")
+        assert get_manifest.call_count == 2
+
+
+async def test_latest_tag():
+    registry = DockerRegistry(url="https://registry.example.org")
+    assert registry.latest_tag("myimage") is None
+    with mock.patch.object(
+        registry, "get_image_manifest", return_value={"image": "myimage"}
+    ):
+        assert await registry.image_exists("myimage", "old")
+    assert registry.latest_tag("myimage") == "old"
+    registry.mark_image_built("myimage", "new")
+    assert registry.latest_tag("myimage") == "new"
+    # finding an older image doesn't make it the latest
+    with mock.patch.object(
+        registry, "get_image_manifest", return_value={"image": "myimage"}
+    ):
+        assert await registry.image_exists("myimage", "older")
+    assert registry.latest_tag("myimage") == "new"
+
+
+async def test_image_exists_no_cache():
+    registry = DockerRegistry(
+        url="https://registry.example.org",
+        manifest_cache_size=0,
+        manifest_negative_cache_ttl=0,
+    )
+    with mock.patch.object(
+        registry, "get_image_manifest", return_value={"image": "myimage"}
+    ) as get_manifest:
+        assert await registry.image_exists("myimage", "abc")
+        assert await registry.image_exists("myimage", "abc")
+        assert get_manifest.call_count == 2
+
+
+async def test_get_token_cache():
+    registry = DockerRegistry(url="https://registry.example.org")
+    client = httpclient.AsyncHTTPClient()
+    tokens = iter(["a", "b", "c"])
+
+    async def fetch_token(client, token_url, service, scope):
+        await asyncio.sleep(0)
+        return next(tokens), 300
+
+    with mock.patch.object(
+        registry, "_fetch_token", side_effect=fetch_token
+    ) as fetch, mock.patch("time.monotonic", return_value=1000):
+        # concurrent requests share a single fetch
+        assert await asyncio.gather(
+            registry._get_token(client, "https://t", "s", "scope1"),
+            registry._get_token(client, "https://t", "s", "scope1"),
+        ) == ["a", "a"]
+        assert await registry._get_token(client, "https://t", "s", "scope1") == "a"
+        assert fetch.call_count == 1
+        # tokens are per scope
+        assert await registry._get_token(client, "https://t", "s", "scope2") == "b"
+
+    # reused until shortly before they expire
+    with mock.patch("time.monotonic", return_value=1000 + 300 - 20):
+        with mock.patch.object(registry, "_fetch_token", side_effect=fetch_token):
+            assert await registry._get_token(client, "https://t", "s", "scope1") == "c"
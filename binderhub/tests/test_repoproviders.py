@@ -1,5 +1,6 @@
 import re
-from unittest import TestCase
+import time
+from unittest import TestCase, mock
 from urllib.parse import quote
 
 import pytest
@@ -520,6 +521,78 @@ def test_git_validate_url(url, unresolved_ref, expected):
     assert provider.repo == expected
 
 
+_LS_REMOTE_REFS = [
+    ("a" * 40, "HEAD"),
+    ("b" * 40, "refs/heads/feature/main"),
+    ("c" * 40, "refs/heads/main"),
+    ("d" * 40, "refs/tags/v1"),
+    ("e" * 40, "refs/tags/v1^{}"),
+]
+
+
+@pytest.fixture
+def clear_ls_remote_cache():
+    GitRepoProvider._ls_remote_cache.clear()
+    yield
+    GitRepoProvider._ls_remote_cache.clear()
+
+
+@pytest.mark.parametrize(
+    "unresolved_ref, resolved_ref",
+    [
+        ("HEAD", "a" * 40),
+        # first match in git's order, like `git ls-remote -- repo main`
+        ("main", "b" * 40),
+        ("heads/main", "c" * 40),
+        ("refs/heads/main", "c" * 40),
+        ("v1", "d" * 40),
+        ("nosuchref", None),
+    ],
+)
+async def test_git_ref_all_refs(clear_ls_remote_cache, unresolved_ref, resolved_ref):
+    url = "https://git.example.com/repo"
+    spec = "{}/{}".format(quote(url, safe=""), quote(unresolved_ref))
+    provider = GitRepoProvider(spec=spec, ls_remote_all_refs=True)
+    with mock.patch.object(
+        GitRepoProvider, "_ls_remote", return_value=_LS_REMOTE_REFS
+    ) as ls_remote:
+        assert await provider.get_resolved_ref() == resolved_ref
+        # other refs of the same repo come from the cache
+        provider = GitRepoProvider(
+            spec=quote(url, safe="") + "/v1", ls_remote_all_refs=True
+        )
+        assert await provider.get_resolved_ref() == "d" * 40
+    ls_remote.assert_called_once_with()
+
+
+async def test_git_ref_cache(clear_ls_remote_cache):
+    url = "https://git.example.com/repo"
+
+    def resolve(ref):
+        provider = GitRepoProvider(spec="{}/{}".format(quote(url, safe=""), ref))
+        return provider.get_resolved_ref()
+
+    with mock.patch.object(
+        GitRepoProvider, "_ls_remote", return_value=[("c" * 40, "refs/heads/main")]
+    ) as ls_remote:
+        assert await resolve("main") == "c" * 40
+        assert await resolve("main") == "c" * 40
+        ls_remote.assert_called_once_with("main")
+
+    # missing refs are cached too
+    with mock.patch.object(GitRepoProvider, "_ls_remote", return_value=[]) as ls_remote:
+        assert await resolve("nosuchref") is None
+        assert await resolve("nosuchref") is None
+        ls_remote.assert_called_once_with("nosuchref")
+
+    # expired
+    with mock.patch("time.monotonic", return_value=time.monotonic() + 3600):
+        with mock.patch.object(
+            GitRepoProvider, "_ls_remote", return_value=[("f" * 40, "refs/heads/main")]
+        ) as ls_remote:
+            assert await resolve("main") == "f" * 40
+
+
 @pytest.mark.parametrize(
     "unresolved_ref, resolved_ref",
     [
@@ -1,3 +1,4 @@
+import asyncio
 import ipaddress
 from unittest import mock
 
@@ -29,6 +30,25 @@ def test_rendezvous_independence():
     assert eighty_buckets == hundred_buckets
 
 
+def test_bounded_load_rank():
+    key = "hot repo"
+    buckets = ["b1", "b2", "b3"]
+    ranked = utils.rendezvous_rank(buckets, key)
+    # without load, same as rendezvous hashing
+    assert utils.bounded_load_rank(buckets, key, {}) == ranked
+    # small imbalances don't move keys
+    loads = {ranked[0]: 2, ranked[1]: 1, ranked[2]: 1}
+    assert utils.bounded_load_rank(buckets, key, loads) == ranked
+    # overloaded buckets go last, keeping the order of the others
+    loads = {ranked[0]: 6, ranked[1]: 1, ranked[2]: 1}
+    assert utils.bounded_load_rank(buckets, key, loads, epsilon=0.25) == [
+        ranked[1],
+        ranked[2],
+        ranked[0],
+    ]
+    assert utils.bounded_load_rank([], key, {}) == []
+
+
 def test_rendezvous_redistribution():
     # check that approximately a third of keys move to the new bucket
     # when one is added
@@ -127,3 +147,42 @@ def test_ip_in_networks(ip, cidrs, found):
         assert str(match) in cidrs
     else:
         assert match is False
+
+
+async def test_single_flight():
+    flights = utils.SingleFlight()
+    calls = []
+    release = asyncio.Event()
+
+    async def resolve(value):
+        calls.append(value)
+        await release.wait()
+        return value
+
+    tasks = [
+        asyncio.ensure_future(flights.run("key", resolve, i)) for i in range(3)
+    ]
+    await asyncio.sleep(0)
+    assert flights.in_flight("key")
+    release.set()
+    results = await asyncio.gather(*tasks)
+    assert calls == [0]
+    assert results == [(0, False), (0, True), (0, True)]
+    assert not flights.in_flight("key")
+
+    # a new call after the first one finished calls again
+    assert await flights.run("key", resolve, 4) == (4, False)
+    assert calls == [0, 4]
+
+
+async def test_single_flight_error():
+    flights = utils.SingleFlight()
+
+    async def fail():
+        await asyncio.sleep(0)
+        raise ValueError("nope")
+
+    tasks = [asyncio.ensure_future(flights.run("key", fail)) for i in range(2)]
+    results = await asyncio.gather(*tasks, return_exceptions=True)
+    assert all(isinstance(r, ValueError) for r in results)
+    assert not flights.in_flight("key")
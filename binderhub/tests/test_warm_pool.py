@@ -0,0 +1,159 @@
+"""Test the pool of idle servers"""
+
+import asyncio
+
+from tornado.httpclient import HTTPError
+
+from binderhub.quota import LaunchQuota, LaunchQuotaExceeded
+from binderhub.warm_pool import WarmPool
+
+IMAGE = "registry.example.com/binder-repo:abc"
+REPO = "https://github.com/owner/repo"
+
+
+class FakeLauncher:
+    def __init__(self):
+        self.users = {}
+        self.deleted = []
+        self.count = 0
+
+    def unique_name_from_repo(self, repo_url):
+        self.count += 1
+        return f"user-{self.count}"
+
+    async def launch(self, image, username, repo_url, extra_args):
+        self.users[username] = extra_args
+        return {"url": f"http://hub/user/{username}/", "image": image}
+
+    async def get_user_data(self, username):
+        if username not in self.users:
+            raise HTTPError(404)
+        return {"servers": {"": {"ready": self.users[username] is not False}}}
+
+    async def delete_user(self, username):
+        self.users.pop(username, None)
+        self.deleted.append(username)
+
+
+async def _settle(pool):
+    while pool._tasks:
+        await asyncio.gather(*pool._tasks)
+
+
+async def test_claim():
+    launcher = FakeLauncher()
+    pool = WarmPool(launcher=launcher, images=[IMAGE.rsplit(":", 1)[0]], min_size=2)
+    # nothing to claim before the first launch
+    assert await pool.claim(IMAGE, REPO) is None
+    assert pool.target_size(IMAGE) == 2
+    pool.replenish()
+    await _settle(pool)
+    assert sorted(launcher.users) == ["user-1", "user-2"]
+
+    # stale servers are skipped
+    launcher.users["user-2"] = False
+    server_info = await pool.claim(IMAGE, REPO)
+    assert server_info["url"] == "http://hub/user/user-1/"
+    await _settle(pool)
+    assert launcher.deleted == ["user-2"]
+    assert await pool.claim(IMAGE, REPO) is None
+
+    # images not in the pool are launched as usual
+    assert await pool.claim("other:abc", REPO) is None
+    assert pool.target_size("other:abc") == 0
+
+
+async def test_new_tag_retires_servers():
+    launcher = FakeLauncher()
+    pool = WarmPool(launcher=launcher, images=[IMAGE.rsplit(":", 1)[0]], min_size=1)
+    await pool.claim(IMAGE, REPO)
+    pool.replenish()
+    await _settle(pool)
+    assert list(launcher.users) == ["user-1"]
+
+    new_image = IMAGE.replace(":abc", ":def")
+    await pool.claim(new_image, REPO)
+    pool.replenish()
+    await _settle(pool)
+    assert launcher.deleted == ["user-1"]
+    assert list(launcher.users) == ["user-2"]
+    assert [image for image, _ in pool._idle] == [new_image]
+
+
+async def test_claim_matches_launch_options():
+    launcher = FakeLauncher()
+    pool = WarmPool(launcher=launcher, images=[IMAGE.rsplit(":", 1)[0]], min_size=1)
+    extra_args = {
+        "environment": {"BINDER_REPO_URL": REPO},
+        "volumes": [{"name": "mount1"}],
+    }
+    await pool.claim(IMAGE, REPO, extra_args)
+    pool.replenish()
+    await _settle(pool)
+    # servers are started like the last launch
+    assert launcher.users["user-1"] == extra_args
+
+    # and only claimed by launches with the same options
+    assert await pool.claim(IMAGE, REPO, {"environment": {}}) is None
+    server_info = await pool.claim(IMAGE, REPO, dict(extra_args))
+    assert server_info["url"] == "http://hub/user/user-1/"
+
+
+async def test_claim_ignores_request_environment():
+    launcher = FakeLauncher()
+    pool = WarmPool(launcher=launcher, images=[IMAGE.rsplit(":", 1)[0]], min_size=1)
+
+    def launch_args(spec):
+        return {
+            "environment": {"BINDER_REQUEST": f"v2/gh/{spec}"},
+            "extra_annotations": {"binder.jupyter.org/spec": spec},
+            "volumes": [{"name": "mount1"}],
+        }
+
+    await pool.claim(IMAGE, REPO, launch_args("owner/repo/main"))
+    pool.replenish()
+    await _settle(pool)
+    assert list(launcher.users) == ["user-1"]
+
+    # launches of other specs of the same image don't retire the pool
+    for spec in ["owner/repo/abc", "owner/repo/main"] * 2:
+        pool.record_launch(IMAGE, REPO, launch_args(spec))
+        pool.replenish()
+        await _settle(pool)
+    assert launcher.deleted == []
+    server_info = await pool.claim(IMAGE, REPO, launch_args("owner/repo/abc"))
+    assert server_info["url"] == "http://hub/user/user-1/"
+
+
+class FullQuota(LaunchQuota):
+    async def check_repo_quota(self, image_name, repo_config, repo_url):
+        raise LaunchQuotaExceeded("full", quota=1, used=1, status="pod_quota")
+
+
+async def test_spawn_respects_quota():
+    launcher = FakeLauncher()
+    pool = WarmPool(
+        launcher=launcher,
+        launch_quota=FullQuota(),
+        images=[IMAGE.rsplit(":", 1)[0]],
+        min_size=1,
+    )
+    await pool.claim(IMAGE, REPO)
+    pool.replenish()
+    await _settle(pool)
+    assert launcher.users == {}
+    assert not pool._idle
+    # tried again later
+    assert sum(pool._spawning.values()) == 0
+
+
+def test_target_size():
+    pool = WarmPool(images=[IMAGE.rsplit(":", 1)[0]], max_size=3, launch_window=60)
+    pool.mean_spawn_time = 30
+    for _ in range(4):
+        pool.record_launch(IMAGE, REPO)
+    # 4 launches per minute, 2 while a server starts
+    assert pool.target_size(IMAGE) == 2
+    for _ in range(10):
+        pool.record_launch(IMAGE, REPO)
+    assert pool.target_size(IMAGE) == 3
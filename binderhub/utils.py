@@ -1,6 +1,8 @@
 """Miscellaneous utilities"""
 
+import asyncio
 import ipaddress
+import math
 import time
 from collections import OrderedDict
 from hashlib import blake2b
@@ -45,6 +47,26 @@ def rendezvous_rank(buckets, key):
     return [b for (s, b) in sorted(ranking, reverse=True)]
 
 
+def bounded_load_rank(buckets, key, loads, epsilon=0.25):
+    """Rank the buckets for a given key using Rendez-vous hashing with bounded loads
+
+    Like `rendezvous_rank`, but buckets that are already loaded with more than
+    (1 + epsilon) times the average load, counting the new item,
+    are moved after the others.
+    `loads` maps buckets to their current load, missing buckets have no load.
+    This keeps most keys on their first choice, without piling hot keys onto one bucket.
+    """
+    ranked = rendezvous_rank(buckets, key)
+    if not ranked:
+        return ranked
+    total = sum(loads.get(bucket, 0) for bucket in ranked) + 1
+    # at least one bucket is always below the capacity
+    capacity = math.ceil((1 + epsilon) * total / len(ranked))
+    available = [bucket for bucket in ranked if loads.get(bucket, 0) < capacity]
+    full = [bucket for bucket in ranked if loads.get(bucket, 0) >= capacity]
+    return available + full
+
+
 class ByteSpecification(Integer):
     """
     Allow easily specifying bytes in units of 1024 with suffixes
@@ -145,6 +167,37 @@ class Cache(OrderedDict):
         return result
 
 
+class SingleFlight:
+    """Share the result of concurrent calls with the same key
+
+    While a call for a key is in progress,
+    further calls with the same key wait for its result
+    instead of starting their own.
+    """
+
+    def __init__(self):
+        self._futures = {}
+
+    def in_flight(self, key):
+        """Whether a call for `key` is in progress"""
+        return key in self._futures
+
+    async def run(self, key, f, *args, **kwargs):
+        """Await `f(*args, **kwargs)`, or the call already in progress for `key`
+
+        Returns a tuple (result, shared),
+        where `shared` is True if the result came from a call started by someone else.
+        """
+        if key in self._futures:
+            return await asyncio.shield(self._futures[key]), True
+
+        future = asyncio.ensure_future(f(*args, **kwargs))
+        self._futures[key] = future
+        future.add_done_callback(lambda _: self._futures.pop(key, None))
+        # shield the shared call from the cancellation of the first caller
+        return await asyncio.shield(future), False
+
+
 def url_path_join(*pieces):
     """Join components of url into a relative url.
 
@@ -0,0 +1,323 @@
+"""
+Pool of idle servers, started ahead of launches.
+
+Launching a cached image still means creating a temporary user,
+starting the server and waiting for its pod to be scheduled and ready.
+In anonymous mode, the WarmPool keeps servers of selected images running,
+each held by its own temporary user,
+so that a launch can claim one and return its URL right away.
+The pool is replenished in the background,
+sized from the recent launch rate of each image.
+"""
+
+import asyncio
+import json
+import math
+import time
+from collections import defaultdict, deque
+from urllib.parse import quote
+
+from prometheus_client import Counter, Gauge
+from tornado.httpclient import HTTPError
+from traitlets import Any, Integer, List, Unicode
+from traitlets.config import LoggingConfigurable
+
+from .quota import LaunchQuotaExceeded
+
+WARM_POOL_CLAIMS = Counter(
+    "binderhub_warm_pool_claims",
+    "Counter of launches claiming a server from the warm pool, by outcome",
+    ["status"],
+)
+WARM_POOL_SPAWNS = Counter(
+    "binderhub_warm_pool_spawns",
+    "Counter of servers started for the warm pool, by outcome",
+    ["status"],
+)
+WARM_POOL_IDLE = Gauge(
+    "binderhub_warm_pool_idle_servers", "Idle servers in the warm pool"
+)
+
+
+class WarmPool(LoggingConfigurable):
+    """Keep idle servers of selected images, for launches to claim
+
+    Call `claim(image, repo_url, extra_args)` on every launch,
+    and run `run()` to keep the pool replenished.
+    Only for anonymous mode, where servers belong to temporary users.
+    """
+
+    launcher = Any(help="The Launcher starting the servers")
+
+    launch_quota = Any(
+        None,
+        allow_none=True,
+        help="The LaunchQuota checked before starting a server, None for no quota",
+    )
+
+    images = List(
+        Unicode(),
+        config=True,
+        help="""
+        Images for which to keep idle servers, without their tag,
+        e.g. `gcr.io/binder/r2d-g5b5b759-binder-2dexamples-2drequirements-55ab5c`.
+
+        Servers are started for the tag launched last,
+        with the repo, environment and launch options of that launch,
+        and are claimed by launches with the same launch options.
+        Their environment and annotations are those of the launch they were started for,
+        e.g. `BINDER_REQUEST` may be another spec of the same image,
+        and `BINDER_CLIENT_IP` is empty.
+        Warm servers count towards launch quotas like any other server,
+        and are not started when that would exceed a quota.
+        """,
+    )
+
+    min_size = Integer(
+        0,
+        config=True,
+        help="Idle servers to keep for each image launched within `launch_window`",
+    )
+
+    max_size = Integer(
+        5,
+        config=True,
+        help="Maximum number of idle servers to keep for each image",
+    )
+
+    launch_window = Integer(
+        600,
+        config=True,
+        help="""
+        Time (in seconds) over which launches are counted to size the pool.
+
+        Each image keeps about as many idle servers as it gets launches
+        while a server starts.
+        """,
+    )
+
+    max_age = Integer(
+        1800,
+        config=True,
+        help="""
+        Time (in seconds) after which idle servers are replaced.
+
+        Keep it below the timeout of the idle culler,
+        so that warm servers are not culled before they are claimed.
+        """,
+    )
+
+    interval = Integer(
+        15,
+        config=True,
+        help="Time (in seconds) between checks of the size of the pool",
+    )
+
+    def __init__(self, **kwargs):
+        super().__init__(**kwargs)
+        # pool key -> deque of (time started, username, server info), oldest first
+        self._idle = defaultdict(deque)
+        # pool key -> servers being started
+        self._spawning = defaultdict(int)
+        # image name without tag -> (image name, repo url, extra args, repo config)
+        # of the last launch
+        self._latest = {}
+        # (time, image name) of recent launches
+        self._launches = deque()
+        # average time to start a server, updated as servers are started
+        self.mean_spawn_time = 60
+        self._wakeup = asyncio.Event()
+        self._tasks = set()
+
+    @property
+    def enabled(self):
+        return bool(self.images)
+
+    def _update_idle_gauge(self):
+        WARM_POOL_IDLE.set(sum(len(servers) for servers in self._idle.values()))
+
+    # extra_args set for each request, not part of the pool key
+    _request_args = ("environment", "extra_annotations")
+
+    @classmethod
+    def _pool_key(cls, image, extra_args):
+        """Servers are only interchangeable if they were launched with the same options"""
+        options = {k: v for k, v in extra_args.items() if k not in cls._request_args}
+        return (image, json.dumps(options, sort_keys=True, default=str))
+
+    def record_launch(self, image, repo_url, extra_args=None, repo_config=None):
+        """Count a launch of `image`, to size the pool
+
+        `repo_config` is checked against the launch quota
+        when starting servers like this launch.
+        """
+        image_no_tag = image.rsplit(":", 1)[0]
+        if image_no_tag not in self.images:
+            return
+        self._launches.append((time.monotonic(), image))
+        self._latest[image_no_tag] = (
+            image,
+            repo_url,
+            extra_args or {},
+            repo_config or {},
+        )
+
+    def target_size(self, image):
+        """The number of idle servers to keep for `image`"""
+        cutoff = time.monotonic() - self.launch_window
+        while self._launches and self._launches[0][0] < cutoff:
+            self._launches.popleft()
+        launches = sum(1 for _, launched in self._launches if launched == image)
+        if not launches:
+            return 0
+        # the launches expected while a replacement server starts
+        size = math.ceil(launches / self.launch_window * self.mean_spawn_time)
+        return min(max(size, self.min_size), self.max_size)
+
+    async def _is_ready(self, username):
+        try:
+            user = await self.launcher.get_user_data(quote(username, safe="@~"))
+        except HTTPError as e:
+            if e.code == 404:
+                # culled, or deleted by someone else
+                return False
+            raise
+        server = user.get("servers", {}).get("")
+        return bool(server and server.get("ready"))
+
+    async def claim(self, image, repo_url, extra_args=None, repo_config=None):
+        """Claim an idle server of `image`, for a launch of `repo_url`
+
+        Only servers launched with the same `extra_args`,
+        apart from their environment and annotations, are claimed.
+
+        Returns the server info of the claimed server, as returned by
+        `Launcher.launch`, or None if there is no idle server.
+        """
+        self.record_launch(image, repo_url, extra_args, repo_config)
+        servers = self._idle.get(self._pool_key(image, extra_args or {}))
+        try:
+            while servers:
+                # newest first, the least likely to have been culled
+                _, username, server_info = servers.pop()
+                self._update_idle_gauge()
+                try:
+                    ready = await self._is_ready(username)
+                except Exception:
+                    self.log.exception("Failed to check warm server of %s", username)
+                    ready = False
+                if ready:
+                    self.log.info("Claimed warm server %s for %s", username, image)
+                    WARM_POOL_CLAIMS.labels(status="hit").inc()
+                    return server_info
+                WARM_POOL_CLAIMS.labels(status="stale").inc()
+                self._delete(username)
+            WARM_POOL_CLAIMS.labels(status="miss").inc()
+            return None
+        finally:
+            # replace the claimed server
+            self._wakeup.set()
+
+    def _spawn_task(self, coro):
+        task = asyncio.ensure_future(coro)
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+
+    def _delete(self, username):
+        async def delete():
+            try:
+                await self.launcher.delete_user(username)
+            except HTTPError as e:
+                if e.code != 404:
+                    self.log.error("Failed to delete warm server %s: %s", username, e)
+            except Exception:
+                self.log.exception("Failed to delete warm server %s", username)
+
+        self._spawn_task(delete())
+
+    async def _spawn(self, image, repo_url, extra_args, repo_config):
+        key = self._pool_key(image, extra_args)
+        try:
+            server_info = await self._launch(image, repo_url, extra_args, repo_config)
+        finally:
+            self._spawning[key] -= 1
+        if server_info is not None:
+            self._idle[key].append(server_info)
+            self._update_idle_gauge()
+
+    async def _launch(self, image, repo_url, extra_args, repo_config):
+        """Start a server, unless it would exceed the launch quota
+
+        Returns (time started, username, server info), or None.
+        """
+        if self.launch_quota is not None:
+            try:
+                await self.launch_quota.check_repo_quota(image, repo_config, repo_url)
+            except LaunchQuotaExceeded as e:
+                self.log.info("Not starting warm server for %s: %s", image, e.message)
+                WARM_POOL_SPAWNS.labels(status="quota").inc()
+                return None
+        username = self.launcher.unique_name_from_repo(repo_url)
+        self.log.info("Starting warm server %s for %s", username, image)
+        start = time.perf_counter()
+        try:
+            server_info = await self.launcher.launch(
+                image=image,
+                username=username,
+                repo_url=repo_url,
+                extra_args=extra_args,
+            )
+        except Exception:
+            self.log.exception("Failed to start warm server for %s", image)
+            WARM_POOL_SPAWNS.labels(status="failure").inc()
+            self._delete(username)
+            return None
+        WARM_POOL_SPAWNS.labels(status="success").inc()
+        self.mean_spawn_time += 0.1 * (
+            time.perf_counter() - start - self.mean_spawn_time
+        )
+        return (time.monotonic(), username, server_info)
+
+    def replenish(self):
+        """Retire stale idle servers and start the missing ones"""
+        latest_keys = {
+            self._pool_key(image, extra_args)
+            for image, _, extra_args, _ in self._latest.values()
+        }
+        retire_before = time.monotonic() - self.max_age
+        for key, servers in list(self._idle.items()):
+            image = key[0]
+            # servers of previous tags or launch options are retired,
+            # as are servers in excess
+            target = self.target_size(image) if key in latest_keys else 0
+            while servers and (servers[0][0] < retire_before or len(servers) > target):
+                _, username, _ = servers.popleft()
+                self.log.info("Retiring warm server %s of %s", username, image)
+                self._delete(username)
+            if not servers:
+                self._idle.pop(key)
+        self._update_idle_gauge()
+
+        for image, repo_url, extra_args, repo_config in self._latest.values():
+            key = self._pool_key(image, extra_args)
+            missing = (
+                self.target_size(image)
+                - len(self._idle.get(key, ()))
+                - self._spawning[key]
+            )
+            for _ in range(missing):
+                self._spawning[key] += 1
+                self._spawn_task(self._spawn(image, repo_url, extra_args, repo_config))
+
+    async def run(self):
+        """Replenish the pool every `interval` seconds, and after every claim"""
+        while True:
+            try:
+                self.replenish()
+            except Exception:
+                self.log.exception("Failed to replenish the warm pool")
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), self.interval)
+            except asyncio.TimeoutError:
+                pass
+            self._wakeup.clear()
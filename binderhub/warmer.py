@@ -0,0 +1,136 @@
+"""
+Keep the images of popular specs built.
+
+The ImageWarmer periodically resolves a list of specs
+and prebuilds the images that are missing,
+so that moving refs like HEAD are rebuilt shortly after they change,
+instead of on the first launch.
+"""
+
+import asyncio
+
+from prometheus_client import Gauge, Histogram
+from traitlets import Integer, List, Unicode
+from traitlets.config import LoggingConfigurable
+
+from .prebuild import PREBUILD_COUNT, prebuild
+
+WARMER_RUN_TIME = Histogram(
+    "binderhub_warmer_run_duration_seconds",
+    "Histogram of the time to check and build all specs of the image warmer",
+    buckets=[10, 60, 300, 900, 1800, 3600, 7200, float("inf")],
+)
+WARMER_INPROGRESS = Gauge(
+    "binderhub_warmer_inprogress_specs",
+    "Specs the image warmer is currently checking or building",
+)
+
+
+class ImageWarmer(LoggingConfigurable):
+    """Periodically prebuild the images of a list of specs"""
+
+    specs = List(
+        Unicode(),
+        config=True,
+        help="""
+        Specs to keep built, as `<provider prefix>/<spec>`,
+        e.g. `gh/binder-examples/requirements/HEAD`.
+        """,
+    )
+
+    specs_file = Unicode(
+        "",
+        config=True,
+        help="""
+        File with specs to keep built, one per line, in addition to `specs`.
+
+        Empty lines and lines starting with # are ignored.
+        The file is read again on every run, so it can be updated without restarting.
+        """,
+    )
+
+    interval = Integer(
+        600,
+        config=True,
+        help="Time (in seconds) between checks of the specs",
+    )
+
+    concurrency = Integer(
+        2,
+        config=True,
+        help="""
+        The number of specs to check and build at the same time.
+
+        Builds of the warmer also wait in the build queue like any other build,
+        behind the builds of users.
+        """,
+    )
+
+    def __init__(self, settings, **kwargs):
+        super().__init__(**kwargs)
+        # the tornado settings of the application
+        self.settings = settings
+
+    @property
+    def enabled(self):
+        return bool(self.specs or self.specs_file)
+
+    def get_specs(self):
+        """The specs to keep built"""
+        specs = list(self.specs)
+        if self.specs_file:
+            try:
+                with open(self.specs_file) as f:
+                    for line in f:
+                        line = line.strip()
+                        if line and not line.startswith("#"):
+                            specs.append(line)
+            except OSError:
+                self.log.exception("Failed to read specs from %s", self.specs_file)
+        # remove duplicates, keeping the order
+        return list(dict.fromkeys(specs))
+
+    async def warm_spec(self, spec):
+        """Build the image of one spec, if it is missing"""
+        provider_prefix, _, provider_spec = spec.partition("/")
+        providers = self.settings["repo_providers"]
+        if provider_prefix not in providers or not provider_spec:
+            self.log.error("Invalid spec for image warmer: %s", spec)
+            PREBUILD_COUNT.labels(source="warmer", status="error").inc()
+            return
+        try:
+            provider = providers[provider_prefix](
+                config=self.settings["traitlets_config"], spec=provider_spec
+            )
+            if provider.is_banned():
+                self.log.warning("Not warming banned spec %s", spec)
+                return
+            status = await prebuild(self.settings, provider, source="warmer", wait=True)
+        except Exception:
+            self.log.exception("Failed to warm image of %s", spec)
+            PREBUILD_COUNT.labels(source="warmer", status="error").inc()
+        else:
+            self.log.debug("Image warmer %s: %s", spec, status)
+
+    async def warm(self):
+        """Check all specs once, building missing images"""
+        semaphore = asyncio.Semaphore(self.concurrency)
+
+        async def warm_spec(spec):
+            async with semaphore:
+                with WARMER_INPROGRESS.track_inprogress():
+                    await self.warm_spec(spec)
+
+        specs = self.get_specs()
+        self.log.info("Image warmer checking %i specs", len(specs))
+        with WARMER_RUN_TIME.time():
+            await asyncio.gather(*(warm_spec(spec) for spec in specs))
+
+    async def run(self):
+        """Check the specs every `interval` seconds"""
+        while True:
+            try:
+                await self.warm()
+            except Exception:
+                self.log.exception("Image warmer failed")
+            await asyncio.sleep(self.interval)